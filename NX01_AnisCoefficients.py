@@ -8,7 +8,8 @@ Code contributions by Rutger van Haasteren (piccard), Justin Ellis (PAL/PAL2), a
 """
 
 from __future__ import division
-import math
+import os, math, hashlib
+import multiprocessing
 import numpy as np
 from math import factorial, sqrt, sin, cos, tan, acos, atan, pi, log
 from cmath import exp
@@ -17,32 +18,25 @@ from scipy.integrate import quad, dblquad
 from scipy import special as sp
 import random
 
+import NX01_utils as utils
+
 norm = 3./(8*pi)
 c00 = sqrt(4*pi)
 
 def calczeta(phi1, phi2, theta1, theta2):
     """
     Calculate the angular separation between position (phi1, theta1) and
-    (phi2, theta2)
+    (phi2, theta2). Accepts scalars or arrays of positions.
     
     """
-    
-    zeta = 0.0
-    
-    if phi1 == phi2 and theta1 == theta2:
-        zeta = 0.0
-    else:
-        argument = sin(theta1)*sin(theta2)*cos(phi1-phi2) + \
-          cos(theta1)*cos(theta2)
-          
-        if argument < -1:
-            zeta = np.pi
-        elif argument > 1:
-            zeta = 0.0
-        else:
-            zeta = acos(argument)
-    
-    return zeta
+
+    phi1, phi2, theta1, theta2 = np.broadcast_arrays(phi1, phi2, theta1, theta2)
+
+    argument = np.sin(theta1)*np.sin(theta2)*np.cos(phi1-phi2) + \
+      np.cos(theta1)*np.cos(theta2)
+    zeta = np.arccos(np.clip(argument, -1.0, 1.0))
+
+    return np.where((phi1 == phi2) & (theta1 == theta2), 0.0, zeta)
 
 
 """
@@ -51,123 +45,133 @@ Following functions taken from Gair et. al (2014),
 involving solutions of integrals to define the ORF for an
 arbitrarily anisotropic GW background.
 
+Every Fminus/Fplus integral is a finite sum of terms
+c_k * (2^p_k - x^p_k), with x = 1 +/- cos(zeta). The coefficient
+tables (c_k, p_k) only depend on (q, m, l), so they are computed once
+and the integrals are then evaluated for arrays of zeta.
+
 """
 
+_gair_tables = {}
 
-def Fminus00(qq, mm,ll,zeta):
+def gair_coeffs(kind, qq, mm, ll):
+    """
+    Coefficients and powers of the Gair et al. integral of this kind
+    ('minus00', 'minus01', 'plus00' or 'plus01') for (q, m, l).
     
-    integrand = 0.
+    """
+
+    key = (kind, qq, mm, ll)
+    if key not in _gair_tables:
+
+        shift = {'minus00': 1, 'minus01': 2, 'plus00': 1, 'plus01': 0}[kind]
+        imax = qq if kind == 'plus01' else qq+1
+
+        coeffs = []
+        powers = []
+        for ii in range(0,imax):
+            for jj in range(mm,ll+1):
+
+                pw = qq-ii+jj-mm+shift
+                if kind.startswith('minus'):
+                    sign = (-1.)**(qq-ii+jj+mm)
+                else:
+                    sign = (-1.)**(ll+qq-ii+jj)
+
+                coeffs.append( 2.0**(ii-jj) * sign * factorial(qq)*factorial(ll+jj) / \
+                               ( factorial(ii)*factorial(qq-ii)*factorial(jj)*
+                                 factorial(ll-jj)*factorial(jj-mm)*pw ) )
+                powers.append(pw)
+
+        if kind == 'plus01':
+            for jj in range(mm+1,ll+1):
+                coeffs.append( 2.0**(qq-jj) * (-1.)**(ll+jj) * factorial(ll+jj) / \
+                               ( factorial(jj)*factorial(ll-jj)*factorial(jj-mm)*(jj-mm) ) )
+                powers.append(jj-mm)
+
+        _gair_tables[key] = (np.array(coeffs), np.array(powers, dtype=float))
+
+    return _gair_tables[key]
+
+
+def gair_sum(kind, qq, mm, ll, xx):
+    """
+    Evaluate sum_k c_k * (2^p_k - x^p_k) for an array of x.
     
-    for ii in range(0,qq+1):
-        for jj in range(mm,ll+1):
-            
-            integrand += ( 2.0**(ii-jj) * (-1.)**(qq-ii+jj+mm) ) * \
-                ( factorial(qq)*factorial(ll+jj) * ( 2.0**(qq-ii+jj-mm+1) - (1.0+cos(zeta))**(qq-ii+jj-mm+1) ) ) / \
-                ( factorial(ii)*factorial(qq-ii)*factorial(jj)*factorial(ll-jj)*factorial(jj-mm)*(qq-ii+jj-mm+1) )
+    """
+
+    coeffs, powers = gair_coeffs(kind, qq, mm, ll)
+    xx = np.asarray(xx, dtype=float)
+
+    if len(coeffs) == 0:
+        return np.zeros(xx.shape)
 
-    return integrand
+    return np.dot(2.0**powers - np.power.outer(xx, powers), coeffs)
+
+
+def Fminus00(qq, mm,ll,zeta):
+
+    return gair_sum('minus00', qq, mm, ll, 1.0+np.cos(zeta))
 
 
 def Fminus01(qq, mm,ll,zeta):
-    
-    integrand = 0.
-    
-    for ii in range(0,qq+1):
-        for jj in range(mm,ll+1):
-            
-            integrand += ( 2.0**(ii-jj) * (-1.)**(qq-ii+jj+mm) ) * \
-              ( factorial(qq)*factorial(ll+jj) * ( 2.0**(qq-ii+jj-mm+2) - (1.0+cos(zeta))**(qq-ii+jj-mm+2) ) ) / \
-              ( factorial(ii)*factorial(qq-ii)*factorial(jj)*factorial(ll-jj)*factorial(jj-mm)*(qq-ii+jj-mm+2) )
 
-    return integrand
+    return gair_sum('minus01', qq, mm, ll, 1.0+np.cos(zeta))
 
 
 def Fplus01(qq, mm,ll,zeta):
-    
-    integrand = 0.
-    
-    for ii in range(0,qq):
-        for jj in range(mm,ll+1):
-            integrand += ( 2.0**(ii-jj) * (-1.)**(ll+qq-ii+jj) ) * \
-              ( factorial(qq)*factorial(ll+jj) * ( 2.0**(qq-ii+jj-mm) - (1.0-cos(zeta))**(qq-ii+jj-mm) ) ) / \
-              ( factorial(ii)*factorial(qq-ii)*factorial(jj)*factorial(ll-jj)*factorial(jj-mm)*(qq-ii+jj-mm) )
-
-    if mm==ll:
-        integrand += 0.
-    else:
-        for jj in range(mm+1,ll+1):
-            integrand += ( 2.0**(qq-jj) * (-1.)**(ll+jj) ) * \
-              ( factorial(ll+jj) * ( 2.0**(jj-mm) - (1.0-cos(zeta))**(jj-mm) ) ) / \
-              ( factorial(jj)*factorial(ll-jj)*factorial(jj-mm)*(jj-mm) )
 
-    integrand += ( (-1.)**(ll+mm) * 2.0**(qq-mm) * factorial(ll+mm) * log(2./(1.0-cos(zeta))) ) / \
+    logcoeff = (-1.)**(ll+mm) * 2.0**(qq-mm) * factorial(ll+mm) / \
       (1.0*factorial(mm)*factorial(ll-mm))
-    
-    return integrand
 
+    return gair_sum('plus01', qq, mm, ll, 1.0-np.cos(zeta)) + \
+      logcoeff * np.log(2./(1.0-np.cos(zeta)))
 
-def Fplus00(qq, mm,ll,zeta):
 
-    integrand = 0.
-    
-    for ii in range(0,qq+1):
-        for jj in range(mm,ll+1):
-            
-            integrand += ( 2.0**(ii-jj) * (-1.)**(ll+qq-ii+jj) ) * \
-              ( factorial(qq)*factorial(ll+jj) * ( 2.0**(qq-ii+jj-mm+1) - (1.0-cos(zeta))**(qq-ii+jj-mm+1) ) ) / \
-              ( factorial(ii)*factorial(qq-ii)*factorial(jj)*factorial(ll-jj)*factorial(jj-mm)*(qq-ii+jj-mm+1) )
+def Fplus00(qq, mm,ll,zeta):
 
-    return integrand
+    return gair_sum('plus00', qq, mm, ll, 1.0-np.cos(zeta))
 
 
 def arbORF(mm,ll,zeta):
 
-    if mm == 0:
+    zeta = np.asarray(zeta, dtype=float)
+    cz = np.cos(zeta)
 
-        if ll>=0 and ll<=2:
+    with np.errstate(divide='ignore', invalid='ignore'):
 
-            delta = [1.0+cos(zeta)/3., -(1.+cos(zeta))/3., 2.0*cos(zeta)/15.]
-            
-            if zeta==0.:
-                return norm*0.5*sqrt( (2.0*ll+1.0)*pi ) * \
-                  (delta[ll] - (1.0+cos(zeta))*Fminus00(0, 0,ll,zeta)) 
-            else:
-                return norm*0.5*sqrt( (2.0*ll+1.0)*pi ) * \
-                  (delta[ll] - (1.0+cos(zeta))*Fminus00(0, 0,ll,zeta) - \
-                   (1.0-cos(zeta))*Fplus01(1, 0,ll,zeta))
+        if mm == 0:
 
-        else:
-            if zeta==0.:
-                return norm*0.5*sqrt( (2.0*ll+1.0)*pi ) * \
-                  ( - (1.0+cos(zeta))*Fminus00(0, 0,ll,zeta)) 
-            else:
-                return norm*0.5*sqrt( (2.0*ll+1.0)*pi ) * \
-                  ( - (1.0+cos(zeta))*Fminus00(0, 0,ll,zeta) - \
-                    (1.0-cos(zeta))*Fplus01(1, 0,ll,zeta))
+            # the Fplus01 term vanishes for coincident pulsars
+            plus_term = np.where(zeta == 0., 0.0,
+                                 (1.0-cz)*Fplus01(1, 0,ll,zeta))
 
-    elif mm == 1:
+            if ll>=0 and ll<=2:
+                delta = [1.0+cz/3., -(1.+cz)/3., 2.0*cz/15.][ll]
+            else:
+                delta = 0.0
 
-        if ll==1 or ll==2:
+            return norm*0.5*sqrt( (2.0*ll+1.0)*pi ) * \
+              (delta - (1.0+cz)*Fminus00(0, 0,ll,zeta) - plus_term)
 
-            delta = [2.0*sin(zeta)/3., -2.0*sin(zeta)/5.]
-            
-            return norm * 0.25*sqrt( (2.0*ll+1.0)*pi )*sqrt( (1.0*factorial(ll-1))/(1.0*factorial(ll+1)) ) * \
-              (delta[ll-1] - ( (1.0+cos(zeta))**(3./2.) / (1.0-cos(zeta))**(1./2.) )*Fminus00(1, 1,ll,zeta) - \
-               ( (1.0-cos(zeta))**(3./2.) / (1.0+cos(zeta))**(1./2.) )*Fplus01(2, 1,ll,zeta))
+        elif mm == 1:
 
-        else:
+            if ll==1 or ll==2:
+                delta = [2.0*np.sin(zeta)/3., -2.0*np.sin(zeta)/5.][ll-1]
+            else:
+                delta = 0.0
 
             return norm * 0.25*sqrt( (2.0*ll+1.0)*pi )*sqrt( (1.0*factorial(ll-1))/(1.0*factorial(ll+1)) ) * \
-              ( - ( (1.0+cos(zeta))**(3./2.) / (1.0-cos(zeta))**(1./2.) )*Fminus00(1, 1,ll,zeta) - \
-                ( (1.0-cos(zeta))**(3./2.) / (1.0+cos(zeta))**(1./2.) )*Fplus01(2, 1,ll,zeta))
+              (delta - ( (1.0+cz)**(3./2.) / (1.0-cz)**(1./2.) )*Fminus00(1, 1,ll,zeta) - \
+               ( (1.0-cz)**(3./2.) / (1.0+cz)**(1./2.) )*Fplus01(2, 1,ll,zeta))
 
-    else:
+        else:
 
-        return - norm * 0.25*sqrt( (2.0*ll+1.0)*pi )*sqrt( (1.0*factorial(ll-mm))/(1.0*factorial(ll+mm)) ) * \
-          ( ( (1.0+cos(zeta))**(mm/2. + 1) / (1.0-cos(zeta))**(mm/2.) )*Fminus00(mm, mm,ll,zeta) - \
-            ( (1.0+cos(zeta))**(mm/2.) / (1.0-cos(zeta))**(mm/2. - 1.) )*Fminus01(mm-1, mm,ll,zeta) + \
-          ( (1.0-cos(zeta))**(mm/2. + 1) / (1.0+cos(zeta))**(mm/2.) )*Fplus01(mm+1, mm,ll,zeta) - \
-          ( (1.0-cos(zeta))**(mm/2.) / (1.0+cos(zeta))**(mm/2. - 1.) )*Fplus00(mm, mm,ll,zeta) )
+            return - norm * 0.25*sqrt( (2.0*ll+1.0)*pi )*sqrt( (1.0*factorial(ll-mm))/(1.0*factorial(ll+mm)) ) * \
+              ( ( (1.0+cz)**(mm/2. + 1) / (1.0-cz)**(mm/2.) )*Fminus00(mm, mm,ll,zeta) - \
+                ( (1.0+cz)**(mm/2.) / (1.0-cz)**(mm/2. - 1.) )*Fminus01(mm-1, mm,ll,zeta) + \
+                ( (1.0-cz)**(mm/2. + 1) / (1.0+cz)**(mm/2.) )*Fplus01(mm+1, mm,ll,zeta) - \
+                ( (1.0-cz)**(mm/2.) / (1.0+cz)**(mm/2. - 1.) )*Fplus00(mm, mm,ll,zeta) )
 
 
 def dlmk(l,m,k,theta1):
@@ -180,8 +184,8 @@ def dlmk(l,m,k,theta1):
     if m >= k:
         
         factor = sqrt(factorial(l-k)*factorial(l+m)/factorial(l+k)/factorial(l-m))
-        part2 = (cos(theta1/2))**(2*l+k-m)*(-sin(theta1/2))**(m-k)/factorial(m-k)
-        part3 = sp.hyp2f1(m-l,-k-l,m-k+1,-(tan(theta1/2))**2)
+        part2 = (np.cos(theta1/2))**(2*l+k-m)*(-np.sin(theta1/2))**(m-k)/factorial(m-k)
+        part3 = sp.hyp2f1(m-l,-k-l,m-k+1,-(np.tan(theta1/2))**2)
 
         return factor*part2*part3
     
@@ -190,14 +194,18 @@ def dlmk(l,m,k,theta1):
         return (-1)**(m-k) * dlmk(l,k,m,theta1)
 
 
-def Dlmk(l,m,k,phi1,phi2,theta1,theta2):
+def Dlmk(l,m,k,phi1,phi2,theta1,theta2,gam=None):
     """
     returns value of D^l_mk as defined in allen, ottewill 97.
+    The third rotation angle can be passed in as gam if it is
+    already known.
     
     """
-    
-    return exp(complex(0.,-m*phi1)) * dlmk(l,m,k,theta1) * \
-      exp(complex(0.,-k*gamma(phi1,phi2,theta1,theta2)))
+
+    if gam is None:
+        gam = gamma(phi1,phi2,theta1,theta2)
+
+    return np.exp(-1j*m*phi1) * dlmk(l,m,k,theta1) * np.exp(-1j*k*gam)
 
       
 def gamma(phi1,phi2,theta1,theta2):
@@ -207,63 +215,58 @@ def gamma(phi1,phi2,theta1,theta2):
     returns the angle.
     
     """
-    
-    if phi1 == phi2 and theta1 == theta2:
-        gamma = 0
-    else:
-        gamma = atan( sin(theta2)*sin(phi2-phi1) / \
-                      (cos(theta1)*sin(theta2)*cos(phi1-phi2) - \
-                       sin(theta1)*cos(theta2)) )
 
-    dummy_arg = (cos(gamma)*cos(theta1)*sin(theta2)*cos(phi1-phi2) + \
-                 sin(gamma)*sin(theta2)*sin(phi2-phi1) - \
-                 cos(gamma)*sin(theta1)*cos(theta2))
-        
-    if dummy_arg >= 0:
-        return gamma
-    else:
-        return pi + gamma
+    phi1, phi2, theta1, theta2 = np.broadcast_arrays(phi1, phi2, theta1, theta2)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gam = np.arctan( np.sin(theta2)*np.sin(phi2-phi1) / \
+                         (np.cos(theta1)*np.sin(theta2)*np.cos(phi1-phi2) - \
+                          np.sin(theta1)*np.cos(theta2)) )
+    gam = np.where((phi1 == phi2) & (theta1 == theta2), 0.0, gam)
+
+    dummy_arg = (np.cos(gam)*np.cos(theta1)*np.sin(theta2)*np.cos(phi1-phi2) + \
+                 np.sin(gam)*np.sin(theta2)*np.sin(phi2-phi1) - \
+                 np.cos(gam)*np.sin(theta1)*np.cos(theta2))
+
+    return np.where(dummy_arg >= 0, gam, pi + gam)
 
 
 def arbCompFrame_ORF(mm,ll,zeta):
+    """
+    Computational-frame ORF of multipole (l,m) for an array of pulsar
+    separations, including the coincident and antipodal limits.
     
-    if zeta == 0.:
-        
-        if ll>2: 
-            return 0.
-        elif ll==2:
-            if mm==0:
-                # pulsar-term doubling
-                return 2*0.25*norm*(4./3)*(sqrt(pi/5))*cos(zeta) 
-            else:
-                return 0.
-        elif ll==1:
-            if mm==0:
-                # pulsar-term doubling
-                return -2*0.5*norm*(sqrt(pi/3.))*(1.0+cos(zeta)) 
-            else:
-                return 0.
-        elif ll==0:
-            # pulsar-term doubling
-            return 2.0*norm*0.25*sqrt(pi*4)*(1+(cos(zeta)/3.)) 
-            
-    elif zeta == pi:
-        
-        if ll>2: 
-            return 0.
-        elif ll==2 and mm!=0: 
-            return 0.
-        elif ll==1 and mm!=0: 
-            return 0.
-        else: 
-            return arbORF(mm,ll,zeta)
-        
+    """
+
+    zeta = np.asarray(zeta, dtype=float)
+    coincident = (zeta == 0.)
+    antipodal = (zeta == pi)
+
+    # value for coincident pulsars (with pulsar-term doubling)
+    if ll==0:
+        coincident_val = 2.0*norm*0.25*sqrt(pi*4)*(1+(1./3.))
+    elif ll==1 and mm==0:
+        coincident_val = -2*0.5*norm*(sqrt(pi/3.))*2.0
+    elif ll==2 and mm==0:
+        coincident_val = 2*0.25*norm*(4./3)*(sqrt(pi/5))
     else:
-        
-        return arbORF(mm,ll,zeta)
+        coincident_val = 0.
+
+    # the antipodal limit is only non-zero for m=0 and l<=2
+    if ll<=2 and mm==0:
+        regular = ~coincident
+    else:
+        regular = ~(coincident | antipodal)
+
+    ans = np.zeros(zeta.shape)
+    if np.any(regular):
+        ans[regular] = arbORF(mm,ll,zeta[regular])
+    ans[coincident] = coincident_val
 
+    return ans
 
-def rotated_Gamma_ml(m,l,phi1,phi2,theta1,theta2,gamma_ml):
+
+def rotated_Gamma_ml(m,l,phi1,phi2,theta1,theta2,gamma_ml,gam=None):
     """
     This function takes any gamma in the computational frame and rotates it to the
     cosmic frame. 
@@ -273,80 +276,150 @@ def rotated_Gamma_ml(m,l,phi1,phi2,theta1,theta2,gamma_ml):
     rotated_gamma = 0
     
     for ii in range(2*l+1):
-        rotated_gamma += Dlmk(l,m,ii-l,phi1,phi2,theta1,theta2).conjugate()*gamma_ml[ii]
+        rotated_gamma += Dlmk(l,m,ii-l,phi1,phi2,theta1,theta2,gam).conjugate()*gamma_ml[ii]
 
     return rotated_gamma
 
 
-def real_rotated_Gammas(m,l,phi1,phi2,theta1,theta2,gamma_ml):
+def real_form(m, rot_pos, rot_neg):
     """
-    This function returns the real-valued form of the Overlap Reduction Functions,
-    see Eqs 47 in Mingarelli et al, 2013.
+    Real-valued combination of the rotated Gamma^m_l (rot_pos) and
+    Gamma^-m_l (rot_neg), see Eqs 47 in Mingarelli et al, 2013.
     
     """
-    
+
     if m>0:
-        ans=(1./sqrt(2))*(rotated_Gamma_ml(m,l,phi1,phi2,theta1,theta2,gamma_ml) + \
-                          (-1)**m*rotated_Gamma_ml(-m,l,phi1,phi2,theta1,theta2,gamma_ml))
+        ans=(1./sqrt(2))*(rot_pos + (-1)**m*rot_neg)
         return ans.real
     if m==0:
-        return rotated_Gamma_ml(0,l,phi1,phi2,theta1,theta2,gamma_ml).real
+        return rot_pos.real
     if m<0:
-        ans=(1./sqrt(2)/complex(0.,1))*(rotated_Gamma_ml(-m,l,phi1,phi2,theta1,theta2,gamma_ml) - \
-                                        (-1)**m*rotated_Gamma_ml(m,l,phi1,phi2,theta1,theta2,gamma_ml))
+        ans=(1./sqrt(2)/complex(0.,1))*(rot_neg - (-1)**m*rot_pos)
         return ans.real
 
 
-def CorrBasis(psr_locs, lmax):
+def real_rotated_Gammas(m,l,phi1,phi2,theta1,theta2,gamma_ml):
+    """
+    This function returns the real-valued form of the Overlap Reduction Functions,
+    see Eqs 47 in Mingarelli et al, 2013.
     
-    corr=[]
+    """
+
+    gam = gamma(phi1,phi2,theta1,theta2)
+
+    return real_form(m,
+                     rotated_Gamma_ml(m,l,phi1,phi2,theta1,theta2,gamma_ml,gam),
+                     rotated_Gamma_ml(-m,l,phi1,phi2,theta1,theta2,gamma_ml,gam))
+
+
+def pair_basis(task):
+    """
+    Real-valued anisotropy basis ORFs of a set of pulsar pairs for every
+    (l,m) up to lmax, ordered like the clm vector.
+
+    :param task: Tuple (phi1, phi2, theta1, theta2, lmax), where the
+                 positions are arrays with one element per pair
+
+    :returns: Array of shape ((lmax+1)**2, npairs)
     
+    """
+
+    phi1, phi2, theta1, theta2, lmax = task
+
+    zeta = calczeta(phi1, phi2, theta1, theta2)
+    gam = gamma(phi1, phi2, theta1, theta2)
+
+    vals = np.zeros(((lmax+1)**2, len(zeta)))
     for ll in range(0,lmax+1):
-        
-        mmodes = 2*ll+1     # Number of modes for this ll
-        for mm in range(mmodes):
-            corr.append(np.zeros((len(psr_locs), len(psr_locs))))
-            
-        for aa in range(len(psr_locs)):
-            for bb in range(aa, len(psr_locs)):
-                
-                rot_Gs=[]
-                plus_gamma_ml = [] # this will hold the list of gammas
-                                   # evaluated at a specific value of phi{1,2}, and theta{1,2}.
-                neg_gamma_ml = []
-                gamma_ml = []
-                
-                # Pre-calculate all the gammas so this gets done only once.
-                # Need all the values to execute rotation codes.
-                for mm in range(ll+1):
-                    zeta = calczeta(psr_locs[:,0][aa],psr_locs[:,0][bb],\
-                                    psr_locs[:,1][aa],psr_locs[:,1][bb])
-                    
-                    intg_gamma = arbCompFrame_ORF(mm,ll,zeta)
-
-                    # just (-1)^m Gamma_ml since this is in the computational frame
-                    neg_intg_gamma = (-1)**(mm) * intg_gamma
-
-                    # all of the gammas from Gamma^-m_l --> Gamma ^m_l
-                    plus_gamma_ml.append(intg_gamma)
-
-                    # get the neg m values via complex conjugates   
-                    neg_gamma_ml.append(neg_intg_gamma)  
-                    
-                neg_gamma_ml = neg_gamma_ml[1:]         # this makes sure we don't have 0 twice
-                rev_neg_gamma_ml = neg_gamma_ml[::-1]   # reverse direction of list, now runs from -m...0
-                gamma_ml = rev_neg_gamma_ml + plus_gamma_ml
-                
-                mindex = len(corr) - mmodes
-                for mm in range(mmodes):
-                    m = mm - ll
-                    
-                    corr[mindex+mm][aa, bb] = \
-                      real_rotated_Gammas(m, ll, psr_locs[:,0][aa], psr_locs[:,0][bb],
-                                          psr_locs[:,1][aa], psr_locs[:,1][bb], gamma_ml)
-                    
-                    if aa != bb:
-                        corr[mindex+mm][bb, aa] = corr[mindex+mm][aa, bb]
-                        
-                        
+
+        # Pre-calculate all the gammas so this gets done only once.
+        # Need all the values to execute rotation codes.
+        plus_gamma_ml = [arbCompFrame_ORF(mm,ll,zeta) for mm in range(ll+1)]
+
+        # just (-1)^m Gamma_ml since this is in the computational frame;
+        # the first element is dropped so we don't have 0 twice
+        neg_gamma_ml = [(-1)**(mm) * plus_gamma_ml[mm] for mm in range(1,ll+1)]
+
+        # gammas from Gamma^-m_l --> Gamma ^m_l
+        gamma_ml = neg_gamma_ml[::-1] + plus_gamma_ml
+
+        rotated = [rotated_Gamma_ml(mm-ll, ll, phi1, phi2, theta1, theta2,
+                                    gamma_ml, gam)
+                   for mm in range(2*ll+1)]
+
+        for mm in range(2*ll+1):
+            vals[ll**2 + mm] = real_form(mm-ll, rotated[mm], rotated[-mm-1])
+
+    return vals
+
+
+CORRBASIS_CACHE_VERSION = 1
+
+def corrbasis_cachefile(psr_locs, lmax, cache_dir):
+    """
+    Content-addressed path of the cached basis ORFs for these pulsar
+    positions and lmax.
+    
+    """
+
+    key = hashlib.sha1()
+    key.update(np.ascontiguousarray(psr_locs, dtype=np.float64).tostring())
+    key.update('{0},{1}'.format(lmax, CORRBASIS_CACHE_VERSION).encode())
+
+    return os.path.join(cache_dir,
+                        'corrbasis_lmax{0}_{1}.npz'.format(lmax, key.hexdigest()))
+
+
+def CorrBasis(psr_locs, lmax, cache_dir=None, ncpus=1, write_cache=True):
+    """
+    Real-valued anisotropy basis ORFs for all pulsar pairs.
+
+    :param psr_locs: Pulsar (phi, theta) positions, shape (npsr, 2)
+    :param lmax: Maximum multipole
+    :param cache_dir: If given, load the basis from (or store it to) a
+                      compressed file in this directory, keyed on the
+                      positions and lmax
+    :param ncpus: Number of processes over which to split the pulsar
+                  pairs when the basis has to be computed; all pairs
+                  in a process are evaluated at once
+    :param write_cache: Store a freshly computed basis in cache_dir
+                        (only one of several MPI processes should)
+
+    :returns: Array of shape ((lmax+1)**2, npsr, npsr)
+    
+    """
+
+    psr_locs = np.asarray(psr_locs, dtype=float)
+    npsr = len(psr_locs)
+
+    if cache_dir is not None:
+        cachefile = corrbasis_cachefile(psr_locs, lmax, cache_dir)
+        if os.path.isfile(cachefile):
+            with np.load(cachefile) as cached:
+                return cached['corr']
+
+    aa, bb = np.triu_indices(npsr)
+    chunks = np.array_split(np.arange(len(aa)), max(ncpus,1))
+    tasks = [(psr_locs[aa[ck],0], psr_locs[bb[ck],0],
+              psr_locs[aa[ck],1], psr_locs[bb[ck],1], lmax)
+             for ck in chunks if len(ck)]
+
+    if len(tasks) > 1:
+        pool = multiprocessing.Pool(len(tasks))
+        try:
+            vals = pool.map(pair_basis, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        vals = [pair_basis(task) for task in tasks]
+
+    corr = np.zeros(((lmax+1)**2, npsr, npsr))
+    corr[:,aa,bb] = np.concatenate(vals, axis=1)
+    corr[:,bb,aa] = corr[:,aa,bb]
+
+    if cache_dir is not None and write_cache:
+        utils.savez_atomic(cachefile, compress=True, corr=corr,
+                           psr_locs=psr_locs, lmax=lmax)
+
     return corr
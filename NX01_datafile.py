@@ -20,7 +20,6 @@ import os, sys
 import tempfile
 import ephem
 import os
-import cPickle as pickle
 
 import NX01_utils
 
@@ -306,9 +305,9 @@ class DataFile(object):
         self.writeData(psrGroup, 'GCmatrix', psr.Gc,
                        overwrite=overwrite)
 
-        if psr.Umat is not None:
-            self.writeData(psrGroup, 'QuantMat', psr.Umat,
-                        overwrite=overwrite)
+        # the epochs are stored as index ranges [start, stop) into the
+        # sorted TOAs, rather than as a dense quantisation matrix
+        if psr.Uinds is not None:
             self.writeData(psrGroup, 'QuantInds', psr.Uinds,
                         overwrite=overwrite)
             self.writeData(psrGroup, 'EpochFlags', psr.epflags,
@@ -318,10 +317,17 @@ class DataFile(object):
             self.writeData(psrGroup, 'DetSigQuantInds', psr.detsig_Uinds,
                         overwrite=overwrite)
 
-        # pickle and store system flag dictionary
-        storeFlagDict = pickle.dumps(psr.sysflagdict)
-        self.writeData(psrGroup, 'SysFlagDict', storeFlagDict,
+        # Store the backends of every system flag, and the integer
+        # backend index of every TOA (-1 outside the flag's backends)
+        sysGroup = psrGroup.require_group('SysFlags')
+        self.writeData(sysGroup, 'flags', np.array(psr.sysflags.keys()),
                        overwrite=overwrite)
+        for flag, (names, index) in psr.sysflags.items():
+            flagGroup = sysGroup.require_group(flag)
+            self.writeData(flagGroup, 'names', np.array(names),
+                           overwrite=overwrite)
+            self.writeData(flagGroup, 'index', index.astype(np.int32),
+                           overwrite=overwrite)
 
         # Save the pulsar locations
         self.writeData(psrGroup, 'psrlocs', psr.psr_locs,
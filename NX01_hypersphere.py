@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+"""
+Created by stevertaylor
+Copyright (c) 2014 Stephen R. Taylor
+
+Code contributions by Rutger van Haasteren (piccard) and Justin Ellis (PAL/PAL2).
+
+"""
+
+from __future__ import division
+import numpy as np
+
+
+class HypersphereCorr(object):
+    """
+    Hyperspherical parameterisation of an (npsr x npsr) correlation
+    matrix, R = U^T U, with U upper-triangular. Column b of U is a unit
+    vector whose first b+1 elements are the Cartesian coordinates of the
+    angles phi[b(b-1)/2 : b(b+1)/2],
+
+        U[a,b] = cos(phi_ab) prod_{c<a} sin(phi_cb),   a < b
+        U[b,b] = prod_{c<b} sin(phi_cb)
+
+    The npsr*(npsr-1)/2 angles are ordered column by column, which is the
+    ordering of the modelIndep correlation parameters in NX01_master.
+    All methods accept a single angle vector or a stack of them (one per
+    frequency window) along the leading axis.
+    """
+
+    def __init__(self, npsr):
+        """
+        :param npsr: Number of pulsars
+        """
+
+        self.npsr = npsr
+        self.npairs = int(npsr*(npsr-1)/2)
+
+        # (row, column) of each angle inside U
+        cols, rows = np.tril_indices(npsr, -1)
+        self.rows = rows
+        self.cols = cols
+
+        # mask of the strict upper triangle, where the angles live
+        self.upper = np.zeros((npsr,npsr), dtype=bool)
+        self.upper[rows,cols] = True
+
+        # multiplicity of each log|sin(phi_cb)| in the Jacobian
+        # log-determinant (see logjacobian)
+        aa = np.arange(npsr)
+        self.sin_weight = np.where(self.upper,
+                                   (aa[None,:] - aa[:,None]) + (npsr - 1 - aa[None,:]),
+                                   0)
+
+    def _angle_table(self, phi):
+        """
+        Place the angles on the strict upper triangle of a matrix.
+        """
+
+        phi = np.asarray(phi, dtype=float)
+        table = np.zeros(phi.shape[:-1] + (self.npsr,self.npsr))
+        table[...,self.rows,self.cols] = phi
+
+        return table
+
+    def cholesky(self, phi):
+        """
+        Upper-triangular Cholesky factor of the correlation matrix.
+
+        :param phi: Angles, shape (..., npairs)
+
+        :returns: U, shape (..., npsr, npsr)
+        """
+
+        table = self._angle_table(phi)
+
+        sines = np.where(self.upper, np.sin(table), 1.0)
+        cosines = np.where(self.upper, np.cos(table),
+                           np.eye(self.npsr))
+
+        # exclusive cumulative product of sines down each column
+        sinprod = np.ones_like(sines)
+        sinprod[...,1:,:] = np.cumprod(sines[...,:-1,:], axis=-2)
+
+        return cosines * sinprod
+
+    def corr(self, phi):
+        """
+        Correlation matrix.
+
+        :param phi: Angles, shape (..., npairs)
+
+        :returns: R = U^T U, shape (..., npsr, npsr)
+        """
+
+        U = self.cholesky(phi)
+
+        return np.einsum('...ji,...jl->...il', U, U)
+
+    def logjacobian(self, phi):
+        """
+        Log of the absolute Jacobian determinant of the map from angles to
+        the off-diagonal correlation coefficients.
+
+        The map is block-triangular over the columns of U: column b of R
+        is U_b^T x_b, where U_b is the leading (b x b) block of U and x_b
+        holds the first b elements of column b. The Jacobian of x_b with
+        respect to its own angles is triangular too, so
+
+            log|J| = sum_b [ sum_{a<b} log|U[a,a]|
+                             + sum_{c<b} (b-c) log|sin(phi_cb)| ]
+
+        and every log|sin(phi_cb)| enters with weight (b-c) + (npsr-1-b).
+
+        :param phi: Angles, shape (..., npairs)
+
+        :returns: log|J|, shape (...)
+        """
+
+        table = self._angle_table(phi)
+
+        with np.errstate(divide='ignore'):
+            logsin = np.where(self.upper, np.log(np.abs(np.sin(table))), 0.0)
+
+        return np.sum(self.sin_weight * logsin, axis=(-2,-1))
+
+    def logjacobian_simple(self, phi):
+        """
+        Simplified Jacobian, using only the first angle of every column.
+
+        :param phi: Angles, shape (..., npairs)
+
+        :returns: sum_b log|sin(phi_0b)|, shape (...)
+        """
+
+        phi = np.asarray(phi, dtype=float)
+        first = phi[...,self.rows==0]
+
+        return np.sum(np.log(np.abs(np.sin(first))), axis=-1)
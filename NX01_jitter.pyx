@@ -1,7 +1,9 @@
 
 import numpy as np
 cimport numpy as np
+cimport cython
 from libc.math cimport log, sqrt
+from scipy.linalg.cython_blas cimport dsyrk
 
 
 '''
@@ -112,9 +114,61 @@ def cython_block_shermor_1D( \
             beta = 1.0 / (nisum + ji)
             Jldet += log(Jvec[cc]) - log(beta)
             xNx -= beta * nir * nir
-    
+
     return Jldet, xNx
 
+def cython_block_shermor_signal( \
+        np.ndarray[np.double_t,ndim=1] s, \
+        np.ndarray[np.double_t,ndim=1] r, \
+        np.ndarray[np.double_t,ndim=1] Nvec, \
+        np.ndarray[np.double_t,ndim=1] Jvec, \
+        np.ndarray[np.int_t,ndim=2] Uinds):
+    """
+    Sherman-Morrison block-inversion for Jitter (Cythonized), applied to a
+    deterministic signal. Returns N^-1 s, r^T N^-1 s and s^T N^-1 s from
+    a single pass over the TOAs.
+    @param s:       The deterministic signal, array (n)
+    @param r:       The timing residuals, array (n)
+    @param Nvec:    The white noise amplitude, array (n)
+    @param Jvec:    The jitter amplitude, array (k)
+    @param Uinds:   The start/finish indices for the jitter blocks (k x 2)
+    For this version, the residuals need to be sorted properly so that all the
+    blocks are continuous in memory. Here, there are n residuals, and k jitter
+    parameters.
+    """
+    cdef unsigned int cc, ii, rows = len(s), cols = len(Jvec)
+    cdef double ji, beta, rNs=0.0, sNs=0.0, nis, nir, nisum
+    cdef np.ndarray[np.double_t,ndim=1] ni = np.empty(rows, 'd')
+    cdef np.ndarray[np.double_t,ndim=1] Nx = np.empty(rows, 'd')
+
+    ni = 1.0 / Nvec
+
+    for cc in range(rows):
+        Nx[cc] = s[cc]*ni[cc]
+        rNs += r[cc]*Nx[cc]
+        sNs += s[cc]*Nx[cc]
+
+    for cc in range(cols):
+        if Jvec[cc] > 0.0:
+            ji = 1.0 / Jvec[cc]
+
+            nis = 0.0
+            nir = 0.0
+            nisum = 0.0
+            for ii in range(Uinds[cc,0],Uinds[cc,1]):
+                nisum += ni[ii]
+                nis += s[ii]*ni[ii]
+                nir += r[ii]*ni[ii]
+
+            beta = 1.0 / (nisum + ji)
+            for ii in range(Uinds[cc,0],Uinds[cc,1]):
+                Nx[ii] -= beta * nis * ni[ii]
+
+            rNs -= beta * nir * nis
+            sNs -= beta * nis * nis
+
+    return Nx, rNs, sNs
+
 
 # Proposals for calculating the Z.T * N^-1 * Z combinations
 def python_block_shermor_2D(Z, Nvec, Jvec, Uinds):
@@ -191,3 +245,86 @@ def cython_block_shermor_2D( \
 
     return Jldet, zNz
 
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def cython_block_shermor_products( \
+        np.ndarray[np.double_t,ndim=2] Z, \
+        np.ndarray[np.double_t,ndim=1] r, \
+        np.ndarray[np.double_t,ndim=1] Nvec, \
+        np.ndarray[np.double_t,ndim=1] Jvec, \
+        np.ndarray[np.int_t,ndim=2] Uinds):
+    """
+    Sherman-Morrison block-inversion for Jitter (Cythonized), returning
+    all the products needed by the likelihood from a single pass
+    @param Z:       The design matrix, array (n x m)
+    @param r:       The timing residuals, array (n)
+    @param Nvec:    The white noise amplitude, array (n)
+    @param Jvec:    The jitter amplitude, array (k)
+    @param Uinds:   The start/finish indices for the jitter blocks (k x 2)
+    For this version, the residuals need to be sorted properly so that all the
+    blocks are continuous in memory. Here, there are n residuals, and k jitter
+    parameters.
+    N = D + U*J*U.T
+    calculate: log(det(N)), Z.T * N^-1 * r, r.T * N^-1 * r, Z.T * N^-1 * Z
+    The block sums U.T * D^-1 * Z are collected in one (k x m) matrix, so
+    that the rank-k correction to Z.T * D^-1 * Z is a single BLAS syrk.
+    """
+    cdef int cc, ii, jj, start, stop, rows = Z.shape[0], m = Z.shape[1], \
+        cols = len(Jvec)
+    cdef double Jldet=0.0, rNr=0.0, beta, sbeta, nir, nisum
+    cdef double alpha = -1.0, one = 1.0
+    cdef char uplo = 'L', trans = 'N'
+
+    cdef np.ndarray[np.double_t,ndim=2] Zc = np.ascontiguousarray(Z)
+    cdef np.ndarray[np.double_t,ndim=1] ni = 1.0 / Nvec
+    cdef np.ndarray[np.double_t,ndim=1] ZNr = np.dot(Zc.T, r*ni)
+    cdef np.ndarray[np.double_t,ndim=2] ZNZ = \
+        np.ascontiguousarray(np.dot(Zc.T*ni, Zc))
+    cdef np.ndarray[np.double_t,ndim=2] zn = np.zeros((max(cols,1), m), 'd')
+
+    cdef double[:,::1] Zv = Zc, ZNZv = ZNZ, znv = zn
+    cdef double[::1] niv = ni, ZNrv = ZNr
+    cdef double[::1] rv = np.ascontiguousarray(r)
+    cdef double[::1] Nv = np.ascontiguousarray(Nvec)
+    cdef double[::1] Jv = np.ascontiguousarray(Jvec)
+    cdef np.int_t[:,::1] Uv = np.ascontiguousarray(Uinds)
+
+    with nogil:
+        for ii in range(rows):
+            Jldet += log(Nv[ii])
+            rNr += rv[ii]*rv[ii]*niv[ii]
+
+        for cc in range(cols):
+            if Jv[cc] > 0.0:
+                start = Uv[cc,0]
+                stop = Uv[cc,1]
+
+                nisum = 0.0
+                nir = 0.0
+                for ii in range(start, stop):
+                    nisum += niv[ii]
+                    nir += rv[ii]*niv[ii]
+                    for jj in range(m):
+                        znv[cc,jj] += niv[ii]*Zv[ii,jj]
+
+                beta = 1.0 / (nisum + 1.0/Jv[cc])
+                Jldet += log(Jv[cc]) - log(beta)
+                rNr -= beta * nir * nir
+
+                sbeta = sqrt(beta)
+                for jj in range(m):
+                    ZNrv[jj] -= beta * nir * znv[cc,jj]
+                    znv[cc,jj] *= sbeta
+
+        # ZNZ -= zn.T * zn. In column-major terms zn is an (m x k) matrix
+        # and the lower triangle of ZNZ is the upper one of the C array.
+        if cols > 0 and m > 0:
+            dsyrk(&uplo, &trans, &m, &cols, &alpha, &znv[0,0], &m,
+                  &one, &ZNZv[0,0], &m)
+
+        for ii in range(m):
+            for jj in range(ii+1, m):
+                ZNZv[jj,ii] = ZNZv[ii,jj]
+
+    return Jldet, ZNr, rNr, ZNZ
@@ -0,0 +1,1723 @@
+#!/usr/bin/env python
+
+"""
+Created by stevertaylor
+Copyright (c) 2014 Stephen R. Taylor
+
+Code contributions by Rutger van Haasteren (piccard) and Justin Ellis (PAL/PAL2).
+
+"""
+
+from __future__ import division
+import os, hashlib
+import numpy as np
+from collections import OrderedDict
+from scipy import linalg as sl
+
+import NX01_AnisCoefficients as anis
+import NX01_utils as utils
+import NX01_hypersphere as hsph
+
+try:
+    import NX01_jitter as jitter
+except ImportError:
+    import pyximport
+    pyximport.install(setup_args={"include_dirs":np.get_include()},
+                      reload_support=True)
+    import NX01_jitter as jitter
+
+try:
+    import healpy as hp
+    import AnisCoefficients_pix as pixAnis
+except ImportError:
+    hp = None
+    pixAnis = None
+
+f1yr = 1.0/(365.25*86400.0)
+
+
+def powerlaw_spectrum(Amp, gam, freqs, Tspan):
+    """
+    Power-law spectrum of a rank-reduced Gaussian process, as used for
+    intrinsic red noise, DM variations, clock errors and the GWB.
+
+    :param Amp: Amplitude (scalar or array broadcastable against freqs)
+    :param gam: Spectral index (scalar or array broadcastable against freqs)
+    :param freqs: Sampling frequencies [Hz]
+    :param Tspan: Total observation span [s]
+
+    :returns: Variance of each Fourier coefficient
+    """
+
+    return Amp**2/12/np.pi**2 * f1yr**(gam-3) * freqs**(-gam) / Tspan
+
+
+def batch_cho_inv(mats):
+    """
+    Invert a stack of symmetric positive-definite matrices with one
+    batched Cholesky decomposition.
+
+    :param mats: Array of matrices, shape (nmats, n, n)
+
+    :returns: Inverse matrices, log-determinant of each matrix
+
+    Raises np.linalg.LinAlgError if any of the matrices is not
+    positive-definite.
+    """
+
+    L = np.linalg.cholesky(mats)
+    Linv = np.linalg.solve(L, np.broadcast_to(np.eye(mats.shape[-1]), mats.shape))
+    logdet = 2.0*np.sum(np.log(np.diagonal(L, axis1=1, axis2=2)), axis=1)
+
+    return np.einsum('kji,kjl->kil', Linv, Linv), logdet
+
+
+def ecorr_variances(p, noEcorr=False):
+    """
+    ECORR variance of every jitter epoch of pulsar p, from its
+    single-pulsar ECORR values.
+
+    :param p: Pulsar object
+    :param noEcorr: Ignore correlated white noise
+
+    :returns: Variances, or None without ECORR
+    """
+
+    if noEcorr or p.ecorrs is None or len(p.ecorrs)==0:
+        return None
+
+    Jamp = np.ones(len(p.epflags))
+    for jj,nano_sysname in enumerate(p.sysflagdict['nano-f'].keys()):
+        Jamp[np.where(p.epflags==nano_sysname)] *= \
+          p.ecorrs[nano_sysname]**2.0
+
+    return Jamp
+
+
+PRODUCTS_CACHE_VERSION = 1
+
+def products_cachefile(p, config, cache_dir, noEcorr=False):
+    """
+    Content-addressed path of the cached likelihood products (T, and the
+    white-noise products of _setup_white_noise) of pulsar p. The key
+    covers the pulsar data and noise values that enter them, as well as
+    the model options that fix the Fourier basis.
+
+    :param p: Pulsar object, before its T matrix is made
+    :param config: Model options that fix the Fourier basis (number of
+                   modes, Tmax, DM and ephemeris modes, ...)
+    :param cache_dir: Directory of the cached products
+    :param noEcorr: Ignore correlated white noise
+
+    """
+
+    key = hashlib.sha1()
+    for arr in [p.toas, p.res, p.toaerrs, p.obs_freqs, p.psr_locs, p.Gc]:
+        key.update(np.ascontiguousarray(arr, dtype=np.float64).tostring())
+    Jamp = ecorr_variances(p, noEcorr)
+    if Jamp is not None:
+        key.update(np.ascontiguousarray(Jamp, dtype=np.float64).tostring())
+        key.update(np.ascontiguousarray(p.Uinds, dtype=np.int64).tostring())
+    key.update('{0},{1}'.format(repr(tuple(config)), PRODUCTS_CACHE_VERSION).encode())
+
+    return os.path.join(cache_dir,
+                        'likeproducts_{0}_{1}.npz'.format(p.name, key.hexdigest()))
+
+
+def load_products(cachefile):
+    """
+    Read the cached likelihood products of a pulsar.
+
+    :returns: Dictionary of Te, ranphase, TtNT, d, logdet_N and dtNdt
+    """
+
+    with np.load(cachefile) as cached:
+        return dict((name, cached[name]) for name in cached.files)
+
+
+def save_products(cachefile, **products):
+    """
+    Store the likelihood products of a pulsar (see load_products).
+
+    :returns: True if the cache file was written
+    """
+
+    return utils.savez_atomic(cachefile, version=PRODUCTS_CACHE_VERSION,
+                              **products)
+
+
+class PTALikelihood(object):
+    """
+    The PTA likelihood for a fixed model choice. Everything that does
+    not depend on the sampled parameters (parameter slicing, spectral
+    padding, white-noise products, Fourier index maps, the marginalised
+    timing model) is set up once in the constructor, so that a call only
+    evaluates the kernels belonging to the chosen model.
+
+    The instance is callable with a parameter vector, so it can be handed
+    directly to a sampler or evaluated on its own.
+    """
+
+    def __init__(self, psr, args, fqs_red, fqs_dm=None, fqs_eph=None,
+                 corr_modefreqs=None, num_corr_params=0, CorrCoeff=None,
+                 harm_sky_vals=None, monoOrf=None, customOrf=None,
+                 gwdisk_response=None, gp=None, gppkl=None, fb2env=None,
+                 tref=None, orf_cache_size=16, white_cache_size=2,
+                 term_cache_size=2, products=None):
+        """
+        :param psr: List of pulsar objects (with Te already constructed)
+        :param args: Parsed model options of NX01_master
+        :param fqs_red: Red-noise/GWB sampling frequencies [1/day]
+        :param fqs_dm: DM-variation sampling frequencies [1/day]
+        :param fqs_eph: Ephemeris-error sampling frequencies [1/day]
+        :param corr_modefreqs: Frequency indices in each correlation window
+        :param num_corr_params: Number of correlation parameters
+        :param CorrCoeff: Anisotropy basis ORFs (spharmAnis), (nclm, npsr, npsr)
+        :param harm_sky_vals: Spherical harmonics on the prior sky-grid, (npix, nclm)
+        :param monoOrf: Hellings and Downs ORF
+        :param customOrf: User-supplied ORF (custom)
+        :param gwdisk_response: Pixel response matrix (gwDisk)
+        :param gp: Gaussian-process objects (gaussProc GWB prior)
+        :param gppkl: Pickled Gaussian-process training data
+        :param fb2env: Bend-frequency to environment mapping (turnover)
+        :param tref: Reference time of deterministic signals [MJD]
+        :param orf_cache_size: Number of correlation-parameter vectors whose
+                               ORFs are kept between calls
+        :param white_cache_size: Number of white-noise parameter vectors per
+                                 pulsar whose products are kept between calls
+                                 (with args.varyWhite)
+        :param term_cache_size: Number of per-pulsar likelihood terms kept
+                                between calls when the pulsars are treated
+                                independently
+        :param products: Per-pulsar white-noise products from a previous run
+                         (see load_products), or None to compute them
+        """
+
+        self.psr = psr
+        self.args = args
+        self.npsr = len(psr)
+
+        self.fqs_red = fqs_red
+        self.fqs_dm = fqs_dm if args.incDM else None
+        self.fqs_eph = fqs_eph if args.incEph else None
+        self.nmodes_red = len(fqs_red)
+        self.nmodes_dm = len(fqs_dm) if args.incDM else 0
+        self.nmodes_eph = len(fqs_eph) if args.incEph else 0
+
+        # number of frequency bins (one per sine/cosine pair)
+        self.nfreqs = self.nmodes_red + self.nmodes_dm + 3*self.nmodes_eph
+        self.mode_count = 2*self.nfreqs
+
+        self.red_sl = slice(0, self.nmodes_red)
+        self.dm_sl = slice(self.nmodes_red, self.nmodes_red+self.nmodes_dm)
+        self.eph_sl = slice(self.nmodes_red+self.nmodes_dm, self.nfreqs)
+
+        self.Tspan = (1/fqs_red[0])*86400.0
+        self.fred_hz = fqs_red/86400.0
+        if args.incDM:
+            self.fdm_hz = fqs_dm/86400.0
+        if args.incEph:
+            self.feph_hz = fqs_eph/86400.0
+
+        self.corr_modefreqs = corr_modefreqs
+        if corr_modefreqs is not None:
+            self.nwins = len(corr_modefreqs)
+            self.win_counts = np.array([len(cmf) for cmf in corr_modefreqs])
+        else:
+            self.nwins = 0
+            self.win_counts = None
+        self.num_corr_params = num_corr_params
+        # anisotropy basis ORFs as one contiguous (nclm, npsr, npsr) stack
+        if CorrCoeff is not None:
+            self.CorrCoeff = np.ascontiguousarray(CorrCoeff, dtype=float)
+        else:
+            self.CorrCoeff = None
+        self.harm_sky_vals = harm_sky_vals
+        self.monoOrf = monoOrf
+        self.customOrf = customOrf
+        self.gwdisk_response = gwdisk_response
+        self.gp = gp
+        self.gppkl = gppkl
+        self.fb2env = fb2env
+        self.tref = tref
+
+        self.positions = np.array([[p.psr_locs[0], np.pi/2. - p.psr_locs[1]]
+                                   for p in psr])
+        self.psrvec = np.array([np.sin(self.positions[:,1])*np.cos(self.positions[:,0]),
+                                np.sin(self.positions[:,1])*np.sin(self.positions[:,0]),
+                                np.cos(self.positions[:,1])]).T
+        self.diag_inds = np.arange(self.npsr)
+        # pairwise angular separations of the pulsars
+        self.psr_zeta = utils.psr_separations(self.psrvec)
+        self.dipole_kernel = utils.dipole_orf_kernel(self.psr_zeta)
+        # hyperspherical parameterisation of the modelIndep correlations
+        self.hsphere = hsph.HypersphereCorr(self.npsr)
+
+        if args.use_gpu:
+            import pycuda.gpuarray as gpuarray
+            import scikits.cuda.linalg as culinalg
+            self.gpuarray = gpuarray
+            self.culinalg = culinalg
+
+        if args.varyWhite:
+            self._setup_white_backends(white_cache_size)
+        self._setup_params()
+        self._setup_white_noise(products)
+        if args.det_signal and args.epochTOAs:
+            self._setup_epoch_projections()
+        self._setup_fixed_spectra()
+        self._setup_sigma_maps()
+        self._setup_orf_cache(orf_cache_size)
+        self._setup_term_cache(term_cache_size)
+
+        if args.det_signal and args.cgw_search and args.psrTerm:
+            self.pdist = np.array([p.h5Obj['pdist'].value for p in psr])
+            self.pdistErr = np.array([p.h5Obj['pdistErr'].value for p in psr])
+
+    ##########################
+    # One-time model set-up
+    ##########################
+
+    def _setup_params(self):
+        """
+        Map each model component onto its slice of the parameter vector.
+        """
+
+        args = self.args
+        npsr = self.npsr
+        nmodes_red = self.nmodes_red
+        nmodes_dm = self.nmodes_dm
+        nmodes_eph = self.nmodes_eph
+
+        self.pslices = OrderedDict()
+        ct = 0
+
+        def add(name, nparams):
+            self.pslices[name] = slice(ct, ct+nparams)
+            return ct + nparams
+
+        if not args.fixRed:
+            if args.redSpecModel == 'powerlaw':
+                ct = add('red', 2*npsr)
+            elif args.redSpecModel == 'spectrum':
+                ct = add('red', npsr*nmodes_red)
+        if args.incDM and not args.fixDM:
+            if args.dmSpecModel == 'powerlaw':
+                ct = add('dm', 2*npsr)
+            elif args.dmSpecModel == 'spectrum':
+                ct = add('dm', npsr*nmodes_dm)
+        if args.incClk:
+            if args.clkSpecModel == 'powerlaw':
+                ct = add('clk', 2)
+            elif args.clkSpecModel == 'spectrum':
+                ct = add('clk', nmodes_red)
+        if args.incCm:
+            if args.cmSpecModel == 'powerlaw':
+                ct = add('cm', 2)
+            elif args.cmSpecModel == 'spectrum':
+                ct = add('cm', nmodes_red)
+        if args.incEph:
+            if args.ephSpecModel == 'powerlaw':
+                ct = add('eph', 6)
+            elif args.ephSpecModel == 'spectrum':
+                ct = add('eph', 3*nmodes_eph)
+        if args.incGWB:
+            if args.gwbSpecModel == 'powerlaw':
+                ct = add('gwb', 1 if args.fix_slope else 2)
+            elif args.gwbSpecModel == 'spectrum':
+                if args.gwbPrior == 'gaussProc':
+                    ct = add('gwb', nmodes_red+2)
+                else:
+                    ct = add('gwb', nmodes_red)
+            elif args.gwbSpecModel == 'turnover':
+                ct = add('gwb', 2 if args.gwb_fb2env is not None else 3)
+            if args.incCorr:
+                ct = add('corr', self.num_corr_params)
+                if args.gwbModelSelect:
+                    ct = add('gwbmodsel', 1)
+        if args.incGWline:
+            ct = add('gwline', 4)
+        if args.det_signal:
+            if args.cgw_search:
+                ncgw = 12 if args.ecc_search else 11
+                if args.psrTerm:
+                    ncgw += 3*npsr
+                ct = add('cgw', ncgw)
+                if args.cgwModelSelect:
+                    ct = add('nmodel', 1)
+            elif args.bwm_search:
+                ct = add('bwm', 5)
+                if args.bwm_model_select:
+                    ct = add('nmodel', 1)
+            if args.eph_quadratic:
+                ct = add('ephquad', 12)
+        if args.varyWhite:
+            # appended last, so the other parameters keep their positions
+            ct = add('white', self.nwhite)
+
+    def _setup_white_backends(self, white_cache_size):
+        """
+        Backends of the sampled white noise. Every pulsar gets an EFAC and
+        a log10 EQUAD per system of args.sysflag_target, followed by a
+        log10 ECORR per NANOGrav backend, in one contiguous block.
+        """
+
+        args = self.args
+
+        self.white_systems = []
+        self.white_ecorrs = []
+        self.white_slices = []
+        ct = 0
+        for p in self.psr:
+
+            systems = p.sysflagdict.get(args.sysflag_target)
+            if systems is None:
+                systems = OrderedDict([(p.name, np.arange(len(p.toas)))])
+
+            ecorrs = OrderedDict()
+            if not args.noEcorr and p.epflags is not None and \
+              p.sysflagdict.get('nano-f'):
+                for nano_sysname in p.sysflagdict['nano-f'].keys():
+                    ecorrs[nano_sysname] = p.epflags==nano_sysname
+
+            nparams = 2*len(systems) + len(ecorrs)
+            self.white_systems.append(systems)
+            self.white_ecorrs.append(ecorrs)
+            self.white_slices.append(slice(ct, ct+nparams))
+            ct += nparams
+
+        self.nwhite = ct
+
+        # per-pulsar LRU caches of white-noise products, keyed on the
+        # pulsar's own white-noise parameters
+        self.white_keys = [None]*self.npsr
+        self.white_cache = [OrderedDict() for p in self.psr]
+        self.white_cache_size = white_cache_size
+
+    def _setup_white_noise(self, products=None):
+        """
+        Pre-compute the white-noise products T^T N^-1 T, T^T N^-1 r,
+        log(det(N)) and r^T N^-1 r for every pulsar, with N given by the
+        single-pulsar EFAC/EQUAD/ECORR values, unless they are supplied
+        from a previous run. With args.varyWhite these are only starting
+        values, replaced pulsar by pulsar in _update_white_noise.
+        """
+
+        args = self.args
+
+        # white-noise variance of every TOA and ECORR variance of every epoch
+        self.Nvec = [p.toaerrs**2.0 for p in self.psr]
+        self.Jamp = [ecorr_variances(p, args.noEcorr) for p in self.psr]
+
+        self.TtNT = []
+        self.d = []
+        self.logdet_N = np.zeros(self.npsr)
+        self.dtNdt = np.zeros(self.npsr)
+        for ii in range(self.npsr):
+
+            if products is not None and products[ii] is not None:
+                TtNT, d = products[ii]['TtNT'], products[ii]['d']
+                self.logdet_N[ii] = products[ii]['logdet_N']
+                self.dtNdt[ii] = products[ii]['dtNdt']
+            else:
+                TtNT, d, self.logdet_N[ii], self.dtNdt[ii] = \
+                  self._white_noise_products(ii)
+            self.TtNT.append(TtNT)
+            self.d.append(d)
+
+        self.loglike1 = -0.5 * np.sum(self.logdet_N + self.dtNdt)
+
+    def _white_noise_products(self, ii):
+        """
+        White-noise products of pulsar ii for its current Nvec and Jamp.
+
+        :returns: T^T N^-1 T, T^T N^-1 r, log(det(N)), r^T N^-1 r
+        """
+
+        p = self.psr[ii]
+        Nvec = self.Nvec[ii]
+
+        if self.Jamp[ii] is not None:
+
+            logdet_N, d, dtNdt, TtNT = \
+              jitter.cython_block_shermor_products(p.Te, p.res, Nvec,
+                                                   self.Jamp[ii], p.Uinds)
+
+        else:
+
+            d = np.dot(p.Te.T, p.res/Nvec)
+
+            N = 1./Nvec
+            right = (N*p.Te.T).T
+            TtNT = np.dot(p.Te.T, right)
+
+            logdet_N = np.sum(np.log(Nvec))
+            dtNdt = np.sum(p.res**2.0/Nvec)
+
+        return TtNT, d, logdet_N, dtNdt
+
+    def _setup_epoch_projections(self):
+        """
+        Pre-compute the N^-1-weighted projections of the epoch-averaging
+        matrix U, so that deterministic signals evaluated on the
+        epoch-averaged TOAs never have to be expanded to every TOA.
+
+        The ECORR blocks lie within the epochs, so N^-1 u_k is supported on
+        epoch k only and U^T N^-1 U is diagonal. Only T^T N^-1 U (npsr
+        matrices), r^T N^-1 U and diag(U^T N^-1 U) are needed.
+        """
+
+        self.ep_TNU = []
+        self.ep_rNU = []
+        self.ep_UNU = []
+        for ii in range(self.npsr):
+
+            TNU, rNU, UNU = self._epoch_projection(ii)
+            self.ep_TNU.append(TNU)
+            self.ep_rNU.append(rNU)
+            self.ep_UNU.append(UNU)
+
+    def _epoch_projection(self, ii):
+        """
+        Epoch projections of pulsar ii for its current Nvec and Jamp.
+
+        :returns: T^T N^-1 U, r^T N^-1 U, diag(U^T N^-1 U)
+        """
+
+        p = self.psr[ii]
+
+        epinds = p.detsig_Uinds
+        if epinds is None or epinds[0,0] != 0 or epinds[-1,1] != len(p.toas) \
+          or np.any(epinds[1:,0] != epinds[:-1,1]):
+            raise ValueError('Epoch-averaged signals need contiguous epochs '
+                             'covering all TOAs of {0}'.format(p.name))
+
+        # weight of each TOA in N^-1 u_k
+        wvec = 1.0 / self.Nvec[ii]
+        if self.Jamp[ii] is not None:
+
+            ecorr_ep = np.searchsorted(epinds[:,0], p.Uinds[:,0], side='right') - 1
+            if np.any(p.Uinds[:,1] > epinds[ecorr_ep,1]):
+                raise ValueError('ECORR blocks of {0} straddle the epochs of '
+                                 'the deterministic signal'.format(p.name))
+
+            for cc, (start, stop) in enumerate(p.Uinds):
+                if self.Jamp[ii][cc] > 0.0:
+                    nisum = np.sum(wvec[start:stop])
+                    beta = 1.0 / (nisum + 1.0/self.Jamp[ii][cc])
+                    wvec[start:stop] *= 1.0 - beta*nisum
+
+        return np.add.reduceat(p.Te * wvec[:,None], epinds[:,0], axis=0).T, \
+          np.add.reduceat(p.res * wvec, epinds[:,0]), \
+          np.add.reduceat(wvec, epinds[:,0])
+
+    def _setup_fixed_spectra(self):
+        """
+        Spectra that are held fixed at their single-pulsar values.
+        """
+
+        args = self.args
+
+        if args.fixRed:
+            Ared = np.array([np.max([p.Redamp, p.parRedamp]) for p in self.psr])
+            gam_red = np.array([np.max([p.Redind, p.parRedind]) for p in self.psr])
+            self.red_fixed = powerlaw_spectrum(Ared[:,None], gam_red[:,None],
+                                               self.fred_hz, self.Tspan)
+
+        if args.incDM and args.fixDM:
+            Adm = np.array([np.max([p.DMamp, p.parDMamp]) for p in self.psr])
+            gam_dm = np.array([np.max([p.DMind, p.parDMind]) for p in self.psr])
+            self.dm_fixed = powerlaw_spectrum(Adm[:,None], gam_dm[:,None],
+                                              self.fdm_hz, self.Tspan)
+
+    def _setup_sigma_maps(self):
+        """
+        Timing-model columns of each pulsar's T matrix, and the Sigma
+        workspace of the per-pulsar Fourier-domain systems.
+        """
+
+        self.ntm = np.array([p.Gc.shape[1] for p in self.psr])
+        self.mode_inds = np.arange(self.mode_count)
+        # Sigma is rebuilt and factorised in place on every call
+        self.sigma_work = np.empty((self.mode_count, self.mode_count))
+
+        self._setup_schur()
+
+    def _setup_schur(self):
+        """
+        Marginalise the timing-model columns of every pulsar through the
+        Schur complement of the timing-model block of T^T N^-1 T,
+
+            Sigma = [[A, B], [B^T, C + Phi^-1]]
+            log|Sigma| = log|A| + log|C - B^T A^-1 B + Phi^-1|
+
+        A, B and C do not depend on the sampled parameters, so they are
+        factorised once here. Each call then only factorises the
+        (mode_count) Fourier-domain system of every pulsar, or the
+        (npsr*mode_count) one with inter-pulsar correlations.
+        """
+
+        npsr = self.npsr
+        nm = self.mode_count
+
+        self.tm_cf = [None]*npsr
+        self.tm_AinvB = [None]*npsr
+        self.tm_logdet = np.zeros(npsr)
+        self.tm_schur = [None]*npsr
+        if self.args.incCorr:
+            # pulsar-major ordering; Phi^-1 fills the frequency diagonal
+            # of every (psr_a, psr_b) block
+            self.bigSchur = np.zeros((npsr*nm, npsr*nm))
+            self.bigSigma = np.empty_like(self.bigSchur)
+        for ii in range(npsr):
+            self._set_schur_block(ii, self._schur_block(ii))
+
+        self.dF, self.tm_quad = self._schur_data(self.d)
+
+    def _schur_block(self, ii):
+        """
+        Timing-model factorisation and Fourier-domain Schur complement of
+        pulsar ii for its current T^T N^-1 T.
+
+        :returns: Cholesky factor of A, A^-1 B, log|A|, C - B^T A^-1 B
+        """
+
+        TtNT = self.TtNT[ii]
+        ntm = self.ntm[ii]
+        A = TtNT[:ntm,:ntm]
+        B = TtNT[:ntm,ntm:]
+        C = TtNT[ntm:,ntm:]
+
+        cf = sl.cho_factor(A)
+        AinvB = sl.cho_solve(cf, B)
+
+        return cf, AinvB, np.sum(2*np.log(np.diag(cf[0]))), C - np.dot(B.T, AinvB)
+
+    def _set_schur_block(self, ii, block):
+
+        nm = self.mode_count
+
+        self.tm_cf[ii], self.tm_AinvB[ii], self.tm_logdet[ii], schur = block
+        self.tm_schur[ii] = schur
+        if self.args.incCorr:
+            self.bigSchur.reshape((self.npsr, nm, self.npsr, nm))[ii,:,ii,:] = schur
+
+    def _schur_data(self, dtmp):
+        """
+        Project T^T N^-1 r onto the Fourier columns, after marginalising
+        the timing model.
+
+        :param dtmp: List of T^T N^-1 r, one per pulsar
+
+        :returns: Fourier-domain data vectors, shape (npsr, mode_count),
+                  dG^T A^-1 dG of every pulsar
+        """
+
+        dF = np.zeros((self.npsr, self.mode_count))
+        tm_quad = np.zeros(self.npsr)
+        for ii, d in enumerate(dtmp):
+
+            ntm = self.ntm[ii]
+            dG = d[:ntm]
+
+            dF[ii] = d[ntm:] - np.dot(self.tm_AinvB[ii].T, dG)
+            tm_quad[ii] = np.dot(dG, sl.cho_solve(self.tm_cf[ii], dG))
+
+        return dF, tm_quad
+
+    def _setup_orf_cache(self, orf_cache_size):
+        """
+        ORFs without free correlation parameters (custom, clock, fixed
+        point-source, isotropic spharmAnis, ...) are built once here.
+        Otherwise the most recently used ORFs are kept in a small LRU
+        cache keyed on the correlation parameters, so that jumps which
+        leave them untouched do not rebuild the ORF.
+        """
+
+        self.const_orf = None
+        self.orf_cache = OrderedDict()
+        self.orf_cache_size = orf_cache_size
+
+        if self.args.incGWB and self.args.incCorr and self.num_corr_params == 0:
+            self.const_orf = self._compute_corr_orf({'orf_coeffs': np.array([])})
+
+    def _setup_term_cache(self, term_cache_size):
+        """
+        Without inter-pulsar correlations the likelihood is a sum of
+        per-pulsar terms, each fixed by the pulsar's Fourier-domain
+        variances, its data vector and (with args.varyWhite) its white
+        noise. The most recent terms of every pulsar are kept in a small
+        LRU cache keyed on these, so that a jump touching one pulsar's
+        noise parameters only re-factorises that pulsar's Sigma.
+        """
+
+        self.term_cache = [OrderedDict() for p in self.psr]
+        self.term_cache_size = term_cache_size
+
+    ##########################
+    # Parameter unpacking
+    ##########################
+
+    def _unpack(self, xx):
+        """
+        Split the parameter vector into the physical quantities of each
+        model component.
+        """
+
+        args = self.args
+        npsr = self.npsr
+        pars = {}
+
+        if 'red' in self.pslices:
+            xred = xx[self.pslices['red']]
+            if args.redSpecModel == 'powerlaw':
+                pars['Ared'] = 10.0**xred[:npsr]
+                pars['gam_red'] = xred[npsr:]
+            elif args.redSpecModel == 'spectrum':
+                pars['red_spec'] = xred.reshape((npsr,self.nmodes_red))
+
+        if 'dm' in self.pslices:
+            xdm = xx[self.pslices['dm']]
+            if args.dmSpecModel == 'powerlaw':
+                pars['Adm'] = 10.0**xdm[:npsr]
+                pars['gam_dm'] = xdm[npsr:]
+            elif args.dmSpecModel == 'spectrum':
+                pars['dm_spec'] = xdm.reshape((npsr,self.nmodes_dm))
+
+        if 'clk' in self.pslices:
+            xclk = xx[self.pslices['clk']]
+            if args.clkSpecModel == 'powerlaw':
+                pars['Aclk'] = 10.0**xclk[0]
+                pars['gam_clk'] = xclk[1]
+            elif args.clkSpecModel == 'spectrum':
+                pars['clk_spec'] = xclk
+
+        if 'cm' in self.pslices:
+            xcm = xx[self.pslices['cm']]
+            if args.cmSpecModel == 'powerlaw':
+                pars['Acm'] = 10.0**xcm[0]
+                pars['gam_cm'] = xcm[1]
+            elif args.cmSpecModel == 'spectrum':
+                pars['cm_spec'] = xcm
+
+        if 'eph' in self.pslices:
+            xeph = xx[self.pslices['eph']]
+            if args.ephSpecModel == 'powerlaw':
+                pars['Aeph'] = 10.0**xeph[0::2]
+                pars['gam_eph'] = xeph[1::2]
+            elif args.ephSpecModel == 'spectrum':
+                pars['eph_spec'] = xeph.reshape((3,self.nmodes_eph))
+
+        if 'gwb' in self.pslices:
+            xgwb = xx[self.pslices['gwb']]
+            if args.gwbSpecModel == 'powerlaw':
+                pars['Agwb'] = 10.0**xgwb[0]
+                if args.fix_slope:
+                    pars['gam_gwb'] = 13./3.
+                else:
+                    pars['gam_gwb'] = xgwb[1]
+            elif args.gwbSpecModel == 'spectrum':
+                pars['rho_spec'] = xgwb[:self.nmodes_red]
+                if args.gwbPrior == 'gaussProc':
+                    pars['Agwb'] = 10.0**xgwb[self.nmodes_red]
+                    pars['env_param'] = xgwb[self.nmodes_red+1]
+            elif args.gwbSpecModel == 'turnover':
+                pars['Agwb'] = 10.0**xgwb[0]
+                if args.gwb_fb2env is not None:
+                    pars['kappaturn'] = self.fb2env.kappa
+                    pars['fbend'] = self.fb2env.fb_from_env(envParam=10.0**xgwb[1])
+                else:
+                    pars['kappaturn'] = xgwb[1]
+                    pars['fbend'] = 10.0**xgwb[2]
+
+            pars['gwb_modindex'] = 0
+            if args.incCorr:
+                pars['orf_coeffs'] = xx[self.pslices['corr']]
+                if args.gwbModelSelect:
+                    # '0' is uncorrelated GWB, '1' is correlated GWB
+                    pars['gwb_modindex'] = int(np.rint(xx[self.pslices['gwbmodsel']][0]))
+                else:
+                    pars['gwb_modindex'] = 1
+
+        if 'gwline' in self.pslices:
+            xline = xx[self.pslices['gwline']]
+            pars['spec_gwline'] = xline[0]
+            pars['freq_gwline'] = 10.0**xline[1]
+            pars['phi_gwline'] = xline[2]
+            pars['theta_gwline'] = np.arccos(xline[3])
+
+        if 'cgw' in self.pslices:
+            pars['cgw_params'] = xx[self.pslices['cgw']]
+            if args.cgwModelSelect:
+                # '0' is noise-only, '1' is CGW
+                pars['nmodel'] = int(np.rint(xx[self.pslices['nmodel']][0]))
+            if args.ecc_search:
+                nbinary = 12
+            else:
+                nbinary = 11
+            pars['hstrain'] = 10.0**pars['cgw_params'][3]
+            if args.psrTerm:
+                pterm_params = pars['cgw_params'][nbinary:]
+                pars['psrdists'] = pterm_params[:npsr]
+                pars['psrgp0'] = pterm_params[npsr:2*npsr]
+                pars['psrlp0'] = pterm_params[2*npsr:]
+
+        if 'bwm' in self.pslices:
+            pars['bwm_params'] = xx[self.pslices['bwm']]
+            if args.bwm_model_select:
+                # '0' is noise-only, '1' is BWM
+                pars['nmodel'] = int(np.rint(xx[self.pslices['nmodel']][0]))
+
+        if 'ephquad' in self.pslices:
+            pars['ephquad'] = xx[self.pslices['ephquad']]
+
+        if 'white' in self.pslices:
+            xwhite = xx[self.pslices['white']]
+            pars['white'] = [xwhite[wsl] for wsl in self.white_slices]
+
+        return pars
+
+    ##########################
+    # Spectral kernels
+    ##########################
+
+    def _noise_spectra(self, pars):
+        """
+        Per-pulsar red-noise and DM-variation spectra, shape (npsr, nfreqs).
+        """
+
+        args = self.args
+
+        kappa = np.zeros((self.npsr, self.nfreqs))
+
+        if args.fixRed:
+            kappa[:,self.red_sl] = self.red_fixed
+        elif args.redSpecModel == 'powerlaw':
+            kappa[:,self.red_sl] = powerlaw_spectrum(pars['Ared'][:,None],
+                                                     pars['gam_red'][:,None],
+                                                     self.fred_hz, self.Tspan)
+        elif args.redSpecModel == 'spectrum':
+            kappa[:,self.red_sl] = 10.0**(2.0*pars['red_spec']) / self.Tspan
+
+        if args.incDM:
+            if args.fixDM:
+                kappa[:,self.dm_sl] = self.dm_fixed
+            elif args.dmSpecModel == 'powerlaw':
+                kappa[:,self.dm_sl] = powerlaw_spectrum(pars['Adm'][:,None],
+                                                        pars['gam_dm'][:,None],
+                                                        self.fdm_hz, self.Tspan)
+            elif args.dmSpecModel == 'spectrum':
+                kappa[:,self.dm_sl] = 10.0**(2.0*pars['dm_spec']) / self.Tspan
+
+        return kappa
+
+    def _gwb_spectrum(self, pars):
+        """
+        GWB spectrum, zero-padded over the DM and ephemeris bins.
+        """
+
+        args = self.args
+        Tspan = self.Tspan
+
+        spec = np.zeros(self.nfreqs)
+        if args.gwbSpecModel == 'powerlaw':
+            spec[self.red_sl] = powerlaw_spectrum(pars['Agwb'], pars['gam_gwb'],
+                                                  self.fred_hz, Tspan)
+        elif args.gwbSpecModel == 'spectrum':
+            if args.gwbPrior != 'gaussProc':
+                spec[self.red_sl] = 10.0**(2.0*pars['rho_spec']) / Tspan
+            elif args.gwbPrior == 'gaussProc':
+                rho_pred = np.zeros((self.nmodes_red,2))
+                for ii in range(self.nmodes_red):
+                    mu_pred, cov_pred = self.gp[ii].predict(self.gppkl[ii].y,
+                                                            pars['env_param'])
+                    if np.diag(cov_pred) < 0.0:
+                        rho_pred[ii,0], rho_pred[ii,1] = mu_pred, 1e-5 * mu_pred
+                    else:
+                        rho_pred[ii,0], rho_pred[ii,1] = mu_pred, np.sqrt(np.diag(cov_pred))
+
+                # transforming from zero-mean unit-variance variable to rho
+                rho = 2.0*np.log10(pars['Agwb']) - np.log10(Tspan) + \
+                  pars['rho_spec']*rho_pred[:,1] + rho_pred[:,0]
+                spec[self.red_sl] = 10.0**rho
+        elif args.gwbSpecModel == 'turnover':
+            spec[self.red_sl] = powerlaw_spectrum(pars['Agwb'], 13./3.,
+                                                  self.fred_hz, Tspan) / \
+              (1.0+(pars['fbend']/self.fred_hz)**pars['kappaturn'])
+
+        return spec
+
+    def _common_spectra(self, pars):
+        """
+        Spectra of the processes that are common to all pulsars, each
+        zero-padded to the full set of frequency bins.
+        """
+
+        args = self.args
+        Tspan = self.Tspan
+        spectra = {}
+
+        if args.incGWB:
+            spectra['gwb'] = self._gwb_spectrum(pars)
+
+        if args.incGWline:
+            spec = np.zeros(self.nfreqs)
+            idx = np.argmin(np.abs(self.fred_hz - pars['freq_gwline']))
+            spec[idx] = 10.0**(2.0*pars['spec_gwline']) / Tspan
+            spectra['gwline'] = spec
+
+        if args.incClk:
+            spec = np.zeros(self.nfreqs)
+            if args.clkSpecModel == 'powerlaw':
+                spec[self.red_sl] = powerlaw_spectrum(pars['Aclk'], pars['gam_clk'],
+                                                      self.fred_hz, Tspan)
+            elif args.clkSpecModel == 'spectrum':
+                spec[self.red_sl] = 10.0**(2.0*pars['clk_spec']) / Tspan
+            spectra['clk'] = spec
+
+        if args.incCm:
+            spec = np.zeros(self.nfreqs)
+            if args.cmSpecModel == 'powerlaw':
+                spec[self.red_sl] = powerlaw_spectrum(pars['Acm'], pars['gam_cm'],
+                                                      self.fred_hz, Tspan)
+            elif args.cmSpecModel == 'spectrum':
+                spec[self.red_sl] = 10.0**(2.0*pars['cm_spec']) / Tspan
+            spectra['cm'] = spec
+
+        if args.incEph:
+            spec = np.zeros(self.nfreqs)
+            if args.ephSpecModel == 'powerlaw':
+                spec[self.eph_sl] = powerlaw_spectrum(pars['Aeph'][:,None],
+                                                      pars['gam_eph'][:,None],
+                                                      self.feph_hz, Tspan).ravel()
+            elif args.ephSpecModel == 'spectrum':
+                spec[self.eph_sl] = 10.0**(2.0*pars['eph_spec']).ravel()
+            spectra['eph'] = spec
+
+        return spectra
+
+    ##########################
+    # Correlation kernels
+    ##########################
+
+    def _pad_orf(self, orf_red):
+        """
+        Place the GW-frequency ORFs into the full stack of frequency bins.
+        The projection of the GW spectrum onto the DM and ephemeris bins is
+        zero, so those ORFs stay empty.
+        """
+
+        ORF = np.zeros((self.nfreqs, self.npsr, self.npsr))
+        ORF[self.red_sl] = orf_red
+
+        return ORF
+
+    def _window_orfs(self, orf_wins):
+        """
+        Broadcast one ORF per frequency window onto its frequencies.
+        """
+
+        return self._pad_orf(np.repeat(orf_wins, self.win_counts, axis=0))
+
+    def _spharm_clm(self, orf_coeffs):
+        """
+        Reshape the anisotropy coefficients into per-window clm arrays.
+        Returns None if any window has an unphysical power distribution.
+        """
+
+        args = self.args
+
+        orf_coeffs = orf_coeffs.reshape((self.nwins, ((args.LMAX+1)**2)-1))
+        clm = np.zeros((self.nwins, (args.LMAX+1)**2))
+        clm[:,0] = 2.0*np.sqrt(np.pi)
+
+        if args.LMAX!=0:
+            clm[:,1:] = orf_coeffs
+            # Testing for physicality of power distribution in all windows.
+            if not args.noPhysPrior and \
+              utils.PhysPrior(clm, self.harm_sky_vals) == 'Unphysical':
+                return None
+
+        return clm
+
+    def _varylocs(self, orf_coeffs):
+        """
+        Pulsar sky-locations in each window of the psrlocsVary model.
+        """
+
+        orf_coeffs = orf_coeffs.reshape((2,self.nwins*self.npsr))
+        varyPhi = orf_coeffs[0,:].reshape((self.nwins,self.npsr))
+        varyTheta = np.arccos(orf_coeffs[1,:]).reshape((self.nwins,self.npsr))
+
+        return varyPhi, varyTheta
+
+    def _corr_orf(self, pars):
+        """
+        Frequency-dependent overlap reduction functions of the correlated
+        GWB, shape (nfreqs, npsr, npsr), taken from the constant ORF or the
+        ORF cache when possible. Returns None if the sample must be
+        rejected.
+        """
+
+        if self.const_orf is not None:
+            return self.const_orf
+
+        key = pars['orf_coeffs'].tostring()
+        if key in self.orf_cache:
+            ORF, orf_pars = self.orf_cache.pop(key)
+        else:
+            orf_pars = {'orf_coeffs': pars['orf_coeffs'].copy()}
+            ORF = self._compute_corr_orf(orf_pars)
+            if ORF is not None:
+                ORF.flags.writeable = False
+            while self.orf_cache and len(self.orf_cache) >= self.orf_cache_size:
+                self.orf_cache.popitem(last=False)
+
+        # most recently used entries are kept at the end
+        if self.orf_cache_size > 0:
+            self.orf_cache[key] = (ORF, orf_pars)
+        pars.update(orf_pars)
+
+        return ORF
+
+    def _compute_corr_orf(self, pars):
+        """
+        Compute the frequency-dependent overlap reduction functions of the
+        correlated GWB, shape (nfreqs, npsr, npsr). Returns None if the
+        sample must be rejected.
+        """
+
+        args = self.args
+        npsr = self.npsr
+        nwins = self.nwins
+        orf_coeffs = pars['orf_coeffs']
+
+        if args.gwbTypeCorr == 'modelIndep':
+
+            phi_corr = orf_coeffs.reshape((nwins,self.hsphere.npairs))
+            orf_wins = self.hsphere.corr(phi_corr)
+
+            # the Jacobian is computed from the final window
+            pars['phi_corr'] = phi_corr[-1]
+
+            return self._window_orfs(orf_wins)
+
+        elif args.gwbTypeCorr == 'pointSrc':
+
+            if args.fixPointSrcPhi is not None and args.fixPointSrcTheta is not None:
+                gwphi = np.tile(args.fixPointSrcPhi,nwins)
+                gwtheta = np.tile(args.fixPointSrcTheta,nwins)
+            else:
+                orf_coeffs = orf_coeffs.reshape((nwins,2))
+                gwphi, cosgwtheta = orf_coeffs[:,0], orf_coeffs[:,1]
+                gwtheta = np.arccos(cosgwtheta)
+
+            corr_curve = 4.0*np.pi * utils.pointsrc_orf(self.psrvec, gwtheta, gwphi)
+
+            return self._window_orfs(corr_curve)
+
+        elif args.gwbTypeCorr == 'spharmAnis':
+
+            clm = self._spharm_clm(orf_coeffs)
+            if clm is None:
+                return None
+
+            orf_wins = np.tensordot(clm, self.CorrCoeff, axes=(1,0))
+
+            return self._window_orfs(orf_wins)
+
+        elif args.gwbTypeCorr == 'dipoleOrf':
+
+            orf_coeffs = orf_coeffs.reshape((nwins,3))
+            dipphi, dipcostheta, dipwgt = \
+              orf_coeffs[:,0], orf_coeffs[:,1], orf_coeffs[:,2]
+            diptheta = np.arccos(dipcostheta)
+            dipvec = np.array([np.sin(diptheta)*np.cos(dipphi),
+                               np.sin(diptheta)*np.sin(dipphi),
+                               np.cos(diptheta)]).T
+
+            # maximal-dipole orf expression from Anholm et al. (2009)
+            gammaDip = utils.dipole_orf(self.psrvec, dipvec, self.dipole_kernel)
+
+            orf_wins = self.monoOrf + dipwgt[:,None,None]*gammaDip
+
+            return self._window_orfs(orf_wins)
+
+        elif args.gwbTypeCorr == 'custom':
+
+            if np.atleast_3d(self.customOrf.T).shape[-1]>1:
+                return self._pad_orf(self.customOrf[:self.nmodes_red])
+            else:
+                return self._pad_orf(self.customOrf)
+
+        elif args.gwbTypeCorr == 'gwDisk':
+
+            if self.gwdisk_response is None:
+                return self._window_orfs(np.tile(self.monoOrf, (nwins,1,1)))
+
+            orf_coeffs = orf_coeffs.reshape((nwins,4))
+            diskphi, diskcostheta, diskradius, diskwgt = \
+              orf_coeffs[:,0], orf_coeffs[:,1], orf_coeffs[:,2], orf_coeffs[:,3]
+            disktheta = np.arccos(diskcostheta)
+            diskvec = np.array([np.sin(disktheta)*np.cos(diskphi),
+                                np.sin(disktheta)*np.sin(diskphi),
+                                np.cos(disktheta)]).T
+
+            gammaDisk = np.zeros((nwins,npsr,npsr))
+            for kk in range(nwins):
+                m = np.ones(hp.nside2npix(nside=32))
+                qd = hp.query_disc(nside=hp.npix2nside(len(m)),
+                                   vec=diskvec[kk,:],
+                                   radius=diskradius[kk])
+                m[qd] *= 10.0**diskwgt[kk]
+                m /= np.mean(m)
+                gammaDisk[kk,:,:] = pixAnis.orfFromMap_fast(psr_locs=self.positions,
+                                                            usermap=m,
+                                                            response=self.gwdisk_response)
+
+            return self._window_orfs(gammaDisk)
+
+        elif args.gwbTypeCorr == 'psrlocsVary':
+
+            varyPhi, varyTheta = self._varylocs(orf_coeffs)
+
+            orf_wins = np.zeros((nwins,npsr,npsr))
+            for ii in range(nwins):
+                varyLocs = np.zeros((npsr,2))
+                varyLocs[:,0] = varyPhi[ii,:]
+                varyLocs[:,1] = varyTheta[ii,:]
+                varyLocs[0,:] = self.positions[0]
+                orf_wins[ii] = 2.0*np.sqrt(np.pi)*anis.CorrBasis(varyLocs,0)[0]
+
+            # the location prior is computed from the final window
+            pars['varyLocs'] = varyLocs
+
+            return self._window_orfs(orf_wins)
+
+        elif args.gwbTypeCorr == 'clock':
+
+            # clock signal is completely correlated
+            orf_wins = np.tile(np.ones((npsr,npsr)) + 1e-5*np.eye(npsr), (nwins,1,1))
+
+            return self._window_orfs(orf_wins)
+
+    def _gwline_orf(self, pars):
+        """
+        Point-source ORF of the GW line.
+        """
+
+        return utils.pointsrc_orf(self.psrvec, pars['theta_gwline'],
+                                  pars['phi_gwline'])[0]
+
+    ##########################
+    # Deterministic signals
+    ##########################
+
+    def _deterministic_signals(self, pars):
+        """
+        Deterministic signal model in every pulsar; None where the model
+        switches the signal off. With args.epochTOAs the signals are
+        evaluated on the epoch-averaged TOAs, one value per epoch.
+        """
+
+        args = self.args
+        npsr = self.npsr
+        signals = [None]*npsr
+
+        if args.cgw_search:
+
+            if args.ecc_search:
+                logmass, qr, logdist, loghstrain, logorbfreq, gwphi,\
+                  costheta, cosinc, gwpol, gwgamma0, l0, e0 = pars['cgw_params'][:12]
+            else:
+                logmass, qr, logdist, loghstrain, logorbfreq, gwphi,\
+                  costheta, cosinc, gwpol, gwgamma0, l0 = pars['cgw_params'][:11]
+
+            mc = 10.0**logmass
+            dist = 10.0**logdist
+            orbfreq = 10.0**logorbfreq
+            gwtheta = np.arccos(costheta)
+            gwinc = np.arccos(cosinc)
+
+            if args.psrTerm:
+                psrdists = pars['psrdists']
+                psrgp0 = pars['psrgp0']
+                psrlp0 = pars['psrlp0']
+            else:
+                psrdists = np.array([None]*npsr)
+                psrgp0 = np.array([None]*npsr)
+                psrlp0 = np.array([None]*npsr)
+
+            # Sometimes we might want to fix cgw parameters
+            if args.fixcgwFreq is not None:
+                orbfreq = 10**args.fixcgwFreq
+            if args.fixcgwPhi is not None:
+                gwphi = args.fixcgwPhi
+            if args.fixcgwTheta is not None:
+                gwtheta = args.fixcgwTheta
+
+            if args.ecc_search:
+                if args.fixcgwEcc is not None:
+                    e0 = args.fixcgwEcc
+            else:
+                e0 = 0.0
+
+            if args.cgwPrior == 'uniform' or args.cgwPrior == 'loguniform':
+                hstrain = pars['hstrain']
+            elif args.cgwPrior == 'mdloguniform':
+                hstrain = None
+
+            if not (args.cgwModelSelect and pars['nmodel'] == 0):
+
+                signals = utils.ecc_cgw_array_signal(self.psr, gwtheta, gwphi, mc,
+                                                     dist, hstrain, orbfreq,
+                                                     gwinc, gwpol, gwgamma0, e0,
+                                                     l0, qr, nmax=10000, pd=psrdists,
+                                                     gpx=psrgp0, lpx=psrlp0,
+                                                     periEv=args.periEv, psrTerm=args.psrTerm,
+                                                     tref=self.tref, epochTOAs=args.epochTOAs,
+                                                     noEccEvolve=args.noEccEvolve)
+
+        elif args.bwm_search:
+
+            for ii,p in enumerate(self.psr):
+                if not (args.bwm_model_select and pars['nmodel'] == 0):
+                    signals[ii] = utils.bwmsignal(pars['bwm_params'],p,
+                                                  antennaPattern=args.bwm_antenna,
+                                                  epochTOAs=args.epochTOAs)
+
+        if args.eph_quadratic:
+
+            xquad1_amp, xquad2_amp, \
+              yquad1_amp, yquad2_amp, \
+              zquad1_amp, zquad2_amp = pars['ephquad'][:6]
+            xquad1_sign, xquad2_sign, \
+              yquad1_sign, yquad2_sign, \
+              zquad1_sign, zquad2_sign = pars['ephquad'][6:]
+
+            # need to alter this if you want a single GW source also
+            for ii, p in enumerate(self.psr):
+
+                # define the pulsar position vector
+                x, y, z = self.psrvec[ii]
+
+                if args.epochTOAs:
+                    normtime = (p.detsig_avetoas - self.tref)/365.25
+                else:
+                    normtime = (p.toas - self.tref)/365.25
+                x_quad = (np.sign(xquad1_sign) * 10.0**xquad1_amp * normtime + \
+                          np.sign(xquad2_sign) * 10.0**xquad2_amp * normtime**2.0) * x
+                y_quad = (np.sign(yquad1_sign) * 10.0**yquad1_amp * normtime + \
+                          np.sign(yquad2_sign) * 10.0**yquad2_amp * normtime**2.0) * y
+                z_quad = (np.sign(zquad1_sign) * 10.0**zquad1_amp * normtime + \
+                          np.sign(zquad2_sign) * 10.0**zquad2_amp * normtime**2.0) * z
+
+                signals[ii] = x_quad + y_quad + z_quad
+
+        return signals
+
+    def _residual_products(self, signals):
+        """
+        White-noise products of the residuals after subtracting the
+        deterministic signals. These are linear and quadratic in the
+        signal s, so only its own products are computed on each call,
+
+            T^T N^-1 (r-s) = T^T N^-1 r - T^T N^-1 s
+            (r-s)^T N^-1 (r-s) = r^T N^-1 r - 2 r^T N^-1 s + s^T N^-1 s
+
+        with N^-1 s, r^T N^-1 s and s^T N^-1 s from one pass over the TOAs.
+        Epoch-averaged signals go straight through the projections of
+        _setup_epoch_projections instead.
+        """
+
+        epoch_signals = self.args.epochTOAs
+
+        dtmp = []
+        dtNdt = self.dtNdt.copy()
+        for ii,p in enumerate(self.psr):
+
+            sig = signals[ii]
+            if sig is None:
+                dtmp.append(self.d[ii])
+                continue
+
+            if epoch_signals:
+                TNs = np.dot(self.ep_TNU[ii], sig)
+                rNs = np.dot(self.ep_rNU[ii], sig)
+                sNs = np.dot(self.ep_UNU[ii], sig**2.0)
+            else:
+                if self.Jamp[ii] is not None:
+                    Ns, rNs, sNs = \
+                      jitter.cython_block_shermor_signal(sig, p.res, self.Nvec[ii],
+                                                         self.Jamp[ii], p.Uinds)
+                else:
+                    Ns = sig / self.Nvec[ii]
+                    rNs = np.dot(p.res, Ns)
+                    sNs = np.dot(sig, Ns)
+                TNs = np.dot(p.Te.T, Ns)
+
+            dtmp.append(self.d[ii] - TNs)
+            dtNdt[ii] += sNs - 2.0*rNs
+
+        loglike1 = -0.5 * np.sum(self.logdet_N + dtNdt)
+
+        return dtmp, loglike1
+
+    ##########################
+    # Sampled white noise
+    ##########################
+
+    def _white_state(self, ii, xwhite):
+        """
+        Noise vectors and every white-noise dependent product of pulsar ii
+        for its white-noise parameters [EFAC, log10 EQUAD, log10 ECORR].
+        """
+
+        p = self.psr[ii]
+        systems = self.white_systems[ii]
+        ecorrs = self.white_ecorrs[ii]
+        nsys = len(systems)
+
+        efac = xwhite[:nsys]
+        equad = 10.0**xwhite[nsys:2*nsys]
+        ecorr = 10.0**xwhite[2*nsys:]
+
+        scaled_err = (p.toaerrs).copy()
+        white_noise = np.zeros(len(scaled_err))
+        for jj,sysname in enumerate(systems):
+            scaled_err[systems[sysname]] *= efac[jj]
+            white_noise[systems[sysname]] = equad[jj]
+        self.Nvec[ii] = scaled_err**2.0 + white_noise**2.0
+
+        if len(ecorrs)>0:
+            Jamp = np.zeros(len(p.epflags))
+            for jj,nano_sysname in enumerate(ecorrs):
+                Jamp[ecorrs[nano_sysname]] = ecorr[jj]**2.0
+            self.Jamp[ii] = Jamp
+        else:
+            self.Jamp[ii] = None
+
+        state = {'Nvec': self.Nvec[ii], 'Jamp': self.Jamp[ii]}
+        state['TtNT'], state['d'], state['logdet_N'], state['dtNdt'] = \
+          self._white_noise_products(ii)
+
+        if self.args.det_signal and self.args.epochTOAs:
+            state['epoch'] = self._epoch_projection(ii)
+        self.TtNT[ii] = state['TtNT']
+        state['schur'] = self._schur_block(ii)
+
+        return state
+
+    def _update_white_noise(self, pars):
+        """
+        Bring the white-noise products up to date with the sampled
+        parameters. Only pulsars whose own white-noise parameters changed
+        are touched; their products come from a small per-pulsar cache
+        when the parameters were seen recently (e.g. after a rejected
+        jump), and are recomputed otherwise.
+        """
+
+        changed = False
+        for ii, xwhite in enumerate(pars['white']):
+
+            key = tuple(xwhite)
+            if key == self.white_keys[ii]:
+                continue
+
+            cache = self.white_cache[ii]
+            state = cache.pop(key, None)
+            if state is None:
+                state = self._white_state(ii, xwhite)
+            cache[key] = state
+            while len(cache) > self.white_cache_size:
+                cache.popitem(last=False)
+
+            self.Nvec[ii] = state['Nvec']
+            self.Jamp[ii] = state['Jamp']
+            self.TtNT[ii] = state['TtNT']
+            self.d[ii] = state['d']
+            self.logdet_N[ii] = state['logdet_N']
+            self.dtNdt[ii] = state['dtNdt']
+            if 'epoch' in state:
+                self.ep_TNU[ii], self.ep_rNU[ii], self.ep_UNU[ii] = state['epoch']
+            self._set_schur_block(ii, state['schur'])
+
+            self.white_keys[ii] = key
+            changed = True
+
+        if changed:
+            self.loglike1 = -0.5 * np.sum(self.logdet_N + self.dtNdt)
+            self.dF, self.tm_quad = self._schur_data(self.d)
+
+    ##########################
+    # Likelihood kernels
+    ##########################
+
+    def _loglike_uncorr(self, sigdiag, dF, tm_quad):
+        """
+        Likelihood when the Fourier-domain covariance is diagonal, so that
+        each pulsar can be treated on its own. With the timing model
+        marginalised (see _setup_schur) only the (mode_count) Fourier
+        system of each pulsar is factorised. Pulsars whose term inputs
+        did not change since a recent call are taken from the term cache.
+        """
+
+        logLike = 0.0
+        for ii in range(self.npsr):
+
+            cache = self.term_cache[ii]
+            if self.term_cache_size > 0:
+                key = (self.args.varyWhite and self.white_keys[ii],
+                       sigdiag[ii].tostring(), dF[ii].tostring(), tm_quad[ii])
+                if key in cache:
+                    term = cache.pop(key)
+                    cache[key] = term
+                    logLike += term
+                    continue
+
+            # compute sigma
+            Sigma = self.sigma_work
+            np.copyto(Sigma, self.tm_schur[ii])
+            Sigma[self.mode_inds,self.mode_inds] += 1./sigdiag[ii]
+
+            # cholesky decomp
+            try:
+
+                cf = sl.cho_factor(Sigma, overwrite_a=True)
+                expval2 = sl.cho_solve(cf, dF[ii])
+                logdet_Sigma = np.sum(2*np.log(np.diag(cf[0]))) + self.tm_logdet[ii]
+
+            except np.linalg.LinAlgError:
+
+                print 'Cholesky Decomposition Failed!!'
+                return -np.inf
+
+            logdet_Phi = np.sum(np.log(sigdiag[ii]))
+            term = -0.5 * (logdet_Phi + logdet_Sigma) + \
+              0.5 * (np.dot(dF[ii], expval2) + tm_quad[ii])
+            logLike += term
+
+            if self.term_cache_size > 0:
+                while len(cache) >= self.term_cache_size:
+                    cache.popitem(last=False)
+                cache[key] = term
+
+        return logLike
+
+    def _loglike_corr(self, smallMatrix, dF, tm_quad):
+        """
+        Likelihood with inter-pulsar correlations, given the stack of
+        (npsr x npsr) Fourier-domain covariance matrices at each frequency.
+        The sine and cosine modes of a frequency share the same matrix, so
+        it is factorised only once.
+        The timing model has already been marginalised (see _setup_schur),
+        so dF holds the Fourier-domain data vectors and tm_quad their
+        timing-model counterparts.
+        """
+
+        npsr = self.npsr
+        nm = self.mode_count
+
+        ###################################
+        # invert Phi matrix frequency-wise
+
+        try:
+
+            phiinv, logdet_Phi = batch_cho_inv(smallMatrix)
+
+        except np.linalg.LinAlgError:
+
+            ###################################################
+            # Break if we have non-positive-definiteness of Phi
+
+            print 'Cholesky Decomposition Failed!! Rejecting...'
+            return -np.inf
+
+        # sine and cosine modes
+        logdet_Phi = 2.0*np.sum(logdet_Phi)
+
+        # compute sigma
+        Sigma = self.bigSigma
+        np.copyto(Sigma, self.bigSchur)
+        Sigma.reshape((npsr, nm, npsr, nm))[:,self.mode_inds,:,self.mode_inds] += \
+          np.repeat(phiinv, 2, axis=0)
+
+        # cholesky decomp for second term in exponential
+        if self.args.use_gpu:
+
+            try:
+
+                Sigma_gpu = self.gpuarray.to_gpu( Sigma.astype(np.float64).copy() )
+                expval2_gpu = self.gpuarray.to_gpu( dF.ravel().astype(np.float64) )
+                self.culinalg.cho_solve( Sigma_gpu, expval2_gpu ) # in-place linear-algebra:
+                                                                  # Sigma and expval2 overwritten
+                logdet_Sigma = np.sum(2.0*np.log(np.diag(Sigma_gpu.get())))
+                expval2 = expval2_gpu.get()
+
+            except Exception:
+
+                print 'Cholesky Decomposition Failed (GPU error!!)'
+                return -np.inf
+
+        else:
+
+            try:
+
+                cf = sl.cho_factor(Sigma, overwrite_a=True)
+                expval2 = sl.cho_solve(cf, dF.ravel())
+                logdet_Sigma = np.sum(2*np.log(np.diag(cf[0])))
+
+            except np.linalg.LinAlgError:
+
+                print 'Cholesky Decomposition Failed second time!! Breaking...'
+                return -np.inf
+
+        logdet_Sigma += np.sum(self.tm_logdet)
+
+        return -0.5 * (logdet_Phi + logdet_Sigma) + \
+          0.5 * (np.dot(dF.ravel(), expval2) + np.sum(tm_quad))
+
+    def _loglike(self, pars):
+        """
+        Marginalised likelihood of the data given the noise and signal
+        hyperparameters.
+        """
+
+        args = self.args
+        npsr = self.npsr
+
+        if args.varyWhite:
+            self._update_white_noise(pars)
+
+        if args.det_signal:
+            signals = self._deterministic_signals(pars)
+            dtmp, loglike1 = self._residual_products(signals)
+            dF, tm_quad = self._schur_data(dtmp)
+        else:
+            dF, tm_quad, loglike1 = self.dF, self.tm_quad, self.loglike1
+
+        gwb_corr = args.incGWB and args.incCorr
+        if gwb_corr:
+            ORF = self._corr_orf(pars)
+            if ORF is None:
+                return -np.inf
+
+        if args.incGWline:
+            gwline_orf = self._gwline_orf(pars)
+
+        ###################################
+        # construct elements of sigma array
+
+        spectra = self._common_spectra(pars)
+        sigdiag = self._noise_spectra(pars)
+
+        if args.incGWB:
+            if gwb_corr and pars['gwb_modindex']==1:
+                sigdiag += np.einsum('kii->ik', ORF) * spectra['gwb']
+            else:
+                sigdiag += spectra['gwb']
+        if args.incGWline:
+            if args.incCorr:
+                sigdiag += np.diag(gwline_orf)[:,None] * spectra['gwline']
+            else:
+                sigdiag += spectra['gwline']
+        if args.incClk:
+            sigdiag += spectra['clk']
+        if args.incCm:
+            sigdiag += spectra['cm']
+        if args.incEph:
+            sigdiag += spectra['eph']
+
+        if not args.incCorr or not (args.incGWB or args.incGWline or args.incClk) or \
+          (args.incGWB and pars['gwb_modindex']==0
+           and not args.incGWline and not args.incClk):
+
+            # duplicate over the sine/cosine pairs
+            logLike = self._loglike_uncorr(np.repeat(sigdiag, 2, axis=1), dF, tm_quad)
+
+        else:
+
+            #####################
+            # compute Phi matrix
+
+            smallMatrix = np.zeros((self.nfreqs, npsr, npsr))
+            if args.incGWB and pars['gwb_modindex']==1:
+                smallMatrix += ORF * spectra['gwb'][:,None,None]
+            if args.incGWline:
+                smallMatrix += spectra['gwline'][:,None,None]
+            if args.incClk:
+                # clock errors are fully correlated
+                smallMatrix += spectra['clk'][:,None,None]
+            smallMatrix[:,self.diag_inds,self.diag_inds] = sigdiag.T
+
+            logLike = self._loglike_corr(smallMatrix, dF, tm_quad)
+
+        return logLike + loglike1
+
+    def _constlike(self, pars):
+        """
+        Constant likelihood (for sampling from the prior), still subject to
+        the physicality tests of the correlation models.
+        """
+
+        args = self.args
+
+        if args.incGWB and args.incCorr:
+            if args.gwbTypeCorr == 'spharmAnis':
+                if self._spharm_clm(pars['orf_coeffs']) is None:
+                    return -np.inf
+            elif args.gwbTypeCorr == 'psrlocsVary':
+                # constant likelihood for one window only
+                varyPhi, varyTheta = self._varylocs(pars['orf_coeffs'])
+                pars['varyLocs'] = np.array([varyPhi[0,:], varyTheta[0,:]]).T
+            elif args.gwbTypeCorr == 'modelIndep':
+                phi_corr = pars['orf_coeffs'].reshape((self.nwins,self.hsphere.npairs))
+                pars['phi_corr'] = phi_corr[-1]
+
+        return 0.0
+
+    ##########################
+    # Priors and Jacobians
+    ##########################
+
+    def _log_gauss_amp(self, Amp, mu, sig):
+        return np.log( np.exp( -0.5 * (np.log10(Amp) - mu)**2.0 / sig**2.0)
+                       / np.sqrt(2.0*np.pi*sig**2.0) / np.log(10.0) )
+
+    def _amp_prior(self, Amp, prior):
+        """
+        Jacobian of a sampled log10-amplitude for the requested amplitude
+        prior.
+        """
+
+        if prior == 'uniform':
+            return np.sum(np.log(Amp * np.log(10.0)))
+        elif prior == 'loguniform':
+            return 0.0
+        elif prior == 'sesana':
+            return self._log_gauss_amp(Amp, -15.0, 0.22)
+        elif prior == 'mcwilliams':
+            return self._log_gauss_amp(Amp, -14.4, 0.26)
+
+    def _log_prior_factor(self, pars):
+        """
+        Prior factors and Jacobians multiplying the likelihood.
+        """
+
+        args = self.args
+        npsr = self.npsr
+        logp = 0.0
+
+        if args.incGWB:
+            if args.gwbSpecModel in ['powerlaw', 'turnover']:
+                logp += self._amp_prior(pars['Agwb'], args.gwbPrior)
+            elif args.gwbSpecModel == 'spectrum':
+                if args.gwbPrior == 'uniform':
+                    logp += np.sum(np.log(10.0**pars['rho_spec'] * np.log(10.0)))
+                elif args.gwbPrior == 'gaussProc':
+                    logp += np.sum( - 0.5*np.log(2.0 * np.pi) - 0.5 * pars['rho_spec']**2.0)
+                    ### adding hyper prior on strain amplitude ###
+                    logp += self._amp_prior(pars['Agwb'], args.gwbHyperPrior)
+
+        if args.incGWline:
+            if args.gwlinePrior == 'uniform':
+                logp += np.log(10.0**pars['spec_gwline'] * np.log(10.0))
+
+        if not args.fixRed:
+            if args.redSpecModel == 'powerlaw':
+                logp += self._amp_prior(pars['Ared'], args.redPrior)
+            elif args.redSpecModel == 'spectrum':
+                logp += self._amp_prior(10.0**pars['red_spec'], args.redPrior)
+
+        if args.incDM and not args.fixDM:
+            if args.dmSpecModel == 'powerlaw':
+                logp += self._amp_prior(pars['Adm'], args.dmPrior)
+            elif args.dmSpecModel == 'spectrum':
+                logp += self._amp_prior(10.0**pars['dm_spec'], args.dmPrior)
+
+        if args.incClk:
+            if args.clkSpecModel == 'powerlaw':
+                logp += self._amp_prior(pars['Aclk'], args.clkPrior)
+            elif args.clkSpecModel == 'spectrum':
+                logp += self._amp_prior(10.0**pars['clk_spec'], args.clkPrior)
+
+        if args.incCm:
+            if args.cmSpecModel == 'powerlaw':
+                logp += self._amp_prior(pars['Acm'], args.cmPrior)
+            elif args.cmSpecModel == 'spectrum':
+                logp += self._amp_prior(10.0**pars['cm_spec'], args.cmPrior)
+
+        if args.incEph:
+            if args.ephSpecModel == 'powerlaw':
+                logp += self._amp_prior(pars['Aeph'], args.ephPrior)
+            elif args.ephSpecModel == 'spectrum':
+                logp += self._amp_prior(10.0**pars['eph_spec'], args.ephPrior)
+
+        if args.incGWB and args.incCorr:
+            if args.gwbTypeCorr == 'modelIndep':
+                if args.corrJacobian == 'full':
+                    logp += 0.5*self.hsphere.logjacobian(pars['phi_corr'])
+                elif args.corrJacobian == 'simple':
+                    logp += self.hsphere.logjacobian_simple(pars['phi_corr'])
+
+            ### Gaussian prior on modeled psr positions ###
+            ### Currently assumes only one frequency window ###
+            elif args.gwbTypeCorr == 'psrlocsVary':
+                varyLocs = pars['varyLocs']
+                dphi = varyLocs[:,0] - self.positions[:,0]
+                dtheta = varyLocs[:,1] - self.positions[:,1]
+                if args.psrlocsPrior == 'normal':
+                    sig = 0.5
+                    logp += np.sum(np.log( np.exp( -0.5 * dphi**2.0 / sig**2.0) / \
+                                           np.sqrt(2.0*np.pi*sig**2.0) ) + \
+                                   np.log( np.exp( -0.5 * dtheta**2.0 / sig**2.0) / \
+                                           np.sqrt(2.0*np.pi*sig**2.0) ))
+                elif args.psrlocsPrior == 'uniform':
+                    if not np.all((np.abs(dphi) <= 1.0) & (np.abs(dtheta) <= 1.0)):
+                        logp += -np.inf
+
+            ### Reweighting corr-vs-uncorr GWB models ###
+            ### to ensure proper mixing ###
+            if args.gwbModelSelect:
+                if pars['gwb_modindex'] == 0:
+                    logp += ( np.log( args.gwbCorrModWgt / (1.0 + args.gwbCorrModWgt) )
+                              - np.log(1.0/2.0) )
+                elif pars['gwb_modindex'] == 1:
+                    logp += ( np.log( 1.0 / (1.0 + args.gwbCorrModWgt) )
+                              - np.log(1.0/2.0) )
+
+        ### Jacobian and prior on cgw properties ###
+        if args.det_signal and args.cgw_search:
+            ### uniform prior ###
+            if args.cgwPrior == 'uniform':
+                logp += np.log(pars['hstrain'] * np.log(10.0))
+            ### pulsar distance prior ###
+            if args.psrTerm:
+                logp += np.sum( np.log( np.exp( -0.5 * (pars['psrdists'] - self.pdist)**2.0 /
+                                                self.pdistErr**2.0) / \
+                                        np.sqrt(2.0*np.pi*self.pdistErr**2.0) ) )
+
+        return logp
+
+    ##########################
+    # Evaluation
+    ##########################
+
+    def lnprob(self, xx):
+        """
+        Log-likelihood (including prior Jacobians) of parameter vector xx.
+        """
+
+        pars = self._unpack(xx)
+
+        if self.args.constLike:
+            logLike = self._constlike(pars)
+        else:
+            logLike = self._loglike(pars)
+
+        if logLike == -np.inf:
+            return -np.inf
+
+        return (1.0/self.args.softParam) * (logLike + self._log_prior_factor(pars))
+
+    __call__ = lnprob
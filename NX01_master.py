@@ -36,6 +36,7 @@ import libstempo as T2
 import NX01_AnisCoefficients as anis
 import NX01_utils as utils
 import NX01_psr
+import NX01_likelihood
 
 try:
     import NX01_jitter as jitter
@@ -89,6 +90,8 @@ parser.add_option('--jsonModel', dest='jsonModel', action='store', type=str, def
                    help='Do you want to provide model arguments from a JSON file? (default = None)')
 parser.add_option('--from-h5', dest='from_h5', action='store_true', default = False,
                    help='Do you want to read in pulsars from hdf5 files instead of directly via libstempo? (default = False)')
+parser.add_option('--h5Threads', dest='h5Threads', action='store', type=int, default=4,
+                   help='Number of threads used to read the pulsar hdf5 files (default = 4)')
 parser.add_option('--psrlist', dest='psrlist', action='store', type=str, default = None,
                    help='Provide path to file containing list of pulsars and their respective par/tim paths')
 parser.add_option('--sysflag_target', dest='sysflag_target', action='store', type=str, default = 'f',
@@ -122,7 +125,7 @@ parser.add_option('--softParam', dest='softParam', action='store', type=float, d
 parser.add_option('--incGWB', dest='incGWB', action='store_true', default=False,
                   help='Do you want to search for a GWB? (default = False)')
 parser.add_option('--gwbSpecModel', dest='gwbSpecModel', action='store', type=str, default='powerlaw',
-                  help='What kind of spectral model do you want for the GWB?: powerlaw, spectrum, turnover, gpEnvInterp (default = powerlaw)')
+                  help='What kind of spectral model do you want for the GWB?: powerlaw, spectrum, turnover (default = powerlaw)')
 parser.add_option('--fix_gwbTurnKappa', dest='fix_gwbTurnKappa', action='store', type=float, default=None,
                   help='Do you want to fix kappa in the turnover GWB spectral model to a particular value? (stars=10/3, gas=7/3) (default = \'None\')')
 parser.add_option('--gwb_fb2env', dest='gwb_fb2env', action='store', type=str, default=None,
@@ -181,6 +184,20 @@ parser.add_option('--lmax', dest='LMAX', action='store', type=int, default=0,
                    help='Maximum multipole in anisotropic search (default = 0, i.e. isotropic-search)')
 parser.add_option('--noPhysPrior', dest='noPhysPrior', action='store_true', default=False,
                    help='Switch off test for physicality of anisotropic coefficient sampling (default = False)')
+parser.add_option('--physPriorGrid', dest='physPriorGrid', action='store', type=int, default=40,
+                   help='Number of grid points in phi and cos(theta) for the anisotropy physicality test (default = 40)')
+parser.add_option('--physPriorNside', dest='physPriorNside', action='store', type=int, default=None,
+                   help='Use a HEALPix grid with this nside for the anisotropy physicality test; requires healpy (default = None)')
+parser.add_option('--corrBasisDir', dest='corrBasisDir', action='store', type=str, default=None,
+                   help='Directory in which to cache the anisotropy basis-functions (default = directory of the pulsar files)')
+parser.add_option('--noCorrBasisCache', dest='noCorrBasisCache', action='store_true', default=False,
+                   help='Always recompute the anisotropy basis-functions instead of caching them on disk (default = False)')
+parser.add_option('--likeProductsDir', dest='likeProductsDir', action='store', type=str, default=None,
+                   help='Directory in which to cache the per-pulsar likelihood products (default = directory of the pulsar files)')
+parser.add_option('--noLikeProductsCache', dest='noLikeProductsCache', action='store_true', default=False,
+                   help='Always recompute the per-pulsar likelihood products instead of caching them on disk (default = False)')
+parser.add_option('--corrBasisNcpus', dest='corrBasisNcpus', action='store', type=int, default=1,
+                   help='Number of processes used to compute the anisotropy basis-functions (default = 1)')
 parser.add_option('--use-gpu', dest='use_gpu', action='store_true', default=False,
                   help='Do you want to use the GPU for accelerated linear algebra? (default = False)')
 parser.add_option('--fix_slope', dest='fix_slope', action='store_true', default=False,
@@ -205,6 +222,8 @@ parser.add_option('--anis_modefile', dest='anis_modefile', action='store', type=
                    help='Do you want to provide an anisotropy modefile to split band into frequency windows?')
 parser.add_option('--noEcorr', dest='noEcorr', action='store_true', default=False,
                   help='Do you want to ignore correlated white noise terms in noise matrix? (default = False)')
+parser.add_option('--varyWhite', dest='varyWhite', action='store_true', default=False,
+                  help='Do you want to sample per-backend EFAC, EQUAD and ECORR for every pulsar, instead of fixing them at single-pulsar values? (default = False)')
 parser.add_option('--fixRed', dest='fixRed', action='store_true', default=False,
                   help='Do you want to perform a fixed power-law red-noise analysis? (default = False)')
 parser.add_option('--fixDM', dest='fixDM', action='store_true', default=False,
@@ -232,7 +251,7 @@ parser.add_option('--cgwModelSelect', dest='cgwModelSelect', action='store_true'
 parser.add_option('--ecc_search', dest='ecc_search', action='store_true', default=False,
                   help='Do you want to search for an eccentric binary? (default = False)')
 parser.add_option('--epochTOAs', dest='epochTOAs', action='store_true', default=False,
-                  help='Do you want to compute CGW waveforms with the averaged TOAs? (default = False)')
+                  help='Do you want to compute deterministic (CGW, BWM, eph_quadratic) signals with the averaged TOAs? (default = False)')
 parser.add_option('--psrTerm', dest='psrTerm', action='store_true', default=False,
                   help='Do you want to include the pulsar term in the continuous wave search? (default = False)')
 parser.add_option('--periEv', dest='periEv', action='store_true', default=False,
@@ -329,6 +348,11 @@ if args.jsonModel is not None:
     args.gwlinePrior = json_data['gwlinePrior']
     args.constLike = json_data['constLike']
 
+# The GP-interpolated spectral model is currently out of usage
+if args.incGWB and args.gwbSpecModel == 'gpEnvInterp':
+    parser.error("gwbSpecModel 'gpEnvInterp' is currently out of usage; "
+                 "choose powerlaw, spectrum or turnover")
+
 
 header = """\
 
@@ -390,20 +414,17 @@ psr_pathinfo = np.genfromtxt(args.psrlist, dtype=str, skip_header=2)
 
 if args.from_h5:
 
-    tmp_psr = []
-    
     if args.psrIndices is not None:
         psr_inds = [int(item) for item in args.psrIndices.split(',')]
-        for ii,tmp_name in zip(psr_inds,psr_pathinfo[psr_inds,0]):
-            tmp_psr.append(h5.File(psr_pathinfo[ii,1], 'r')[tmp_name])
-
     else:
-    
-        for ii,tmp_name in enumerate(psr_pathinfo[args.psrStartIndex:args.psrEndIndex,0],
-                                     start=args.psrStartIndex):
-            tmp_psr.append(h5.File(psr_pathinfo[ii,1], 'r')[tmp_name])
+        psr_inds = range(len(psr_pathinfo))[args.psrStartIndex:args.psrEndIndex]
 
-    psr = [NX01_psr.PsrObjFromH5(p) for p in tmp_psr]
+    # Grab all the pulsar quantities
+    # (TOA uncertainties are left unscaled when the white noise is sampled)
+    psr = NX01_psr.load_psrs_from_h5(psr_pathinfo[psr_inds,0], psr_pathinfo[psr_inds,1],
+                                     rescale=not args.varyWhite,
+                                     sysflag_target=args.sysflag_target,
+                                     nthreads=args.h5Threads)
     
 else:
     
@@ -420,9 +441,9 @@ else:
 
     psr = [NX01_psr.PsrObj(p) for p in t2psr]
 
-
-# Grab all the pulsar quantities
-[p.grab_all_vars(rescale=True, sysflag_target=args.sysflag_target) for p in psr]
+    # Grab all the pulsar quantities
+    # (TOA uncertainties are left unscaled when the white noise is sampled)
+    [p.grab_all_vars(rescale=not args.varyWhite, sysflag_target=args.sysflag_target) for p in psr]
 
 # Now, grab the positions and compute the ORF basis functions
 psr_positions = [np.array([psr[ii].psr_locs[0],
@@ -430,8 +451,25 @@ psr_positions = [np.array([psr[ii].psr_locs[0],
                            for ii in range(len(psr))]
 positions = np.array(psr_positions).copy()
 
+# The anisotropy basis-functions are cached next to the pulsar files
+# (only the root process writes; an unwritable directory skips the cache)
+if args.noCorrBasisCache:
+    corrbasis_dir = None
+elif args.corrBasisDir is not None:
+    corrbasis_dir = args.corrBasisDir
+elif args.from_h5:
+    corrbasis_dir = os.path.dirname(os.path.abspath(psr_pathinfo[0,1]))
+else:
+    corrbasis_dir = os.path.dirname(os.path.abspath(psr_pathinfo[0,2]))
+
 num_corr_params = 0
 evol_corr_tag = ''
+corr_modefreqs = None
+CorrCoeff = None
+harm_sky_vals = None
+monoOrf = None
+customOrf = None
+F_e = None
 if args.incGWB and args.incCorr:
     
     if args.gwbTypeCorr == 'modelIndep':
@@ -472,10 +510,16 @@ if args.incGWB and args.incCorr:
     elif args.gwbTypeCorr == 'spharmAnis':
         
         # Computing all the correlation basis-functions for the array.
-        CorrCoeff = np.array(anis.CorrBasis(positions,args.LMAX))
+        CorrCoeff = np.array(anis.CorrBasis(positions,args.LMAX,
+                                            cache_dir=corrbasis_dir,
+                                            write_cache=(rank==0),
+                                            ncpus=args.corrBasisNcpus))
         # Computing the values of the spherical-harmonics up to order
         # LMAX on a pre-specified grid  
-        harm_sky_vals = utils.SetupPriorSkyGrid(args.LMAX)              
+        harm_sky_vals = utils.SetupPriorSkyGrid(args.LMAX,
+                                                ngrid_phi=args.physPriorGrid,
+                                                ngrid_costheta=args.physPriorGrid,
+                                                nside=args.physPriorNside)
                                                             
         if args.anis_modefile is None:
         
@@ -507,7 +551,8 @@ if args.incGWB and args.incCorr:
 
     elif args.gwbTypeCorr == 'dipoleOrf':
 
-        monoOrf = 2.0*np.sqrt(np.pi)*anis.CorrBasis(positions,0)[0]
+        monoOrf = 2.0*np.sqrt(np.pi)*anis.CorrBasis(positions,0,cache_dir=corrbasis_dir,
+                                                    write_cache=(rank==0))[0]
 
         gwfreqs_per_win = int(1.*args.nmodes/(1.*args.nwins)) 
         corr_modefreqs = np.arange(1,args.nmodes+1)
@@ -551,7 +596,8 @@ if args.incGWB and args.incCorr:
             print "WARNING: Defaulting to H&D search..."
 
             hp = None
-            monoOrf = 2.0*np.sqrt(np.pi)*anis.CorrBasis(positions,0)[0]
+            monoOrf = 2.0*np.sqrt(np.pi)*anis.CorrBasis(positions,0,cache_dir=corrbasis_dir,
+                                                        write_cache=(rank==0))[0]
             num_corr_params = 0
 
         gwfreqs_per_win = int(1.*args.nmodes/(1.*args.nwins)) 
@@ -571,7 +617,8 @@ if args.incGWB and args.incCorr:
             " didn't give me an array file!"
             print "WARNING: Proceeding with Hellings and Downs..."
 
-            customOrf = 2.0*np.sqrt(np.pi)*anis.CorrBasis(positions,0)[0]
+            customOrf = 2.0*np.sqrt(np.pi)*anis.CorrBasis(positions,0,cache_dir=corrbasis_dir,
+                                                          write_cache=(rank==0))[0]
             
         elif args.userOrf is not None:
 
@@ -585,9 +632,11 @@ if args.incGWB and args.incCorr:
                     print "ERROR: Number of custom pulsar positions does not match " \
                       "the number of hdf5 files you gave me!"
                     print "ERROR: Proceeding with Hellings and Downs instead!"
-                    customOrf = 2.0*np.sqrt(np.pi)*anis.CorrBasis(positions,0)[0]
+                    customOrf = 2.0*np.sqrt(np.pi)*anis.CorrBasis(positions,0,cache_dir=corrbasis_dir,
+                                                                  write_cache=(rank==0))[0]
                 elif len(custom_positions)==len(psr):
-                    customOrf = 2.0*np.sqrt(np.pi)*anis.CorrBasis(custom_positions,0)[0]
+                    customOrf = 2.0*np.sqrt(np.pi)*anis.CorrBasis(custom_positions,0,cache_dir=corrbasis_dir,
+                                                                  write_cache=(rank==0))[0]
                     
             elif args.userOrf.split('.')[-1] == 'npy':
                 loadOrf = np.load(args.userOrf)
@@ -603,7 +652,8 @@ if args.incGWB and args.incCorr:
                 else:
                     print "ERROR: Dimensions don't match number of pulsars!"
                     print "ERROR: Proceeding with Hellings and Downs instead!"
-                    customOrf = 2.0*np.sqrt(np.pi)*anis.CorrBasis(positions,0)[0]
+                    customOrf = 2.0*np.sqrt(np.pi)*anis.CorrBasis(positions,0,cache_dir=corrbasis_dir,
+                                                                  write_cache=(rank==0))[0]
 
         num_corr_params = 0
 
@@ -648,6 +698,7 @@ fqs_red = np.linspace(1/Tmax, nmodes_red/Tmax, nmodes_red)
 
 ### Define number of DM-variation modes and set sampling frequencies
 nmodes_dm = args.nmodes_dm
+fqs_dm = None
 if args.incDM:
     if args.nmodes_dm is not None:
         nmodes_dm = args.nmodes_dm
@@ -657,6 +708,7 @@ if args.incDM:
 
 ### Define number of ephemeris-error modes and set sampling frequencies
 nmodes_eph = args.nmodes_eph
+fqs_eph = None
 if args.incEph:
     if args.nmodes_eph is not None:
         nmodes_eph = args.nmodes_eph
@@ -668,11 +720,39 @@ if args.incEph:
     elif args.ephFreqs is not None:
         fqs_eph = np.array([float(item) for item in args.ephFreqs.split(',')])
 
+### The basis matrices and white-noise products are cached next to the
+### pulsar files (random phase shifts are never reused; an unwritable
+### directory skips the cache)
+if args.noLikeProductsCache or args.pshift:
+    products_dir = None
+elif args.likeProductsDir is not None:
+    products_dir = args.likeProductsDir
+elif args.from_h5:
+    products_dir = os.path.dirname(os.path.abspath(psr_pathinfo[0,1]))
+else:
+    products_dir = os.path.dirname(os.path.abspath(psr_pathinfo[0,2]))
+
+products = [None]*len(psr)
+products_files = [None]*len(psr)
+if products_dir is not None:
+    products_config = (nmodes_red, Tmax, args.incDM, nmodes_dm,
+                       args.incEph, nmodes_eph, args.ephFreqs,
+                       args.sysflag_target)
+    for ii,p in enumerate(psr):
+        products_files[ii] = NX01_likelihood.products_cachefile(p, products_config,
+                                                                products_dir,
+                                                                noEcorr=args.noEcorr)
+        if os.path.isfile(products_files[ii]):
+            products[ii] = NX01_likelihood.load_products(products_files[ii])
+            p.Te = products[ii]['Te']
+            p.ranphase = products[ii]['ranphase']
+
 ### Make the basis matrices for all rank-reduced processes in model
 [p.makeTe(nmodes_red, Tmax, makeDM=args.incDM, nmodes_dm=nmodes_dm,
           makeEph=args.incEph, nmodes_eph=nmodes_eph, ephFreqs=args.ephFreqs,
-          phaseshift=args.pshift) for p in psr]
+          phaseshift=args.pshift) for ii,p in enumerate(psr) if products[ii] is None]
 
+tref = None
 if args.det_signal:
     # find reference time for all pulsars
     tt = [np.min(p.toas) for p in psr]
@@ -683,6 +763,7 @@ if args.det_signal:
 ############################################
 
 gp = []
+gppkl = None
 if args.incGWB:
     if args.gwbPrior == 'gaussProc' or \
       args.gwbSpecModel == 'gpEnvInterp':
@@ -710,6 +791,7 @@ if args.incGWB:
 # CONSTRUCT DIRECT MAPPING FROM FBEND TO ENVIRONMENT PARAMETER
 ###############################################################
 
+fb2env = None
 if args.incGWB and args.gwbSpecModel=='turnover' and args.gwb_fb2env is not None:
     
     class binary_env:
@@ -738,70 +820,29 @@ if args.incGWB and args.gwbSpecModel=='turnover' and args.gwb_fb2env is not None
 
     fb2env = binary_env(mechanism=args.gwb_fb2env)
 
-#######################################
-# PRE-COMPUTING WHITE NOISE PROPERTIES 
-#######################################
-
-loglike1 = 0
-logdet_N = []
-TtNT = []
-d = []
-Jamp = []
-for ii,p in enumerate(psr):
-
-    # compute ( T.T * N^-1 * T )
-    # & log determinant of N
-    new_err = (p.toaerrs).copy()
-    if not args.noEcorr:
-        
-        if p.ecorrs is not None and len(p.ecorrs)>0:
-
-            Jamp.append(np.ones(len(p.epflags)))
-            for jj,nano_sysname in enumerate(p.sysflagdict['nano-f'].keys()):
-                Jamp[ii][np.where(p.epflags==nano_sysname)] *= \
-                  p.ecorrs[nano_sysname]**2.0
-
-            Nx = jitter.cython_block_shermor_0D(p.res, new_err**2.,
-                                                Jamp[ii], p.Uinds)
-            d.append(np.dot(p.Te.T, Nx))
-            
-            logdet_N_dummy, TtNT_dummy = \
-              jitter.cython_block_shermor_2D(p.Te, new_err**2.,
-                                             Jamp[ii], p.Uinds)
-            logdet_N.append(logdet_N_dummy)
-            TtNT.append(TtNT_dummy)
-            
-            det_dummy, dtNdt = \
-              jitter.cython_block_shermor_1D(p.res, new_err**2.,
-                                             Jamp[ii], p.Uinds)
-
-        else:
-            
-            d.append(np.dot(p.Te.T, p.res/( new_err**2.0 )))
-            
-            N = 1./( new_err**2.0 )
-            right = (N*p.Te.T).T
-            TtNT.append(np.dot(p.Te.T, right))
-    
-            logdet_N.append(np.sum(np.log( new_err**2.0 )))
-        
-            # triple product in likelihood function
-            dtNdt = np.sum(p.res**2.0/( new_err**2.0 ))
-        
-    else:
-
-        d.append(np.dot(p.Te.T, p.res/( new_err**2.0 )))
-            
-        N = 1./( new_err**2.0 )
-        right = (N*p.Te.T).T
-        TtNT.append(np.dot(p.Te.T, right))
-
-        logdet_N.append(np.sum(np.log( new_err**2.0 )))
-        
-        # triple product in likelihood function
-        dtNdt = np.sum(p.res**2.0/( new_err**2.0 ))
+##############################################
+# PRE-COMPUTING THE LIKELIHOOD OF THIS MODEL
+##############################################
+
+like = NX01_likelihood.PTALikelihood(psr, args, fqs_red, fqs_dm=fqs_dm,
+                                     fqs_eph=fqs_eph,
+                                     corr_modefreqs=corr_modefreqs,
+                                     num_corr_params=num_corr_params,
+                                     CorrCoeff=CorrCoeff,
+                                     harm_sky_vals=harm_sky_vals,
+                                     monoOrf=monoOrf, customOrf=customOrf,
+                                     gwdisk_response=F_e, gp=gp,
+                                     gppkl=gppkl, fb2env=fb2env, tref=tref,
+                                     products=products)
 
-    loglike1 += -0.5 * (logdet_N[ii] + dtNdt)
+if rank == 0:
+    for ii,p in enumerate(psr):
+        if products_files[ii] is not None and products[ii] is None:
+            NX01_likelihood.save_products(products_files[ii], Te=p.Te,
+                                          ranphase=p.ranphase,
+                                          TtNT=like.TtNT[ii], d=like.d[ii],
+                                          logdet_N=like.logdet_N[ii],
+                                          dtNdt=like.dtNdt[ii])
 
 
 ##########################
@@ -922,6 +963,12 @@ if args.det_signal:
     if args.eph_quadratic:
         pmin = np.append(pmin,np.tile([-10.0,-10.0],3)) # amps
         pmin = np.append(pmin,np.tile([-1.0,-1.0],3)) # signs
+if args.varyWhite:
+    for ii in range(len(psr)):
+        # efacs, log10 equads, log10 ecorrs
+        pmin = np.append(pmin,0.001*np.ones(len(like.white_systems[ii])))
+        pmin = np.append(pmin,-10.0*np.ones(len(like.white_systems[ii])))
+        pmin = np.append(pmin,-8.5*np.ones(len(like.white_ecorrs[ii])))
         
 
 pmax = np.array([])
@@ -1032,6 +1079,12 @@ if args.det_signal:
     if args.eph_quadratic:
         pmax = np.append(pmax,np.tile([0.0,0.0],3)) # amps
         pmax = np.append(pmax,np.tile([1.0,1.0],3)) # signs
+if args.varyWhite:
+    for ii in range(len(psr)):
+        # efacs, log10 equads, log10 ecorrs
+        pmax = np.append(pmax,10.0*np.ones(len(like.white_systems[ii])))
+        pmax = np.append(pmax,-5.0*np.ones(len(like.white_systems[ii])))
+        pmax = np.append(pmax,-5.0*np.ones(len(like.white_ecorrs[ii])))
 
 ##################################################################################
 
@@ -1050,1590 +1103,8 @@ def my_prior(xx):
     
 def lnprob(xx):
 
-    npsr = len(psr)
-
-    logLike = 0
-    loglike1_tmp = loglike1
-    dtmp = list(d)
-
-    mode_count = 2*nmodes_red
-    if args.incDM:
-        mode_count += 2*nmodes_dm
-    if args.incEph:
-        # 2*nmode for x,y,z
-        mode_count += 6*nmodes_eph
-    
-    ###############################
-    # Splitting up parameter vector
-
-    param_ct = 0
-    
-    ###############################
-    # Including per-pulsar red noise
-    
-    if not args.fixRed:
-        if args.redSpecModel == 'powerlaw':
-            Ared = 10.0**xx[:npsr]
-            gam_red = xx[npsr:2*npsr]
-            param_ct += 2*npsr
-        elif args.redSpecModel == 'spectrum':
-            red_spec = (xx[:nmodes_red*npsr].copy()).reshape((npsr,nmodes_red))
-            param_ct += npsr*nmodes_red
-
-    ####################################
-    # Including per-pulsar DM variations
-    
-    if args.incDM and not args.fixDM:
-        if args.dmSpecModel == 'powerlaw':
-            Adm = 10.0**xx[param_ct:param_ct+npsr]
-            gam_dm = xx[param_ct+npsr:param_ct+2*npsr]
-            param_ct += 2*npsr
-        elif args.dmSpecModel == 'spectrum':
-            dm_spec = (xx[param_ct:param_ct+nmodes_dm*npsr].copy()).reshape((npsr,nmodes_dm))
-            param_ct += npsr*nmodes_dm
-
-    #########################################
-    # Including clock errors
-    
-    if args.incClk:
-        if args.clkSpecModel == 'powerlaw':
-            Aclk = 10.0**xx[param_ct]
-            gam_clk = xx[param_ct+1]
-            param_ct += 2
-        elif args.clkSpecModel == 'spectrum':
-            clk_spec = xx[param_ct:param_ct+nmodes_red].copy()
-            param_ct += nmodes_red
-
-    #########################################
-    # Including a common uncorrelated process
-    
-    if args.incCm:
-        if args.cmSpecModel == 'powerlaw':
-            Acm = 10.0**xx[param_ct]
-            gam_cm = xx[param_ct+1]
-            param_ct += 2
-        elif args.cmSpecModel == 'spectrum':
-            cm_spec = xx[param_ct:param_ct+nmodes_red].copy()
-            param_ct += nmodes_red
-
-    #########################################
-    # Including solar-system ephemeris errors
-    
-    if args.incEph:
-        if args.ephSpecModel == 'powerlaw':
-            Aephx = 10.0**xx[param_ct]
-            gam_ephx = xx[param_ct+1]
-            Aephy = 10.0**xx[param_ct+2]
-            gam_ephy = xx[param_ct+3]
-            Aephz = 10.0**xx[param_ct+4]
-            gam_ephz = xx[param_ct+5]
-            param_ct += 6
-        elif args.ephSpecModel == 'spectrum':
-            eph_spec = (xx[param_ct:param_ct+3*nmodes_eph].copy()).reshape((3,nmodes_eph))
-            param_ct += 3*nmodes_eph
-
-    ############################
-    # Including a GW background
-    
-    if args.incGWB:
-        # GWB parameters
-        if args.gwbSpecModel == 'powerlaw':
-            Agwb = 10.0**xx[param_ct]
-            param_ct += 1
-            if args.fix_slope:
-                gam_gwb = 13./3.
-            else:
-                gam_gwb = xx[param_ct]
-                param_ct += 1
-        elif args.gwbSpecModel == 'spectrum':
-            rho_spec = xx[param_ct:param_ct+nmodes_red]
-            param_ct += nmodes_red
-            if args.gwbPrior == 'gaussProc':
-                Agwb = 10.0**xx[param_ct]
-                env_param = xx[param_ct+1]
-                param_ct += 2
-        elif args.gwbSpecModel == 'turnover':
-            Agwb = 10.0**xx[param_ct]
-            if args.gwb_fb2env is not None:
-                kappaturn = fb2env.kappa
-                fbend = fb2env.fb_from_env(envParam=10.0**xx[param_ct+1])
-                param_ct += 2
-            elif args.gwb_fb2env is None:
-                kappaturn = xx[param_ct+1]
-                fbend = 10.0**xx[param_ct+2]
-                param_ct += 3
-        elif args.gwbSpecModel == 'gpEnvInterp':
-            Agwb = 10.0**xx[param_ct]
-            ecc = xx[param_ct+1]
-            param_ct += 2
-
-        gwb_modindex = 0
-        if args.incCorr:
-            # Anisotropy parameters
-            orf_coeffs = xx[param_ct:param_ct+num_corr_params]
-            param_ct += num_corr_params
-
-            if args.gwbModelSelect:
-                # '0' is uncorrelated GWB, '1' is correlated GWB
-                gwb_modindex = int(np.rint(xx[param_ct]))
-                param_ct += 1
-            elif not args.gwbModelSelect:
-                gwb_modindex = 1
-
-    ###############################
-    # Including a single GW line
-
-    if args.incGWline:
-        spec_gwline = xx[param_ct]
-        freq_gwline = 10.0**xx[param_ct+1]
-        phi_gwline = xx[param_ct+2]
-        theta_gwline = np.arccos(xx[param_ct+3])
-        param_ct += 4
-
-    ###############################
-    # Creating continuous GW signal
-
-    if args.det_signal:
-        if args.cgw_search:
-            if args.cgwModelSelect:
-                cgw_params = xx[param_ct:-1]
-                # '0' is noise-only, '1' is CGW
-                nmodel = int(np.rint(xx[-1]))
-            else:
-                cgw_params = xx[param_ct:]
-        elif args.bwm_search:
-            if args.bwm_model_select:
-                bwm_params = xx[param_ct:-1]
-                # '0' is noise-only, '1' is BWM
-                nmodel = int(np.rint(xx[-1]))
-            else:
-                bwm_params = xx[param_ct:]
-        # fix this for single GW signals as well as eph_quadratic
-        if args.eph_quadratic:
-            xquad1_amp, xquad2_amp, \
-              yquad1_amp, yquad2_amp, \
-              zquad1_amp, zquad2_amp = xx[param_ct:param_ct+6]
-            xquad1_sign, xquad2_sign, \
-              yquad1_sign, yquad2_sign, \
-              zquad1_sign, zquad2_sign = xx[param_ct+6:param_ct+12]
-            
-    ############################
-    ############################
-    # Now, evaluating likelihood
-
-    if args.constLike:
-
-        if args.incGWB and args.incCorr:
-            if args.gwbTypeCorr == 'spharmAnis':
-            
-                ################################################
-                # Reshaping freq-dependent anis coefficients,
-                # and testing for power distribution physicality.
-            
-                orf_coeffs = orf_coeffs.reshape((tmp_nwins,
-                                                ((args.LMAX+1)**2)-1))
-                clm = np.array([[0.0]*((args.LMAX+1)**2)
-                                for ii in range(tmp_nwins)])
-                clm[:,0] = 2.0*np.sqrt(np.pi)
-
-                if args.LMAX!=0:
-
-                    for kk in range(tmp_nwins):
-                        for ii in range(1,((args.LMAX+1)**2)):
-                            clm[kk,ii] = orf_coeffs[kk,ii-1]   
-
-                        if not args.noPhysPrior:
-                            # Testing for physicality of power distribution.
-                            if (utils.PhysPrior(clm[kk],harm_sky_vals) == 'Unphysical'):
-                                return -np.inf
-
-            elif args.gwbTypeCorr == 'psrlocsVary':
-
-                ################################################
-                # Reshaping freq-dependent corr coefficients
-                
-                orf_coeffs = orf_coeffs.reshape((2,tmp_nwins*len(psr)))
-                varyPhi = orf_coeffs[0,:].reshape((tmp_nwins,len(psr)))
-                varyTheta = np.arccos(orf_coeffs[1,:]).reshape((tmp_nwins,len(psr)))
-
-                # constant likelihood for one window only
-                varyLocs = np.zeros((len(psr),2))
-                varyLocs[:,0] = varyPhi[0,:]
-                varyLocs[:,1] = varyTheta[0,:]
-
-                logLike = 0.0
-
-            elif args.gwbTypeCorr == 'modelIndep':
-
-                npairs = int(npsr*(npsr-1)/2)
-                phi_corr = orf_coeffs.copy().reshape((tmp_nwins,npairs))
- 
-                for ii in range(tmp_nwins): # number of frequency windows
-                    for jj in range(len(corr_modefreqs[ii])): # number of frequencies in this window
-                        upper_triang = np.zeros((npsr,npsr))
-                        phi_els = np.array([[0.0]*kk for kk in range(1,npsr)])
-
-                        ct=0
-                        for aa in range(len(phi_els)):
-                            for bb in range(len(phi_els[aa])):
-                                phi_els[aa][bb] = phi_corr[ii,ct]
-                                ct += 1
-
-                        upper_triang[0,0] = 1.
-                        for bb in range(1,upper_triang.shape[1]):
-                            upper_triang[0,bb] = np.cos(phi_els[bb-1][0])
-                        for aa in range(1,upper_triang.shape[1]):
-                            upper_triang[aa,aa] = np.prod( np.sin(phi_els[aa-1]) )
-                        for aa in range(1,upper_triang.shape[1]):
-                            for bb in range(aa+1,upper_triang.shape[1]):
-                                upper_triang[aa,bb] = np.cos(phi_els[bb-1][aa]) * \
-                                np.prod( np.sin(np.array(phi_els[bb-1])[0:aa]) )
-
-                logLike = 0.0
-        
-        else:
-
-            logLike = 0.0
-        
-    elif not args.constLike:
-    
-        if args.det_signal:
-            if args.cgw_search:
-
-                if args.ecc_search:
-                    binary_params = 12
-                    logmass, qr, logdist, loghstrain, logorbfreq, gwphi,\
-                      costheta, cosinc, gwpol, gwgamma0, l0, e0 = cgw_params[:binary_params]
-                else:
-                    binary_params = 11
-                    logmass, qr, logdist, loghstrain, logorbfreq, gwphi,\
-                      costheta, cosinc, gwpol, gwgamma0, l0 = cgw_params[:binary_params]
-
-                mc = 10.0**logmass
-                dist = 10.0**logdist
-                hstrain = 10.0**loghstrain
-                orbfreq = 10.0**logorbfreq
-                gwtheta = np.arccos(costheta)
-                gwinc = np.arccos(cosinc)
-
-                if args.psrTerm:
-                    pterm_params = cgw_params[binary_params:]
-                    psrdists = pterm_params[:npsr]
-                    psrgp0 = pterm_params[npsr:2*npsr]
-                    psrlp0 = pterm_params[2*npsr:]
-                elif not args.psrTerm:
-                    psrdists = np.array([None]*npsr)
-                    psrgp0 = np.array([None]*npsr)
-                    psrlp0 = np.array([None]*npsr)
-            
-                cgw_res = []
-                detres = []
-
-                #########################
-                # Sometimes we might want
-                # to fix cgw parameters
-                
-                if args.fixcgwFreq is None:
-                    orbfreq_tmp = orbfreq
-                elif args.fixcgwFreq is not None:
-                    orbfreq_tmp = 10**args.fixcgwFreq
-
-                if args.fixcgwPhi is None:
-                    gwphi_tmp = gwphi
-                elif args.fixcgwPhi is not None:
-                    gwphi_tmp = args.fixcgwPhi
-
-                if args.fixcgwTheta is None:
-                    gwtheta_tmp = gwtheta
-                elif args.fixcgwTheta is not None:
-                    gwtheta_tmp = args.fixcgwTheta
-                
-                if args.ecc_search:
-                    if args.fixcgwEcc is None:
-                        ecc_tmp = e0
-                    elif args.fixcgwEcc is not None:
-                        ecc_tmp = args.fixcgwEcc
-                    gwgamma_tmp = gwgamma0
-                elif not args.ecc_search:
-                    ecc_tmp = 0.0
-                    gwgamma_tmp = gwgamma0
-
-                ########################
-
-                if args.cgwPrior == 'uniform' or args.cgwPrior == 'loguniform':
-                    hstrain_tmp = hstrain
-                elif args.cgwPrior == 'mdloguniform':
-                    hstrain_tmp = None
-                    
-                for ii,p in enumerate(psr):
-
-                    if args.cgwModelSelect and nmodel == 0:
-                        
-                        cgw_res.append( np.zeros(len(p.toas)) )
-                        
-                    elif (args.cgwModelSelect and nmodel == 1) or not args.cgwModelSelect:
-                           
-                        tmp_res = utils.ecc_cgw_signal(p, gwtheta_tmp, gwphi_tmp, mc,
-                                                    dist, hstrain_tmp, orbfreq_tmp,
-                                                    gwinc, gwpol, gwgamma_tmp, ecc_tmp,
-                                                    l0, qr, nmax=10000, pd=psrdists[ii],
-                                                    gpx=psrgp0[ii], lpx=psrlp0[ii],
-                                                    periEv=args.periEv, psrTerm=args.psrTerm,
-                                                    tref=tref, epochTOAs=args.epochTOAs,
-                                                    noEccEvolve=args.noEccEvolve)
-                    
-                        if args.epochTOAs:
-                            cgw_res.append(np.ones(len(p.toas)))
-                            for cc, swave in enumerate(tmp_res):
-                                cgw_res[ii][p.detsig_Uinds[cc,0]:p.detsig_Uinds[cc,1]] *= swave
-                        elif not args.epochTOAs:
-                            cgw_res.append(tmp_res)
-                        
-                    detres.append( p.res - cgw_res[ii] )
-
-
-            elif args.bwm_search:
-
-                bwm_res = []
-                detres = []
-                for ii,p in enumerate(psr):
-                    if args.bwm_model_select:
-                        if nmodel == 0:
-                            bwm_res.append( np.zeros(len(p.toas)) )
-                        elif nmodel == 1:
-                            bwm_res.append( utils.bwmsignal(bwm_params,p,
-                                                            antennaPattern=args.bwm_antenna) )
-                    else:
-                        bwm_res.append( utils.bwmsignal(bwm_params,p,
-                                                        antennaPattern=args.bwm_antenna) )
-                    detres.append( p.res - bwm_res[ii] )
-
-            if args.eph_quadratic:
-
-                detres = []
-                for ii, p in enumerate(psr):
-
-                    # define the pulsar position vector
-                    pphi = p.psr_locs[0]
-                    ptheta = np.pi/2. - p.psr_locs[1]
-                    x = np.sin(ptheta)*np.cos(pphi)
-                    y = np.sin(ptheta)*np.sin(pphi)
-                    z = np.cos(ptheta)
-
-                    normtime = (p.toas - tref)/365.25
-                    x_quad = (np.sign(xquad1_sign) * 10.0**xquad1_amp * normtime + \
-                              np.sign(xquad2_sign) * 10.0**xquad2_amp * normtime**2.0) * x
-                    y_quad = (np.sign(yquad1_sign) * 10.0**yquad1_amp * normtime + \
-                              np.sign(yquad2_sign) * 10.0**yquad2_amp * normtime**2.0) * y
-                    z_quad = (np.sign(zquad1_sign) * 10.0**zquad1_amp * normtime + \
-                              np.sign(zquad2_sign) * 10.0**zquad2_amp * normtime**2.0) * z
-
-                    # need to alter this if you want a single GW source also
-                    detres.append( p.res - x_quad - y_quad - z_quad )
-
-            #############################################################
-            # Recomputing some noise quantities involving 'residuals'.
-            # Unfortunately necessary when we have a deterministic signal.
-        
-            loglike1_tmp = 0
-            dtNdt = []
-            for ii,p in enumerate(psr):
-
-                # compute ( T.T * N^-1 * T )
-                # & log determinant of N
-                new_err = (p.toaerrs).copy()
-                if not args.noEcorr:
-        
-                    if p.ecorrs is not None and len(p.ecorrs)>0:
-                        Nx = jitter.cython_block_shermor_0D(detres[ii], new_err**2.,
-                                                            Jamp[ii], p.Uinds)
-                        dtmp[ii] = np.dot(p.Te.T, Nx)
-                        det_dummy, dtNdt_dummy = \
-                        jitter.cython_block_shermor_1D(detres[ii], new_err**2.,
-                                                        Jamp[ii], p.Uinds)
-                        dtNdt.append(dtNdt_dummy)
-
-                    else:
-            
-                        dtmp[ii] = np.dot(p.Te.T, detres[ii]/( new_err**2.0 ))
-                        dtNdt.append(np.sum(detres[ii]**2.0/( new_err**2.0 )))
-                
-                else:
-        
-                    dtmp[ii] = np.dot(p.Te.T, detres[ii]/( new_err**2.0 ))
-                    dtNdt.append(np.sum(detres[ii]**2.0/( new_err**2.0 )))
-        
-                loglike1_tmp += -0.5 * (logdet_N[ii] + dtNdt[ii])
-        
-        
-
-            
-        if args.incGWB and args.incCorr:
-            ## (option to de-restrict clms by phys prior)... and gwb_modindex==1:
-            
-            if args.gwbTypeCorr == 'modelIndep':
-
-                npairs = int(npsr*(npsr-1)/2)
-                phi_corr = orf_coeffs.copy().reshape((tmp_nwins,npairs))
-
-                ############################################################
-                # Computing frequency-dependent overlap reduction functions.
-
-                ORF=[]
-                for ii in range(tmp_nwins): # number of frequency windows
-                    for jj in range(len(corr_modefreqs[ii])): # number of frequencies in this window
-                        upper_triang = np.zeros((npsr,npsr))
-                        phi_els = np.array([[0.0]*kk for kk in range(1,npsr)])
-                        ct=0
-                        for aa in range(len(phi_els)):
-                            for bb in range(len(phi_els[aa])):
-                                phi_els[aa][bb] = phi_corr[ii,ct]
-                                ct += 1
-
-                        upper_triang[0,0] = 1.
-                        for bb in range(1,upper_triang.shape[1]):
-                            upper_triang[0,bb] = np.cos(phi_els[bb-1][0])
-                        for aa in range(1,upper_triang.shape[1]):
-                            upper_triang[aa,aa] = np.prod( np.sin(phi_els[aa-1]) )
-                        for aa in range(1,upper_triang.shape[1]):
-                            for bb in range(aa+1,upper_triang.shape[1]):
-                                upper_triang[aa,bb] = np.cos(phi_els[bb-1][aa]) * \
-                                np.prod( np.sin(np.array(phi_els[bb-1])[0:aa]) )   
-
-                        ORF.append(np.dot( upper_triang.T, upper_triang ))
-       
-                if args.incDM:
-                    for ii in range(nmodes_dm): 
-                        ORF.append( np.zeros((npsr,npsr)) )
-
-                if args.incEph:
-                    for kk in range(3): # x,y,z
-                        for ii in range(nmodes_eph):
-                            ORF.append( np.zeros((npsr,npsr)) )
-
-                ORF = np.array(ORF)
-                ORFtot = np.zeros((mode_count,npsr,npsr)) # shouldn't be applying ORF to dmfreqs,
-                                                          # but the projection of GW spec onto dmfreqs
-                                                          # is defined as zero below.
-                ORFtot[0::2] = ORF
-                ORFtot[1::2] = ORF
-
-            elif args.gwbTypeCorr == 'pointSrc':
-
-                if args.fixPointSrcPhi is not None and args.fixPointSrcTheta is not None:
-                    gwphi = np.tile(args.fixPointSrcPhi,tmp_nwins)
-                    gwtheta = np.tile(args.fixPointSrcTheta,tmp_nwins)
-                else:
-                    orf_coeffs = orf_coeffs.reshape((tmp_nwins,2))
-                    gwphi, cosgwtheta = orf_coeffs[:,0], orf_coeffs[:,1]
-                    gwtheta = np.arccos(cosgwtheta)
-
-                corr_curve=np.zeros((tmp_nwins,npsr,npsr))
-
-                Fp = np.zeros((tmp_nwins,npsr))
-                Fc = np.zeros((tmp_nwins,npsr))
-                for kk in range(tmp_nwins):
-                    for ii in range(npsr):
-                        Fp[kk,ii], Fc[kk,ii] = \
-                        utils.fplus_fcross(psr[ii], gwtheta[kk], gwphi[kk])
-
-                for kk in range(tmp_nwins):
-                    for ii in range(npsr):
-                        for jj in range(ii,npsr):
-                            corr_curve[kk,ii,jj] = 4.0*np.pi * (3.0/(8.0*np.pi)) * \
-                              (Fp[kk,ii]*Fp[kk,jj] + Fc[kk,ii]*Fc[kk,jj])
-                            corr_curve[kk,jj,ii] = corr_curve[kk,ii,jj]
-
-                            if ii == jj:
-                                # scaling for pulsar-term
-                                corr_curve[kk,ii,jj] *= 2.0
-
-                ORF=[]
-                for ii in range(tmp_nwins): # number of frequency windows
-                    for jj in range(len(corr_modefreqs[ii])): # number of frequencies in this window
-                        ORF.append( corr_curve[ii,:,:] )
-                    
-                if args.incDM:
-                    for ii in range(nmodes_dm):
-                        ORF.append( np.zeros((npsr,npsr)) )
-
-                if args.incEph:
-                    for kk in range(3): # x,y,z
-                        for ii in range(nmodes_eph): 
-                            ORF.append( np.zeros((npsr,npsr)) )
-
-                ORF = np.array(ORF)
-                ORFtot = np.zeros((mode_count,npsr,npsr)) # shouldn't be applying ORF to dmfreqs,
-                                                          # but the projection of GW spec onto dmfreqs
-                                                          # is defined as zero below.
-                ORFtot[0::2] = ORF
-                ORFtot[1::2] = ORF
-            
-            elif args.gwbTypeCorr == 'spharmAnis':
-            
-                ################################################
-                # Reshaping freq-dependent anis coefficients,
-                # and testing for power distribution physicality.
-            
-                orf_coeffs = orf_coeffs.reshape((tmp_nwins,
-                                                ((args.LMAX+1)**2)-1))
-                clm = np.array([[0.0]*((args.LMAX+1)**2)
-                                for ii in range(tmp_nwins)])
-                clm[:,0] = 2.0*np.sqrt(np.pi)
-
-                if args.LMAX!=0:
-
-                    for kk in range(tmp_nwins):
-                        for ii in range(1,((args.LMAX+1)**2)):
-                            clm[kk,ii] = orf_coeffs[kk,ii-1]   
-
-                        if not args.noPhysPrior:
-                            # Testing for physicality of power distribution.
-                            if (utils.PhysPrior(clm[kk],harm_sky_vals) == 'Unphysical'):
-                                return -np.inf
-
-                ############################################################
-                # Computing frequency-dependent overlap reduction functions.
-        
-                ORF=[]
-                for ii in range(tmp_nwins): # number of frequency windows
-                    for jj in range(len(corr_modefreqs[ii])): # number of frequencies in this window
-                        ORF.append( sum(clm[ii,kk]*CorrCoeff[kk]
-                                        for kk in range(len(CorrCoeff))) )
-                if args.incDM:
-                    for ii in range(nmodes_dm): 
-                        ORF.append( np.zeros((npsr,npsr)) )
-
-                if args.incEph:
-                    for kk in range(3): # x,y,z
-                        for ii in range(nmodes_eph):
-                            ORF.append( np.zeros((npsr,npsr)) )
-
-                ORF = np.array(ORF)
-                ORFtot = np.zeros((mode_count,npsr,npsr)) # shouldn't be applying ORF to dmfreqs,
-                                                          # but the projection of GW spec onto dmfreqs
-                                                          # is defined as zero below.
-                ORFtot[0::2] = ORF
-                ORFtot[1::2] = ORF
-
-            elif args.gwbTypeCorr == 'dipoleOrf':
-            
-                orf_coeffs = orf_coeffs.reshape((tmp_nwins,3))
-                dipphi, dipcostheta, dipwgt = \
-                  orf_coeffs[:,0], orf_coeffs[:,1], orf_coeffs[:,2]
-                diptheta = np.arccos(dipcostheta)
-                dipvec = np.array([np.sin(diptheta)*np.cos(dipphi),
-                                   np.sin(diptheta)*np.sin(dipphi),
-                                   np.cos(diptheta)]).T
-
-                psrvec = np.array([np.sin(positions[:,1])*np.cos(positions[:,0]),
-                                   np.sin(positions[:,1])*np.sin(positions[:,0]),
-                                   np.cos(positions[:,1])]).T
-
-                gammaDip = np.zeros((tmp_nwins,npsr,npsr))
-                for kk in range(tmp_nwins):
-                    for ii in range(npsr):
-                        for jj in range(ii,npsr):
-                            # dot product of psr and dipole position vectors
-                            cpsra = np.dot(psrvec[ii,:],dipvec[kk,:])
-                            cpsrb = np.dot(psrvec[jj,:],dipvec[kk,:])
-                            # angular separation between pulsars
-                            if ii==jj:
-                                zetaab = 0.0
-                            else:
-                                zetaab = np.arccos(np.dot(psrvec[ii,:],psrvec[jj,:]))
-
-                            # maximal-dipole orf expression from Anholm et al. (2009)
-                            gammaDip[kk,ii,jj] = (3.0/8.0) * (cpsra+cpsrb) * \
-                              ( np.cos(zetaab) - (4.0/3.0) - \
-                                4.0*np.tan(zetaab/2.)**2.0*np.log(np.sin(zetaab/2.)) ) 
-                           
-                            gammaDip[kk,jj,ii] = gammaDip[kk,ii,jj]
-
-                            if ii == jj:
-                                # scaling for pulsar-term
-                                gammaDip[kk,ii,jj] *= 2.0
-                
-
-                ############################################################
-                # Computing frequency-dependent overlap reduction functions.
-        
-                ORF=[]
-                for ii in range(tmp_nwins): # number of frequency windows
-                    for jj in range(len(corr_modefreqs[ii])): # number of frequencies in this window
-                        ORF.append( monoOrf + dipwgt[ii]*gammaDip[ii,:,:] )
-                        
-                if args.incDM:
-                    for ii in range(nmodes_dm): 
-                        ORF.append( np.zeros((npsr,npsr)) )
-
-                if args.incEph:
-                    for kk in range(3): # x,y,z
-                        for ii in range(nmodes_eph): 
-                            ORF.append( np.zeros((npsr,npsr)) )
-
-                ORF = np.array(ORF)
-                ORFtot = np.zeros((mode_count,npsr,npsr)) # shouldn't be applying ORF to dmfreqs,
-                                                          # but the projection of GW spec onto dmfreqs
-                                                          # is defined as zero below.
-                ORFtot[0::2] = ORF
-                ORFtot[1::2] = ORF
-
-            elif args.gwbTypeCorr == 'custom':
-            
-                ############################################################
-                # Computing frequency-dependent overlap reduction functions.
-        
-                ORF=[]
-                for ii in range(nmodes_red): # number of frequencies
-                    if np.atleast_3d(customOrf.T).shape[-1]>1:
-                        ORF.append( customOrf[ii,:,:] )
-                    else:
-                        ORF.append( customOrf )
-                        
-                if args.incDM:
-                    for ii in range(nmodes_dm): # number of frequencies
-                        ORF.append( np.zeros((npsr,npsr)) )
-
-                if args.incEph:
-                    for kk in range(3): # x,y,z
-                        for ii in range(nmodes_eph): # number of frequencies
-                            ORF.append( np.zeros((npsr,npsr)) )
-
-                ORF = np.array(ORF)
-                ORFtot = np.zeros((mode_count,npsr,npsr)) # shouldn't be applying ORF to dmfreqs
-                                                          # or ephemeris freqs, but the 
-                                                          # projection of GW spec onto dmfreqs
-                                                          # is defined as zero below.
-                ORFtot[0::2] = ORF
-                ORFtot[1::2] = ORF
-
-            elif args.gwbTypeCorr == 'gwDisk':
-            
-                ################################################
-                # Reshaping freq-dependent anis coefficients,
-                # and testing for power distribution physicality.
-
-                if hp is not None:
-                    orf_coeffs = orf_coeffs.reshape((tmp_nwins,4))
-                    diskphi, diskcostheta, diskradius, diskwgt = \
-                      orf_coeffs[:,0], orf_coeffs[:,1], orf_coeffs[:,2], orf_coeffs[:,3]
-                    disktheta = np.arccos(diskcostheta)
-                    diskvec = np.array([np.sin(disktheta)*np.cos(diskphi),
-                                        np.sin(disktheta)*np.sin(diskphi),
-                                        np.cos(disktheta)]).T
-
-                    gammaDisk = np.zeros((tmp_nwins,npsr,npsr))
-                    for kk in range(tmp_nwins):
-                        m = np.ones(hp.nside2npix(nside=32))
-                        qd = hp.query_disc(nside=hp.npix2nside(len(m)),
-                                           vec=diskvec[kk,:],
-                                           radius=diskradius[kk])
-                        m[qd] *= 10.0**diskwgt[kk]
-                        m /= np.mean(m)
-                        gammaDisk[kk,:,:] = pixAnis.orfFromMap_fast(psr_locs=positions,
-                                                                    usermap=m, response=F_e)
-
-                ############################################################
-                # Computing frequency-dependent overlap reduction functions.
-        
-                ORF=[]
-                for ii in range(tmp_nwins): # number of frequency windows
-                    for jj in range(len(corr_modefreqs[ii])): # number of frequencies in this window
-                        if hp is not None:
-                            ORF.append( gammaDisk[ii,:,:] )
-                        elif hp is None:
-                            ORF.append( monoOrf )
-                        
-                if args.incDM:
-                    for ii in range(nmodes_dm):
-                        ORF.append( np.zeros((npsr,npsr)) )
-
-                if args.incEph:
-                    for kk in range(3): # x,y,z
-                        for ii in range(nmodes_eph): 
-                            ORF.append( np.zeros((npsr,npsr)) )
-
-                ORF = np.array(ORF)
-                ORFtot = np.zeros((mode_count,npsr,npsr)) # shouldn't be applying ORF to dmfreqs,
-                                                          # but the projection of GW spec onto dmfreqs
-                                                          # is defined as zero below.
-                ORFtot[0::2] = ORF
-                ORFtot[1::2] = ORF
-
-            elif args.gwbTypeCorr == 'psrlocsVary':
-            
-                ################################################
-                # Reshaping freq-dependent anis coefficients,
-                # and testing for power distribution physicality.
-            
-                orf_coeffs = orf_coeffs.reshape((2,tmp_nwins*len(psr)))
-                varyPhi = orf_coeffs[0,:].reshape((tmp_nwins,len(psr)))
-                varyTheta = np.arccos(orf_coeffs[1,:]).reshape((tmp_nwins,len(psr)))
-
-                ############################################################
-                # Computing frequency-dependent overlap reduction functions.
-        
-                ORF=[]
-                for ii in range(tmp_nwins): # number of frequency windows
-                    varyLocs = np.zeros((len(psr),2))
-                    varyLocs[:,0] = varyPhi[ii,:]
-                    varyLocs[:,1] = varyTheta[ii,:]
-                    varyLocs[0,:] = psr[0].psr_locs[0], np.pi/2. - psr[0].psr_locs[1]
-                    monoOrf = 2.0*np.sqrt(np.pi)*anis.CorrBasis(varyLocs,0)[0]
-                    for jj in range(len(corr_modefreqs[ii])): # number of frequencies in this window
-                        ORF.append( monoOrf )
-                        
-                if args.incDM:
-                    for ii in range(nmodes_dm): 
-                        ORF.append( np.zeros((npsr,npsr)) )
-
-                if args.incEph:
-                    for kk in range(3): # x,y,z
-                        for ii in range(nmodes_eph): 
-                            ORF.append( np.zeros((npsr,npsr)) )
-
-                ORF = np.array(ORF)
-                ORFtot = np.zeros((mode_count,npsr,npsr)) # shouldn't be applying ORF to dmfreqs,
-                                                          # but the projection of GW spec onto dmfreqs
-                                                          # is defined as zero below.
-                ORFtot[0::2] = ORF
-                ORFtot[1::2] = ORF
-                
-            elif args.gwbTypeCorr == 'clock':
-
-                ORF=[]
-                for ii in range(tmp_nwins): # number of frequency windows
-                    for jj in range(len(corr_modefreqs[ii])): # number of frequencies in this window
-                        ORF.append( np.ones((npsr,npsr)) + 1e-5*np.diag(np.ones(npsr)) ) # clock signal is completely correlated
-                        
-                if args.incDM:
-                    for ii in range(nmodes_dm): 
-                        ORF.append( np.zeros((npsr,npsr)) )
-
-                if args.incEph:
-                    for kk in range(3): # x,y,z
-                        for ii in range(nmodes_eph): 
-                            ORF.append( np.zeros((npsr,npsr)) )
-
-                ORF = np.array(ORF)
-                ORFtot = np.zeros((mode_count,npsr,npsr)) # shouldn't be applying ORF to dmfreqs,
-                                                          # but the projection of GW spec onto dmfreqs
-                                                          # is defined as zero below.
-                ORFtot[0::2] = ORF
-                ORFtot[1::2] = ORF
-            
-
-        if args.incGWline:
-    
-            gwline_orf = np.zeros((npsr,npsr))
-
-            Fp = np.zeros(npsr)
-            Fc = np.zeros(npsr)
-            for ii in range(npsr):
-                Fp[ii], Fc[ii] = utils.fplus_fcross(psr[ii], theta_gwline, phi_gwline)
-        
-            for ii in range(npsr):
-                for jj in range(ii,npsr):
-                    gwline_orf[ii,jj] = (3.0/(8.0*np.pi)) * (Fp[ii]*Fp[jj] + Fc[ii]*Fc[jj])
-                    gwline_orf[jj,ii] = gwline_orf[ii,jj]
-
-                    if ii == jj:
-                        # scaling for pulsar-term
-                        gwline_orf[ii,jj] *= 2.0
-        
-        ################################################
-        # parameterize intrinsic red noise as power law
-    
-        Tspan = (1/fqs_red[0])*86400.0
-
-        # parameterize intrinsic red-noise and DM-variations
-        kappa = []
-        for ii in range(npsr):
-        
-            # Construct red noise signal
-            if args.fixRed:
-                Ared_tmp = np.max([psr[ii].Redamp, psr[ii].parRedamp])
-                gam_red_tmp = np.max([psr[ii].Redind, psr[ii].parRedind])
-
-                red_kappa_tmp = np.log10( Ared_tmp**2/12/np.pi**2 * \
-                                    f1yr**(gam_red_tmp-3) * \
-                                    (fqs_red/86400.0)**(-gam_red_tmp)/Tspan )
-            
-            if not args.fixRed:
-                if args.redSpecModel == 'powerlaw':
-                    Ared_tmp = Ared[ii]
-                    gam_red_tmp = gam_red[ii]
-                    
-                    red_kappa_tmp = np.log10( Ared_tmp**2/12/np.pi**2 * \
-                                            f1yr**(gam_red_tmp-3) * \
-                                            (fqs_red/86400.0)**(-gam_red_tmp)/Tspan )
-                elif args.redSpecModel == 'spectrum':
-                    red_kappa_tmp = np.log10( 10.0**(2.0*red_spec[ii,:]) / Tspan)
-
-            # Construct DM-variations signal (if appropriate)
-            if args.incDM:
-                if args.fixDM:
-                    Adm_tmp = np.max([psr[ii].DMamp, psr[ii].parDMamp])
-                    gam_dm_tmp = np.max([psr[ii].DMind, psr[ii].parDMind])
-                    
-                    dm_kappa_tmp = np.log10( Adm_tmp**2/12/np.pi**2 * \
-                                            f1yr**(gam_dm_tmp-3) * \
-                                            (fqs_dm/86400.0)**(-gam_dm_tmp)/Tspan )
-
-                if not args.fixDM:
-                    if args.dmSpecModel == 'powerlaw':
-                        Adm_tmp = Adm[ii]
-                        gam_dm_tmp = gam_dm[ii]
-                    
-                        dm_kappa_tmp = np.log10( Adm_tmp**2/12/np.pi**2 * \
-                                                f1yr**(gam_dm_tmp-3) * \
-                                                (fqs_dm/86400.0)**(-gam_dm_tmp)/Tspan )
-                    elif args.dmSpecModel == 'spectrum':
-                        dm_kappa_tmp = np.log10( 10.0**(2.0*dm_spec[ii,:]) / Tspan)
-
-            if not args.incDM:
-                dm_kappa_tmp = np.array([])
-
-            if args.incEph:
-                eph_padding = np.zeros(3*nmodes_eph)
-            elif not args.incEph:
-                eph_padding = np.array([])
-
-            # Now create total red signal for each pulsar
-            kappa.append(np.concatenate((10**red_kappa_tmp,
-                                         10**dm_kappa_tmp,
-                                         eph_padding)))
-    
-                
-        ###################################
-        # construct elements of sigma array
-    
-        sigdiag = []
-        if args.incGWB:
-
-            if args.gwbSpecModel == 'powerlaw':
-                rho = np.log10(Agwb**2/12/np.pi**2 * \
-                            f1yr**(gam_gwb-3) * \
-                            (fqs_red/86400.0)**(-gam_gwb)/Tspan)
-            elif args.gwbSpecModel == 'spectrum':
-                if args.gwbPrior != 'gaussProc':
-                    rho = np.log10( 10.0**(2.0*rho_spec) / Tspan )
-                elif args.gwbPrior == 'gaussProc':
-                    rho_pred = np.zeros((len(fqs_red),2))
-                    for ii,freq in enumerate(fqs_red):
-                        mu_pred, cov_pred = gp[ii].predict(gppkl[ii].y, env_param)
-                        if np.diag(cov_pred) < 0.0:
-                            rho_pred[ii,0], rho_pred[ii,1] = mu_pred, 1e-5 * mu_pred
-                        else:
-                            rho_pred[ii,0], rho_pred[ii,1] = mu_pred, np.sqrt(np.diag(cov_pred))
-
-                    # transforming from zero-mean unit-variance variable to rho
-                    rho = 2.0*np.log10(Agwb) - np.log10(Tspan) + rho_spec*rho_pred[:,1] + rho_pred[:,0]
-                    
-            elif args.gwbSpecModel == 'turnover':
-                rho = np.log10(Agwb**2/12/np.pi**2 * \
-                            f1yr**(13.0/3.0-3.0) * \
-                            (fqs_red/86400.0)**(-13.0/3.0) / \
-                            (1.0+(fbend*86400.0/fqs_red)**kappaturn)/Tspan)
-            elif args.gwbSpecModel == 'gpEnvInterp':
-                #### CURRENTLY OUT OF USAGE ####
-                '''
-                hc_pred = np.zeros((len(fqs_red),2))
-                for ii,freq in enumerate(fqs_red):
-                    hc_pred[ii,0], mse = gp[ii].gp.predict(ecc, eval_MSE=True)
-                    hc_pred[ii,1] = np.sqrt(mse)
-
-                if not args.incCosVar:
-                    hc = Agwb * hc_pred[:,0]
-                elif args.incCosVar:
-                    hc = Agwb * (hc_pred[:,0] + np.random.normal(0.0,1.0,len(fqs_red)) * hc_pred[:,1])
-
-                rho = np.log10( hc**2 / (12.0*np.pi**2.0) / (fqs_red/86400.0)**3.0 / Tspan )
-
-                '''
-
-
-            if args.incDM:
-                dm_padding = np.zeros(nmodes_dm)
-            elif not args.incDM:
-                dm_padding = np.array([])
-                
-            if args.incEph:
-                eph_padding = np.zeros(3*nmodes_eph)
-            elif not args.incEph:
-                eph_padding = np.array([])
-                    
-            gwbspec = np.concatenate( (10**rho, dm_padding, eph_padding) )
-            
-            if args.incCorr:
-                sig_gwboffdiag = []
-
-        if args.incGWline:
-        
-            rho_line = np.zeros(nmodes_red)
-            idx = np.argmin(np.abs(fqs_red/86400.0 - freq_gwline))
-            rho_line[idx] = 10.0**(2.0*spec_gwline) / Tspan
-
-            if args.incDM:
-                dm_padding = np.zeros(nmodes_dm)
-            elif not args.incDM:
-                dm_padding = np.array([])
-            
-            if args.incEph:
-                eph_padding = np.zeros(3*nmodes_eph)
-            elif not args.incEph:
-                eph_padding = np.array([])
-            
-            gwline_spec = np.concatenate( (rho_line,
-                                           dm_padding,
-                                           eph_padding) )
-           
-            if args.incCorr:
-                sig_gwlineoffdiag = []
-
-
-        if args.incClk:
-
-            if args.clkSpecModel == 'powerlaw':
-                kappa_clk = np.log10(Aclk**2/12/np.pi**2 * \
-                            f1yr**(gam_clk-3) * \
-                            (fqs_red/86400.0)**(-gam_clk)/Tspan)
-            elif args.clkSpecModel == 'spectrum':
-                kappa_clk = np.log10( 10.0**(2.0*clk_spec) / Tspan )
-
-
-            if args.incDM:
-                dm_padding = np.zeros(nmodes_dm)
-            elif not args.incDM:
-                dm_padding = np.array([])
-                
-            if args.incEph:
-                eph_padding = np.zeros(3*nmodes_eph)
-            elif not args.incEph:
-                eph_padding = np.array([])
-                    
-            clkspec = np.concatenate( (10**kappa_clk,
-                                       dm_padding,
-                                       eph_padding) )
-
-            if args.incCorr:
-                sig_clkoffdiag = []
-
-
-        if args.incCm:
-
-            if args.cmSpecModel == 'powerlaw':
-                kappa_cm = np.log10(Acm**2/12/np.pi**2 * \
-                            f1yr**(gam_cm-3) * \
-                            (fqs_red/86400.0)**(-gam_cm)/Tspan)
-            elif args.cmSpecModel == 'spectrum':
-                kappa_cm = np.log10( 10.0**(2.0*cm_spec) / Tspan )
-
-
-            if args.incDM:
-                dm_padding = np.zeros(nmodes_dm)
-            elif not args.incDM:
-                dm_padding = np.array([])
-                
-            if args.incEph:
-                eph_padding = np.zeros(3*nmodes_eph)
-            elif not args.incEph:
-                eph_padding = np.array([])
-                    
-            cmspec = np.concatenate( (10**kappa_cm, dm_padding, eph_padding) )
-    
-                
-        if args.incEph:
-
-            if args.ephSpecModel == 'powerlaw':
-                kappa_ephx = np.log10(Aephx**2/12/np.pi**2 * \
-                                      f1yr**(gam_ephx-3) * \
-                                      (fqs_eph/86400.0)**(-gam_ephx)/Tspan)
-                kappa_ephy = np.log10(Aephy**2/12/np.pi**2 * \
-                                      f1yr**(gam_ephy-3) * \
-                                      (fqs_eph/86400.0)**(-gam_ephy)/Tspan)
-                kappa_ephz = np.log10(Aephz**2/12/np.pi**2 * \
-                                      f1yr**(gam_ephz-3) * \
-                                      (fqs_eph/86400.0)**(-gam_ephz)/Tspan)
-            elif args.ephSpecModel == 'spectrum':
-                kappa_ephx = np.log10( 10.0**(2.0*eph_spec[0,:]))
-                kappa_ephy = np.log10( 10.0**(2.0*eph_spec[1,:]))
-                kappa_ephz = np.log10( 10.0**(2.0*eph_spec[2,:]))
-
-            red_padding = np.zeros(nmodes_red)
-            if args.incDM:
-                dm_padding = np.zeros(nmodes_dm)
-            elif not args.incDM:
-                dm_padding = np.array([])
-
-            eph_kappa = np.concatenate( (red_padding, dm_padding,
-                                         10**kappa_ephx, 10**kappa_ephy,
-                                         10**kappa_ephz) )
-        
-
-        for ii in range(npsr):
-            tot = np.zeros(mode_count)
-
-            # diagonal terms
-            tot[0::2] = kappa[ii]
-            tot[1::2] = kappa[ii] 
-
-            if args.incGWB:
-            
-                if args.incCorr and gwb_modindex==1:
-                
-                    offdiag = np.zeros(mode_count)
-
-                    # off diagonal terms
-                    offdiag[0::2] = gwbspec
-                    offdiag[1::2] = gwbspec
-
-                    # diagonal terms
-                    tot[0::2] += ORF[:,ii,ii]*gwbspec
-                    tot[1::2] += ORF[:,ii,ii]*gwbspec
-
-                    sig_gwboffdiag.append(offdiag)
-                
-                if not args.incCorr or gwb_modindex==0:
-                    
-                    # diagonal terms
-                    tot[0::2] += gwbspec
-                    tot[1::2] += gwbspec
-
-            if args.incGWline:
-            
-                if args.incCorr:
-                
-                    offdiag = np.zeros(mode_count)
-
-                    # off diagonal terms
-                    offdiag[0::2] = gwline_spec
-                    offdiag[1::2] = gwline_spec
-
-                    # diagonal terms
-                    tot[0::2] += gwline_orf[ii,ii]*gwline_spec
-                    tot[1::2] += gwline_orf[ii,ii]*gwline_spec
-
-                    sig_gwlineoffdiag.append(offdiag)
-                
-                if not args.incCorr:
-                
-                    # diagonal terms
-                    tot[0::2] += gwline_spec
-                    tot[1::2] += gwline_spec
-
-            if args.incClk:
-            
-                if args.incCorr:
-                
-                    offdiag = np.zeros(mode_count)
-
-                    # off diagonal terms
-                    # [clock errors are full correlated]
-                    offdiag[0::2] = clkspec
-                    offdiag[1::2] = clkspec
-
-                    # diagonal terms
-                    tot[0::2] += clkspec
-                    tot[1::2] += clkspec
-
-                    sig_clkoffdiag.append(offdiag)
-                
-                if not args.incCorr:
-                
-                    # diagonal terms
-                    tot[0::2] += clkspec
-                    tot[1::2] += clkspec
-
-            if args.incCm:
-
-                # diagonal terms
-                tot[0::2] += cmspec
-                tot[1::2] += cmspec
-
-            if args.incEph:
-
-                # diagonal terms
-                tot[0::2] += eph_kappa
-                tot[1::2] += eph_kappa
-                
-                
-            # fill in lists of arrays
-            sigdiag.append(tot)
-
-
-        ###############################################
-        # Computing Phi and Sigma matrices without GWB
-    
-        if not args.incGWB and not args.incGWline and not args.incClk:
-
-            for ii,p in enumerate(psr):
-            
-                # compute Phi inverse 
-                red_phi = np.diag(1./sigdiag[ii])
-                logdet_Phi = np.sum(np.log(sigdiag[ii]))
+    return like(xx)
 
-                # now fill in real covariance matrix
-                Phi = np.zeros( TtNT[ii].shape ) 
-                for kk in range(0,mode_count):
-                    Phi[kk+p.Gc.shape[1],kk+p.Gc.shape[1]] = red_phi[kk,kk]
-
-                # symmeterize Phi
-                Phi = Phi + Phi.T - np.diag(np.diag(Phi))
-    
-                # compute sigma
-                Sigma = TtNT[ii] + Phi
-                
-                # cholesky decomp 
-                try:
-                    
-                    cf = sl.cho_factor(Sigma)
-                    expval2 = sl.cho_solve(cf, dtmp[ii])
-                    logdet_Sigma = np.sum(2*np.log(np.diag(cf[0])))
-
-                except np.linalg.LinAlgError:
-                
-                    print 'Cholesky Decomposition Failed!!'
-                    return -np.inf
-                
-                logLike += -0.5 * (logdet_Phi + logdet_Sigma) + \
-                0.5 * (np.dot(dtmp[ii], expval2))
-
-            logLike += loglike1_tmp
-        
-
-        if args.incGWB or args.incGWline or args.incClk:
-    
-            if not args.incCorr or (args.incCorr and args.incGWB and gwb_modindex==0
-                                    and not args.incGWline and not args.incClk):
-            
-                for ii,p in enumerate(psr):
-            
-                    # compute Phi inverse 
-                    red_phi = np.diag(1./sigdiag[ii])
-                    logdet_Phi = np.sum(np.log(sigdiag[ii]))
-
-                    # now fill in real covariance matrix
-                    Phi = np.zeros( TtNT[ii].shape ) 
-                    for kk in range(0,mode_count):
-                        Phi[kk+p.Gc.shape[1],kk+p.Gc.shape[1]] = red_phi[kk,kk]
-
-                    # symmeterize Phi
-                    Phi = Phi + Phi.T - np.diag(np.diag(Phi))
-    
-                    # compute sigma
-                    Sigma = TtNT[ii] + Phi
-
-                    # cholesky decomp 
-                    try:
-                    
-                        cf = sl.cho_factor(Sigma)
-                        expval2 = sl.cho_solve(cf, dtmp[ii])
-                        logdet_Sigma = np.sum(2*np.log(np.diag(cf[0])))
-
-                    except np.linalg.LinAlgError:
-                        
-                        print 'Cholesky Decomposition Failed!!'
-                        return -np.inf
-                
-                    logLike += -0.5 * (logdet_Phi + logdet_Sigma) + \
-                    0.5 * (np.dot(dtmp[ii], expval2))
-
-                logLike += loglike1_tmp
-
-            elif args.incCorr:
-        
-                #####################
-                # compute Phi matrix
-
-                smallMatrix = np.zeros((mode_count, npsr, npsr))
-                for ii in range(npsr):
-                    for jj in range(ii,npsr):
-
-                        if ii == jj:
-                            smallMatrix[:,ii,jj] = sigdiag[jj] 
-                        else:
-                            if args.incGWB and gwb_modindex==1:
-                                smallMatrix[:,ii,jj] += ORFtot[:,ii,jj] * sig_gwboffdiag[jj]
-                            if args.incGWline:
-                                smallMatrix[:,ii,jj] += sig_gwlineoffdiag[jj]
-                            if args.incClk:
-                                smallMatrix[:,ii,jj] += sig_clkoffdiag[jj]
-                            smallMatrix[:,jj,ii] = smallMatrix[:,ii,jj]
-    
-                ###################################
-                # invert Phi matrix frequency-wise
-    
-                logdet_Phi = 0
-                for ii in range(mode_count):
-
-                    try:
-    
-                        L = sl.cho_factor(smallMatrix[ii,:,:])
-                        smallMatrix[ii,:,:] = sl.cho_solve(L, np.eye(npsr))
-                        logdet_Phi += np.sum(2*np.log(np.diag(L[0])))
-
-                    except np.linalg.LinAlgError:
-    
-                        ###################################################
-                        # Break if we have non-positive-definiteness of Phi
-            
-                        print 'Cholesky Decomposition Failed!! Rejecting...'
-                        return -np.inf
-
-
-                bigTtNT = sl.block_diag(*TtNT)
-                Phi = np.zeros_like( bigTtNT )
-    
-                # now fill in real covariance matrix
-                ind = [0]
-                ind = np.append(ind,np.cumsum([TtNT[ii].shape[0]
-                                            for ii in range(npsr)]))
-                ind = [np.arange(ind[ii]+psr[ii].Gc.shape[1],
-                                ind[ii]+psr[ii].Gc.shape[1]+mode_count)
-                                for ii in range(len(ind)-1)]
-                for ii in range(npsr):
-                    for jj in range(npsr):
-                        Phi[ind[ii],ind[jj]] = smallMatrix[:,ii,jj]
-            
-                # compute sigma
-                Sigma = bigTtNT + Phi
-            
-                # cholesky decomp for second term in exponential
-                if args.use_gpu:
-
-                    try:
-                
-                        dtmp = np.concatenate(dtmp)
-                        Sigma_gpu = gpuarray.to_gpu( Sigma.astype(np.float64).copy() )
-                        expval2_gpu = gpuarray.to_gpu( dtmp.astype(np.float64).copy() )
-                        culinalg.cho_solve( Sigma_gpu, expval2_gpu ) # in-place linear-algebra:
-                                                                     # Sigma and expval2 overwritten
-                        logdet_Sigma = np.sum(2.0*np.log(np.diag(Sigma_gpu.get())))
-
-                    except cula.culaDataError:
-    
-                        print 'Cholesky Decomposition Failed (GPU error!!)'
-                        return -np.inf
-
-                    logLike = -0.5 * (logdet_Phi + logdet_Sigma) + \
-                      0.5 * (np.dot(dtmp, expval2_gpu.get() )) + \
-                      loglike1_tmp
-            
-                else:
-        
-                    try:
-
-                        dtmp = np.concatenate(dtmp)
-                        cf = sl.cho_factor(Sigma)
-                        expval2 = sl.cho_solve(cf, dtmp)
-                        logdet_Sigma = np.sum(2*np.log(np.diag(cf[0])))
-
-                    except np.linalg.LinAlgError:
-                    
-                        print 'Cholesky Decomposition Failed second time!! Breaking...'
-                        return -np.inf
-
-
-                    logLike = -0.5 * (logdet_Phi + logdet_Sigma) + \
-                      0.5 * (np.dot(dtmp, expval2)) + \
-                      loglike1_tmp
-
-    
-
-    ################################################
-    # Multiplying likelihood by appropriate Jacobian
-    
-    if args.incGWB:
-        ### powerlaw spectral model ###
-        if args.gwbSpecModel == 'powerlaw':
-            if args.gwbPrior == 'uniform':
-                priorfac_gwb = np.log(Agwb * np.log(10.0))
-            elif args.gwbPrior == 'loguniform':
-                priorfac_gwb = 0.0
-            elif args.gwbPrior == 'sesana':
-                mu = -15.0
-                sig = 0.22
-                priorfac_gwb = np.log( np.exp( -0.5 * (np.log10(Agwb) - mu)**2.0 / sig**2.0)
-                                    / np.sqrt(2.0*np.pi*sig**2.0) / np.log(10.0) )
-            elif args.gwbPrior == 'mcwilliams':
-                mu = -14.4
-                sig = 0.26
-                priorfac_gwb = np.log( np.exp( -0.5 * (np.log10(Agwb) - mu)**2.0 / sig**2.0)
-                                    / np.sqrt(2.0*np.pi*sig**2.0) / np.log(10.0) )
-                
-        ### free spectral model ###
-        elif args.gwbSpecModel == 'spectrum':
-            if args.gwbPrior == 'uniform':
-                priorfac_gwb = np.sum(np.log(10.0**rho_spec * np.log(10.0)))
-            elif args.gwbPrior == 'loguniform':
-                priorfac_gwb = 0.0
-            elif args.gwbPrior == 'gaussProc':
-                '''
-                hc_pred = np.zeros((len(fqs_red),2))
-                for ii,freq in enumerate(fqs_red):
-                    hc_pred[ii,0], mse = gp[ii].predict(ecc, eval_MSE=True)
-                    hc_pred[ii,1] = np.sqrt(mse)
-                psd_mean = Agwb**2.0 * hc_pred[:,0]**2.0 / (12.0*np.pi**2.0) / (fqs_red/86400.0)**3.0 / Tspan
-                psd_std = 2.0 * psd_mean * hc_pred[:,1] / hc_pred[:,0]
-
-                priorfac_gwb = np.sum( np.log(2.0 * 10.0**rho * np.log(10.0))
-                                       - 0.5*np.log(2.0 * np.pi * psd_std**2.0)
-                                       - 0.5*(10.0**rho - psd_mean)**2.0 / psd_std**2.0  )
-                '''
-                priorfac_gwb = np.sum( - 0.5*np.log(2.0 * np.pi) - 0.5 * rho_spec**2.0)
-
-                ### adding hyper prior on strain amplitude ###
-                if args.gwbHyperPrior == 'uniform':
-                    priorfac_gwb += np.log(Agwb * np.log(10.0))
-                elif args.gwbHyperPrior == 'loguniform':
-                    priorfac_gwb += 0.0
-                elif args.gwbHyperPrior == 'sesana':
-                    mu = -15.0
-                    sig = 0.22
-                    priorfac_gwb += np.log( np.exp( -0.5 * (np.log10(Agwb) - mu)**2.0 / sig**2.0)
-                                        / np.sqrt(2.0*np.pi*sig**2.0) / np.log(10.0) )
-                elif args.gwbHyperPrior == 'mcwilliams':
-                    mu = -14.4
-                    sig = 0.26
-                    priorfac_gwb += np.log( np.exp( -0.5 * (np.log10(Agwb) - mu)**2.0 / sig**2.0)
-                                        / np.sqrt(2.0*np.pi*sig**2.0) / np.log(10.0) )
-                    
-                
-        ### turnover spectral model ###
-        elif args.gwbSpecModel == 'turnover':
-            if args.gwbPrior == 'uniform':
-                priorfac_gwb = np.log(Agwb * np.log(10.0))
-            elif args.gwbPrior == 'loguniform':
-                priorfac_gwb = 0.0
-            elif args.gwbPrior == 'sesana':
-                mu = -15.0
-                sig = 0.22
-                priorfac_gwb = np.log( np.exp( -0.5 * (np.log10(Agwb) - mu)**2.0 / sig**2.0)
-                                    / np.sqrt(2.0*np.pi*sig**2.0) / np.log(10.0) )
-            elif args.gwbPrior == 'mcwilliams':
-                mu = -14.4
-                sig = 0.26
-                priorfac_gwb = np.log( np.exp( -0.5 * (np.log10(Agwb) - mu)**2.0 / sig**2.0)
-                                    / np.sqrt(2.0*np.pi*sig**2.0) / np.log(10.0) )
-            
-
-        ### gp interpolation spectral model ###
-        elif args.gwbSpecModel == 'gpEnvInterp':
-            #### CURRENTLY OUT OF USAGE ####
-            '''
-            if args.gwbPrior == 'uniform':
-                priorfac_gwb = np.log(Agwb * np.log(10.0))
-            elif args.gwbPrior == 'loguniform':
-                priorfac_gwb = 0.0
-            elif args.gwbPrior == 'sesana':
-                mu = -15.0
-                sig = 0.22
-                priorfac_gwb = np.log( np.exp( -0.5 * (np.log10(Agwb) - mu)**2.0 / sig**2.0)
-                                    / np.sqrt(2.0*np.pi*sig**2.0) / np.log(10.0) )
-            elif args.gwbPrior == 'mcwilliams':
-                mu = -14.4
-                sig = 0.26
-                priorfac_gwb = np.log( np.exp( -0.5 * (np.log10(Agwb) - mu)**2.0 / sig**2.0)
-                                    / np.sqrt(2.0*np.pi*sig**2.0) / np.log(10.0) )
-            '''
-                
-    elif not args.incGWB:
-        priorfac_gwb = 0.0
-         
-
-    if args.incGWline:
-        if args.gwlinePrior == 'uniform':
-            priorfac_gwline = np.log(10.0**spec_gwline * np.log(10.0))
-        elif args.gwlinePrior == 'loguniform':
-            priorfac_gwline = 0.0
-    elif not args.incGWline:
-        priorfac_gwline = 0.0
-        
-
-    if not args.fixRed:
-        ### powerlaw spectral model ###
-        if args.redSpecModel == 'powerlaw':
-            if args.redPrior == 'uniform':
-                priorfac_red = np.sum(np.log(Ared * np.log(10.0)))
-            elif args.redPrior == 'loguniform':
-                priorfac_red = 0.0
-        ### free spectral model ###
-        elif args.redSpecModel == 'spectrum':
-            if args.redPrior == 'uniform':
-                priorfac_red = np.sum(np.log(10.0**red_spec * np.log(10.0)))
-            elif args.redPrior == 'loguniform':
-                priorfac_red = 0.0
-    elif args.fixRed:
-        priorfac_red = 0.0
-        
-
-    if args.incDM and not args.fixDM:
-        ### powerlaw spectral model ###
-        if args.dmSpecModel == 'powerlaw':
-            if args.dmPrior == 'uniform':
-                priorfac_dm = np.sum(np.log(Adm * np.log(10.0)))
-            elif args.dmPrior == 'loguniform':
-                priorfac_dm = 0.0
-        ### free spectral model ###
-        elif args.dmSpecModel == 'spectrum':
-            if args.dmPrior == 'uniform':
-                priorfac_dm = np.sum(np.log(10.0**dm_spec * np.log(10.0)))
-            elif args.dmPrior == 'loguniform':
-                priorfac_dm = 0.0
-    elif args.fixDM or not args.incDM:
-        priorfac_dm = 0.0
-
-
-    if args.incClk:
-        ### powerlaw spectral model ###
-        if args.clkSpecModel == 'powerlaw':
-            if args.clkPrior == 'uniform':
-                priorfac_clk = np.log(Aclk * np.log(10.0)) 
-            elif args.clkPrior == 'loguniform':
-                priorfac_clk = 0.0
-        ### free spectral model ###
-        elif args.clkSpecModel == 'spectrum':
-            if args.clkPrior == 'uniform':
-                priorfac_clk = np.sum(np.log(10.0**clk_spec * np.log(10.0)))
-            elif args.clkPrior == 'loguniform':
-                priorfac_clk = 0.0
-    elif not args.incClk:
-        priorfac_clk = 0.0
-
-
-    if args.incCm:
-        ### powerlaw spectral model ###
-        if args.cmSpecModel == 'powerlaw':
-            if args.cmPrior == 'uniform':
-                priorfac_cm = np.log(Acm * np.log(10.0)) 
-            elif args.cmPrior == 'loguniform':
-                priorfac_cm = 0.0
-        ### free spectral model ###
-        elif args.cmSpecModel == 'spectrum':
-            if args.cmPrior == 'uniform':
-                priorfac_cm = np.sum(np.log(10.0**cm_spec * np.log(10.0)))
-            elif args.cmPrior == 'loguniform':
-                priorfac_cm = 0.0
-    elif not args.incCm:
-        priorfac_cm = 0.0
-        
-
-    if args.incEph:
-        ### powerlaw spectral model ###
-        if args.ephSpecModel == 'powerlaw':
-            if args.ephPrior == 'uniform':
-                priorfac_eph = np.log(Aephx * np.log(10.0)) + \
-                  np.log(Aephy * np.log(10.0)) + \
-                  np.log(Aephz * np.log(10.0)) 
-            elif args.ephPrior == 'loguniform':
-                priorfac_eph = 0.0
-        ### free spectral model ###
-        elif args.ephSpecModel == 'spectrum':
-            if args.ephPrior == 'uniform':
-                priorfac_eph = np.sum(np.log(10.0**eph_spec[0,:] * np.log(10.0))) + \
-                  np.sum(np.log(10.0**eph_spec[1,:] * np.log(10.0))) + \
-                  np.sum(np.log(10.0**eph_spec[2,:] * np.log(10.0)))
-            elif args.ephPrior == 'loguniform':
-                priorfac_eph = 0.0
-    elif not args.incEph:
-        priorfac_eph = 0.0
-
-    priorfac_corr = 0.0
-    if args.incGWB and args.incCorr:
-        if args.gwbTypeCorr == 'modelIndep':
-            jacobian = np.zeros((npairs,npairs))
-            if args.corrJacobian == 'full':
-                ct = 0
-                for ii in range(len(phi_els)):
-                    for jj in range(len(phi_els[ii])):
-                        
-                        dummy_utriang = upper_triang[jj:,ii+1].copy()
-                        dummy_utriang[0] = -np.sin(phi_els[ii][jj]) * dummy_utriang[0] / np.cos(phi_els[ii][jj])
-                        dummy_utriang[1:] = np.cos(phi_els[ii][jj]) * dummy_utriang[1:] / np.sin(phi_els[ii][jj])
-    
-                        dummy_utriang = np.append(np.zeros(len(upper_triang[:jj,ii+1])), dummy_utriang)
-    
-                        deriv = np.zeros_like(upper_triang)
-                        deriv[:,ii+1] = np.dot(upper_triang.T, dummy_utriang)
-                        deriv = deriv + deriv.T
-
-                        jacobian[:,ct] = deriv[np.triu_indices(npsr,k=1)] 
-                        ct += 1
-
-                tmp = np.linalg.slogdet(jacobian)
-                priorfac_corr = 0.5*tmp[1] 
-            elif args.corrJacobian == 'simple':
-                priorfac_corr = np.sum(np.log(np.abs(np.array([-np.sin(phi_els[ii][0])
-                                                               for ii in range(len(phi_els))]))))
-            else:
-                priorfac_corr = 0.0
-
-        ### Gaussian prior on modeled psr positions ###
-        ### Currently assumes only one frequency window ###
-        elif args.gwbTypeCorr == 'psrlocsVary':
-            priorfac_corr = 0.0
-            for ii,p in enumerate(psr):
-                if args.psrlocsPrior == 'normal':
-                    sig = 0.5
-                    priorfac_corr += np.log( np.exp( -0.5 * (varyLocs[ii,0] - p.psr_locs[0])**2.0 / sig**2.0) / \
-                                    np.sqrt(2.0*np.pi*sig**2.0) ) + \
-                                    np.log( np.exp( -0.5 * (varyLocs[ii,1] - np.pi/2. + p.psr_locs[1])**2.0 / sig**2.0) / \
-                                    np.sqrt(2.0*np.pi*sig**2.0) )
-                elif args.psrlocsPrior == 'uniform':
-                    if np.abs(varyLocs[ii,0] - p.psr_locs[0]) <= 1.0 and \
-                      np.abs(varyLocs[ii,1] - np.pi/2. + p.psr_locs[1]) <= 1.0:
-                        priorfac_corr += 0.0
-                    else:
-                        priorfac_corr += -np.inf
-                else:
-                    priorfac_corr = 0.0
-        else:
-            priorfac_corr = 0.0
-    elif not args.incGWB and not args.incCorr:
-        priorfac_corr = 0.0
-
-    ### Reweighting corr-vs-uncorr GWB models ###
-    ### to ensure proper mixing ###
-    priorfac_gwbmod = 0.0
-    if args.incGWB and args.incCorr and args.gwbModelSelect:
-        if gwb_modindex == 0:
-            priorfac_gwbmod = ( np.log( args.gwbCorrModWgt / (1.0 + args.gwbCorrModWgt) )
-                                - np.log(1.0/2.0) )
-        elif gwb_modindex == 1:
-            priorfac_gwbmod = ( np.log( 1.0 / (1.0 + args.gwbCorrModWgt) )
-                                - np.log(1.0/2.0) )
-        
-    ### Jacobian and prior on cgw properties ###
-    if args.det_signal:
-        if args.cgw_search:
-            ### uniform prior ###
-            if args.cgwPrior == 'uniform':
-                priorfac_detsig = np.log(hstrain * np.log(10.0))
-            elif args.cgwPrior == 'loguniform':
-                priorfac_detsig = 0.0
-            ### pulsar distance prior ###
-            if args.psrTerm:
-                for ii, p in enumerate(psr):
-                    mu = p.h5Obj['pdist'].value
-                    sig = p.h5Obj['pdistErr'].value
-                    priorfac_detsig += \
-                      np.log( np.exp( -0.5 * (psrdists[ii] - mu)**2.0 / sig**2.0) / \
-                              np.sqrt(2.0*np.pi*sig**2.0) )
-        else:
-            priorfac_detsig = 0.0
-    elif not args.det_signal:
-        priorfac_detsig = 0.0
-        
-
-    #####################################
-    # Finally, return the log-likelihood
-    
-    return (1.0/args.softParam) * (logLike + priorfac_gwb + priorfac_gwbmod + priorfac_gwline + \
-                                   priorfac_red + priorfac_dm + priorfac_clk + \
-                                   priorfac_cm + priorfac_eph + priorfac_corr + priorfac_detsig)
-     
 
 
 #########################
@@ -2758,6 +1229,14 @@ if args.det_signal:
                        "eph_yquad2amp", "eph_zquad1amp", "eph_zquad2amp",
                        "eph_xquad1sign", "eph_xquad2sign", "eph_yquad1sign",
                        "eph_yquad2sign", "eph_zquad1sign", "eph_zquad2sign"]
+if args.varyWhite:
+    for ii,p in enumerate(psr):
+        [parameters.append('EFAC_'+p.name+'_'+sysname)
+         for sysname in like.white_systems[ii]]
+        [parameters.append('EQUAD_'+p.name+'_'+sysname)
+         for sysname in like.white_systems[ii]]
+        [parameters.append('ECORR_'+p.name+'_'+nano_sysname)
+         for nano_sysname in like.white_ecorrs[ii]]
 
 
 n_params = len(parameters)
@@ -2884,6 +1363,8 @@ elif not args.incEph:
     eph_tag = ''
 file_tag += red_tag + dm_tag + clk_tag + \
   cm_tag + eph_tag
+if args.varyWhite:
+    file_tag += '_whiteVary'
 
 
 if rank == 0:
@@ -3122,6 +1603,23 @@ elif args.sampler == 'ptmcmc':
         if args.eph_quadratic:
             x0 = np.append(x0,np.array(np.tile([-7.0],6)))
             x0 = np.append(x0,np.random.uniform(-1.0,1.0,6))
+    if args.varyWhite:
+        for ii,p in enumerate(psr):
+            systems = like.white_systems[ii].keys()
+            ecorrs = like.white_ecorrs[ii].keys()
+            if p.efacs is not None:
+                # starting white noise at single pulsar values
+                x0 = np.append(x0,[p.efacs.get(sysname,1.0) for sysname in systems])
+                x0 = np.append(x0,np.log10([p.equads.get(sysname,1e-7)
+                                            for sysname in systems]))
+                x0 = np.append(x0,np.log10([p.ecorrs.get(nano_sysname,1e-7)
+                                            for nano_sysname in ecorrs]))
+            else:
+                x0 = np.append(x0,np.random.uniform(0.75,1.25,len(systems)))
+                x0 = np.append(x0,np.random.uniform(-10.0,-5.0,len(systems)))
+                x0 = np.append(x0,np.random.uniform(-8.5,-5.0,len(ecorrs)))
+        wsl = like.pslices['white']
+        x0[wsl] = np.clip(x0[wsl], pmin[wsl], pmax[wsl])
 
     if rank==0:
         print "\n Your initial parameters are {0}\n".format(x0)
@@ -3199,6 +1697,8 @@ elif args.sampler == 'ptmcmc':
         if args.eph_quadratic:
             cov_diag = np.append(cov_diag,np.tile(0.1,6))
             cov_diag = np.append(cov_diag,np.tile(0.1,6))
+    if args.varyWhite:
+        cov_diag = np.append(cov_diag,0.5*np.ones(like.nwhite))
 
     if rank==0:
         print "\n Running a quick profile on the likelihood to estimate evaluation speed...\n"
@@ -3408,6 +1908,14 @@ elif args.sampler == 'ptmcmc':
             ids = [np.arange(param_ct,param_ct+6)]
             param_ct += 6
             [ind.append(id) for id in ids]
+
+    ##### White noise #####
+    if args.varyWhite:
+        # one group per pulsar
+        ids = [np.arange(param_ct+wsl.start,param_ct+wsl.stop)
+               for wsl in like.white_slices]
+        [ind.append(id) for id in ids if len(id) > 0]
+        param_ct += like.nwhite
             
     ##### all parameters #####
     all_inds = range(len(x0))
@@ -4957,6 +3465,26 @@ elif args.sampler == 'ptmcmc':
 
   
 
+    # white noise draws
+    def drawFromWhiteNoisePrior(parameters, iter, beta):
+
+        # post-jump parameters
+        q = parameters.copy()
+
+        # transition probability
+        qxy = 0
+
+        # white-noise parameters are at the end of the list
+        pct = like.pslices['white'].start
+
+        ind = np.unique(np.random.randint(pct, pct+like.nwhite, 1))
+
+        for ii in ind:
+            q[ii] = np.random.uniform(pmin[ii], pmax[ii])
+            qxy += 0
+
+        return q, qxy
+
     # add jump proposals
     if not args.fixRed:
         if args.redSpecModel == 'powerlaw':
@@ -5013,6 +3541,8 @@ elif args.sampler == 'ptmcmc':
         sampler.addProposalToCycle(drawFromBWMPrior, 10)
         if args.bwm_model_select:
             sampler.addProposalToCycle(drawFromBWMModelIndexPrior, 5)
+    if args.varyWhite:
+        sampler.addProposalToCycle(drawFromWhiteNoisePrior, 10)
 
     sampler.sample(p0=x0, Niter=int(5e6), thin=10,
                 covUpdate=1000, AMweight=20,
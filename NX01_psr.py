@@ -9,16 +9,200 @@ Code contributions by Rutger van Haasteren (piccard) and Justin Ellis (PAL/PAL2)
 """
 
 import numpy as np
-import sys, os, glob
+import sys, os, glob, re
 import libstempo as T2
+import h5py as h5
 import ephem
 from ephem import *
 import NX01_utils as utils
 from collections import OrderedDict
 import cPickle as pickle
+from multiprocessing.pool import ThreadPool
 
 f1yr = 1./(86400.0*365.25)
 
+# System flags used by the PTAs, in order of preference
+SYSTEM_FLAGS = ['group','sys','i','f']
+
+# White-noise ("<key> -<flag> <backend> <value>") and red-noise/DM
+# ("<key> <value>") lines of a parfile
+PARFILE_NOISE = re.compile(r'^[ \t]*\S*?(?:(?P<white>T2EFAC|T2EQUAD|ECORR)[ \t]+\S+[ \t]+(?P<backend>\S+)'
+                           r'|(?P<red>RNAMP|RNIDX|TNRedAmp|TNRedGam|TNDMAmp|TNDMGam))'
+                           r'[ \t]+(?P<value>\S+)', re.M)
+PARFILE_WHITE = {'T2EFAC': 1.0, 'T2EQUAD': 1e-6, 'ECORR': 1e-6}
+PARFILE_RED = {'RNAMP': ('Redamp', lambda val: val),
+               'TNRedAmp': ('Redamp', lambda val: 10.0**val),
+               'RNIDX': ('Redind', lambda val: -val),
+               'TNRedGam': ('Redind', lambda val: val),
+               'TNDMAmp': ('DMamp', lambda val: 10.0**val * np.sqrt(12.0*np.pi**2.0)),
+               'TNDMGam': ('DMind', lambda val: val)}
+
+# Lines of a single-pulsar noise file ("<psr>_efac-<backend> <value>", ...)
+NOISEFILE_NOISE = re.compile(r'^[ \t]*\S*?(?:(?P<white>efac|equad|jitter_q)-(?P<backend>\S+)'
+                             r'|(?P<red>RN-Amplitude|RN-spectral-index|DM-Amplitude|DM-spectral-index)\S*)'
+                             r'[ \t]+(?P<value>\S+)', re.M)
+NOISEFILE_WHITE = {'efac': lambda val: val,
+                   'equad': lambda val: 10.0**val,
+                   'jitter_q': lambda val: 10.0**val}
+NOISEFILE_RED = {'RN-Amplitude': ('Redamp', lambda val: 10.0**val),
+                 'RN-spectral-index': ('Redind', lambda val: val),
+                 # AP's DM-amps use the TN convention
+                 'DM-Amplitude': ('DMamp', lambda val: 10.0**val * np.sqrt(12.0*np.pi**2.0)),
+                 'DM-spectral-index': ('DMind', lambda val: val)}
+
+
+def parse_noise(text, pattern, white_conv, red_conv):
+    """
+    Single-pass parse of the noise values in a parfile or noise file.
+
+    :param text: Contents of the file
+    :param pattern: Compiled line pattern (PARFILE_NOISE or NOISEFILE_NOISE)
+    :param white_conv: Conversion of each white-noise key (a scale factor
+                       or a function of the value)
+    :param red_conv: Attribute name and conversion of each red-noise key
+
+    :returns: Noise table; an OrderedDict of backend values per white-noise
+              key, and the red-noise/DM values (1e-20 amplitudes and zero
+              spectral indices when absent)
+    """
+
+    table = OrderedDict((key, OrderedDict()) for key in white_conv)
+    table.update([('Redamp', 1e-20), ('Redind', 0.0),
+                  ('DMamp', 1e-20), ('DMind', 0.0)])
+
+    for match in pattern.finditer(text):
+        val = np.double(match.group('value'))
+        if match.group('white') is not None:
+            conv = white_conv[match.group('white')]
+            table[match.group('white')][match.group('backend')] = \
+              conv(val) if callable(conv) else conv*val
+        else:
+            name, conv = red_conv[match.group('red')]
+            table[name] = conv(val)
+
+    return table
+
+
+def backend_index(flagvals, names=None):
+    """
+    Integer backend index of every TOA.
+
+    :param flagvals: Flag value of every TOA
+    :param names: Backends to index (default: every flag value)
+
+    :returns: Backend names, index of every TOA into them (-1 for TOAs
+              whose flag value is not one of the backends)
+    """
+
+    flagvals = np.asarray(flagvals)
+    if names is None:
+        names, index = np.unique(flagvals, return_inverse=True)
+        return list(names), index
+
+    names = list(names)
+    order = np.argsort(names)
+    sorted_names = np.asarray(names)[order]
+    pos = np.clip(np.searchsorted(sorted_names, flagvals), 0, len(names)-1)
+    index = np.where(sorted_names[pos] == flagvals, order[pos], -1)
+
+    return names, index
+
+
+def sysflags_from_dict(sysflagdict, ntoa):
+    """
+    Backend indices of every system flag, from a dictionary of per-system
+    TOA indices (as pickled in older hdf5 files).
+
+    :param sysflagdict: OrderedDict of OrderedDicts {flag: {backend: TOA indices}}
+    :param ntoa: Number of TOAs
+
+    :returns: OrderedDict of (names, index) per flag
+    """
+
+    sysflags = OrderedDict()
+    for flag, systems in sysflagdict.items():
+        if systems is None:
+            continue
+        index = -np.ones(ntoa, dtype=np.int)
+        for kk, sysname in enumerate(systems):
+            index[systems[sysname]] = kk
+        sysflags[flag] = (list(systems.keys()), index)
+
+    return sysflags
+
+
+def sysflag_dict(sysflags):
+    """
+    Per-system TOA indices of every system flag, from the backend indices.
+
+    :param sysflags: OrderedDict of (names, index) per flag
+
+    :returns: OrderedDict of OrderedDicts {flag: {backend: TOA indices}},
+              with None for the standard flags that are absent
+    """
+
+    sysflagdict = OrderedDict.fromkeys(SYSTEM_FLAGS)
+    for flag, (names, index) in sysflags.items():
+        sysflagdict[flag] = OrderedDict((name, np.flatnonzero(index == kk))
+                                        for kk, name in enumerate(names))
+
+    return sysflagdict
+
+
+def h5_lazy_dataset(attr, key):
+    """
+    Pulsar attribute that is read from dataset key of the pulsar's hdf5
+    group the first time it is accessed, and is None if the dataset is
+    absent. Large matrices which only some analyses need are stored this
+    way, so that loading a pulsar does not pay for them.
+    """
+
+    def getter(self):
+        if attr not in self._h5_lazy:
+            self._h5_lazy[attr] = self.h5Obj[key].value \
+              if key in self.h5Obj else None
+        return self._h5_lazy[attr]
+
+    def setter(self, value):
+        self._h5_lazy[attr] = value
+
+    return property(getter, setter)
+
+
+def load_psrs_from_h5(names, h5paths, rescale=True, sysflag_target=None,
+                      nthreads=4):
+    """
+    Open the hdf5 files of several pulsars and extract them concurrently.
+
+    :param names: Pulsar names (the group inside each file)
+    :param h5paths: Paths to the hdf5 files
+    :param rescale: Rescale the TOA uncertainties by single-pulsar values
+    :param sysflag_target: System flag of the EFACs and EQUADs
+    :param nthreads: Number of threads over which to split the pulsars
+
+    :returns: List of PsrObjFromH5, in the order of names
+    """
+
+    def load(task):
+        name, path = task
+        psr = PsrObjFromH5(h5.File(path, 'r')[name])
+        psr.grab_all_vars(rescale=rescale, sysflag_target=sysflag_target)
+        return psr
+
+    tasks = zip(names, h5paths)
+    if nthreads > 1 and len(tasks) > 1:
+        pool = ThreadPool(min(nthreads, len(tasks)))
+        try:
+            psr = pool.map(load, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        psr = [load(task) for task in tasks]
+
+    return psr
+
+
 class PsrObj(object):
     T2psr = None
     parfile = None
@@ -31,6 +215,7 @@ class PsrObj(object):
     obs_freqs = None
     G = None
     Mmat = None
+    sysflags = None
     sysflagdict = None
     Fred = None
     Fdm = None
@@ -74,9 +259,9 @@ class PsrObj(object):
         self.Ftot_prime = None
         self.Gc = None
         self.Te = None
-        self.Umat = None
         self.Uinds = None
         self.name = "J0000+0000"
+        self.sysflags = None
         self.sysflagdict = None
         self.Gres = None
         self.epflags = None
@@ -136,61 +321,37 @@ class PsrObj(object):
         print "--> Grabbed the pulsar position."
         ################################################################################################
             
-        # These are all the relevant system flags used by the PTAs.
-        system_flags = ['group','sys','i','f']
-        self.sysflagdict = OrderedDict.fromkeys(system_flags)
-
-        # Put the systems into a dictionary which 
-        # has the locations of their toa placements.
-        for systm in self.sysflagdict:
-            try:
-                if systm in self.T2psr.flags():
-                    sys_uflagvals = list(set(self.T2psr.flagvals(systm)))
-                    self.sysflagdict[systm] = OrderedDict.fromkeys(sys_uflagvals)
-                    for kk,subsys in enumerate(sys_uflagvals):
-                        if isort is not None:
-                            self.sysflagdict[systm][subsys] = \
-                              np.where(self.T2psr.flagvals(systm)[isort] == sys_uflagvals[kk])
-                        elif isort is None:
-                            self.sysflagdict[systm][subsys] = \
-                              np.where(self.T2psr.flagvals(systm) == sys_uflagvals[kk])
-            except KeyError:
-                pass
+        # These are all the relevant system flags used by the PTAs. Each is
+        # kept as its list of backends and the backend index of every TOA.
+        toasort = isort if isort is not None else slice(None, None, None)
+        self.sysflags = OrderedDict()
+        for systm in SYSTEM_FLAGS:
+            if systm in self.T2psr.flags():
+                self.sysflags[systm] = backend_index(self.T2psr.flagvals(systm)[toasort])
 
         # If we have some NANOGrav data, then separate
         # this off for later ECORR assignment.
         if 'pta' in self.T2psr.flags():
             pta_names = list(set(self.T2psr.flagvals('pta')))
-            pta_mask = [self.T2psr.flagvals('pta')[isort]==ptaname for ptaname in pta_names]
-            pta_maskdict = OrderedDict.fromkeys(pta_names)
-            for ii,item in enumerate(pta_maskdict):
-                pta_maskdict[item] = pta_mask[ii]
-            if len(pta_names)!=0 and ('NANOGrav' in pta_names):
+            if 'NANOGrav' in pta_names:
+                ptavals = self.T2psr.flagvals('pta')[toasort]
                 try:
-                    nanoflagdict = OrderedDict.fromkeys(['nano-f'])
-                    nano_flags = list(set(self.T2psr.flagvals('group')[pta_maskdict['NANOGrav']]))
-                    nanoflagdict['nano-f'] = OrderedDict.fromkeys(nano_flags)
-                    for kk,subsys in enumerate(nano_flags):
-                        nanoflagdict['nano-f'][subsys] = \
-                          np.where(self.T2psr.flagvals('group')[isort] == nano_flags[kk])
-                    self.sysflagdict.update(nanoflagdict)
+                    flagvals = self.T2psr.flagvals('group')[toasort]
                 except KeyError:
-                    nanoflagdict = OrderedDict.fromkeys(['nano-f'])
-                    nano_flags = list(set(self.T2psr.flagvals('f')[pta_maskdict['NANOGrav']]))
-                    nanoflagdict['nano-f'] = OrderedDict.fromkeys(nano_flags)
-                    for kk,subsys in enumerate(nano_flags):
-                        nanoflagdict['nano-f'][subsys] = \
-                          np.where(self.T2psr.flagvals('f')[isort] == nano_flags[kk])
-                    self.sysflagdict.update(nanoflagdict)
-                    
+                    flagvals = self.T2psr.flagvals('f')[toasort]
+                nano_flags = sorted(set(flagvals[ptavals == 'NANOGrav']))
+                self.sysflags['nano-f'] = backend_index(flagvals, names=nano_flags)
         
         # If there are really no relevant flags,
         # then just make a full list of the toa indices.
-        if np.all([self.sysflagdict[sys] is None for sys in self.sysflagdict]):
+        if len(self.sysflags) == 0:
             print "No relevant flags found"
             print "Assuming one overall system for {0}\n".format(self.T2psr.name)
-            self.sysflagdict[self.T2psr.name] = OrderedDict.fromkeys([self.T2psr.name])
-            self.sysflagdict[self.T2psr.name][self.T2psr.name] = np.arange(len(self.toas))
+            self.sysflags[self.T2psr.name] = ([self.T2psr.name],
+                                              np.zeros(len(self.toas), dtype=np.int))
+
+        # per-system TOA indices
+        self.sysflagdict = sysflag_dict(self.sysflags)
 
         print "--> Processed all relevant flags plus associated locations."
         ##################################################################################################
@@ -217,24 +378,20 @@ class PsrObj(object):
                 
                 print "--> Sorted data."
     
-                # get quantization matrix
-                avetoas, self.Umat, Ui = utils.quantize_split(self.toas, flags, dt=jitterbin/86400., calci=True)
-                print "--> Computed quantization matrix."
+                # get quantization indices
+                avetoas, self.detsig_Uinds = utils.quantize_split(self.toas, flags, dt=jitterbin/86400.)
+                print "--> Computed quantization indices."
 
                 self.detsig_avetoas = avetoas.copy()
-                self.detsig_Uinds = utils.quant2ind(self.Umat)
 
                 # get only epochs that need jitter/ecorr
-                self.Umat, avetoas, aveflags = utils.quantreduce(self.Umat, avetoas, flags)
-                print "--> Excized epochs without jitter."
-
-                # get quantization indices
-                self.Uinds = utils.quant2ind(self.Umat)
+                self.Uinds, avetoas, aveflags = utils.quantreduce(self.detsig_Uinds, avetoas, flags)
                 self.epflags = flags[self.Uinds[:, 0]]
+                print "--> Excized epochs without jitter."
 
                 print "--> Checking TOA sorting and quantization..."
                 print utils.checkTOAsort(self.toas, flags, which='jitterext', dt=jitterbin/86400.)
-                print utils.checkquant(self.Umat, flags)
+                print utils.checkquant(self.Uinds, flags)
                 print "...Finished checks."
 
         # perform SVD of design matrix to stabilise
@@ -332,8 +489,10 @@ class PsrObjFromH5(object):
     toaerrs = None
     res = None
     obs_freqs = None
-    G = None
-    Mmat = None
+    G = h5_lazy_dataset('G', 'Gmatrix')
+    Gres = h5_lazy_dataset('Gres', 'Gres')
+    Mmat = h5_lazy_dataset('Mmat', 'designmatrix')
+    sysflags = None
     sysflagdict = None
     Fred = None
     Fdm = None
@@ -348,7 +507,6 @@ class PsrObjFromH5(object):
     Gc = None
     Te = None
     name = "J0000+0000"
-    Gres = None
     epflags = None
     detsig_avetoas = None
     detsig_Uinds = None
@@ -369,6 +527,7 @@ class PsrObjFromH5(object):
 
     def __init__(self, h5Obj):
         self.h5Obj = h5Obj
+        self._h5_lazy = {}
         self.parfile = None
         self.timfile = None
         self.noisefile = None
@@ -377,8 +536,6 @@ class PsrObjFromH5(object):
         self.toaerrs = None
         self.res = None
         self.obs_freqs = None
-        self.G = None
-        self.Mmat = None
         self.Fred = None
         self.Fdm = None
         self.Fephx = None
@@ -391,11 +548,10 @@ class PsrObjFromH5(object):
         self.Ftot_prime = None
         self.Gc = None
         self.Te = None
-        self.Umat = None
         self.Uinds = None
         self.name = "J0000+0000"
+        self.sysflags = None
         self.sysflagdict = None
-        self.Gres = None
         self.epflags = None
         self.detsig_avetoas = None
         self.detsig_Uinds = None
@@ -437,66 +593,45 @@ class PsrObjFromH5(object):
 
         self.psr_locs = self.h5Obj['psrlocs'].value
 
-        self.Mmat = self.h5Obj['designmatrix'].value
-        try:
-            self.G = self.h5Obj['Gmatrix'].value
-            self.Gres = self.h5Obj['Gres'].value
-        except:
-            self.G = None
-            self.Gres = None
+        # the design matrix, G matrix and G-projected residuals
+        # are only read when first used
         self.Gc = self.h5Obj['GCmatrix'].value
         try:
-            self.Umat = self.h5Obj['QuantMat'].value
             self.Uinds = self.h5Obj['QuantInds'].value
             self.epflags = self.h5Obj['EpochFlags'].value
             self.detsig_avetoas = self.h5Obj['DetSigAveToas'].value
             self.detsig_Uinds = self.h5Obj['DetSigQuantInds'].value
         except:
-            self.Umat = None
             self.Uinds = None
             self.epflags = None
             self.detsig_avetoas = None
             self.detsig_Uinds = None
 
-        self.sysflagdict = pickle.loads(self.h5Obj['SysFlagDict'].value)
-
-        # Let's rip out EFACS, EQUADS and ECORRS from parfile
-        parlines = self.h5Obj['parfile'].value.split('\n')
-        t2efacs = []
-        t2equads = []
-        t2ecorrs = []
-        for ll in parlines:
-            if 'T2EFAC' in ll:
-                t2efacs.append([ll.split()[2], np.double(ll.split()[3])])
-            if 'T2EQUAD' in ll:
-                t2equads.append([ll.split()[2], np.double(ll.split()[3])*1e-6])
-            if 'ECORR' in ll:
-                t2ecorrs.append([ll.split()[2], np.double(ll.split()[3])*1e-6])
-
-        self.t2efacs = OrderedDict(t2efacs)
-        self.t2equads = OrderedDict(t2equads)
-        self.t2ecorrs = OrderedDict(t2ecorrs)
-
-        # Let's rip out the red-noise/DM properties if present
-        self.parRedamp = 1e-20
-        self.parRedind = 0.0
-        self.parDMamp = 1e-20
-        self.parDMind = 0.0
-        for ll in parlines:
-            if 'RNAMP' in ll:
-                self.parRedamp = np.double(ll.split()[1]) # 1e-6 * f1yr * np.sqrt(12.0*np.pi**2.0) * np.double(ll.split()[1])
-            elif 'TNRedAmp' in ll:
-                self.parRedamp = 10.0**np.double(ll.split()[1])
-
-            if 'RNIDX' in ll:
-                self.parRedind = -np.double(ll.split()[1])
-            elif 'TNRedGam' in ll:
-                self.parRedind = np.double(ll.split()[1])
-
-            if 'TNDMAmp' in ll:
-                self.parDMamp = 10.0**np.double(ll.split()[1]) * np.sqrt(12.0*np.pi**2.0)
-            if 'TNDMGam' in ll:
-                self.parDMind = np.double(ll.split()[1])
+        # backends of every system flag, as backend indices of the TOAs
+        # (files written before these were stored hold a pickled
+        # dictionary of per-system TOA indices instead)
+        if 'SysFlags' in self.h5Obj:
+            sysGroup = self.h5Obj['SysFlags']
+            self.sysflags = OrderedDict()
+            for flag in sysGroup['flags'].value:
+                self.sysflags[str(flag)] = ([str(name) for name in sysGroup[flag]['names'].value],
+                                            sysGroup[flag]['index'].value)
+        else:
+            self.sysflags = sysflags_from_dict(pickle.loads(self.h5Obj['SysFlagDict'].value),
+                                               len(self.toas))
+        self.sysflagdict = sysflag_dict(self.sysflags)
+
+        # Let's rip out EFACS, EQUADS and ECORRS, and the
+        # red-noise/DM properties if present, from the parfile
+        partable = parse_noise(self.h5Obj['parfile'].value, PARFILE_NOISE,
+                               PARFILE_WHITE, PARFILE_RED)
+        self.t2efacs = partable['T2EFAC']
+        self.t2equads = partable['T2EQUAD']
+        self.t2ecorrs = partable['ECORR']
+        self.parRedamp = partable['Redamp']
+        self.parRedind = partable['Redind']
+        self.parDMamp = partable['DMamp']
+        self.parDMind = partable['DMind']
 
         # Let's also find single pulsar analysis EFACS, EQUADS, ECORRS
         self.Redamp = 1e-20
@@ -504,64 +639,35 @@ class PsrObjFromH5(object):
         self.DMamp = 1e-20
         self.DMind = 0.0
         if self.noisefile is not None:
-            noiselines = self.h5Obj['noisefile'].value.split('\n')
-            efacs = []
-            equads = []
-            ecorrs = []
-            for ll in noiselines:
-                if 'efac' in ll:
-                    efacs.append([ll.split()[0].split('efac-')[1], np.double(ll.split()[1])])
-                if 'equad' in ll:
-                    equads.append([ll.split()[0].split('equad-')[1], 10.0**np.double(ll.split()[1])])
-                if 'jitter' in ll:
-                    ecorrs.append([ll.split()[0].split('jitter_q-')[1], 10.0**np.double(ll.split()[1])])
-
-            self.efacs = OrderedDict(efacs)
-            self.equads = OrderedDict(equads)
-            self.ecorrs = OrderedDict(ecorrs)
+            noisetable = parse_noise(self.h5Obj['noisefile'].value, NOISEFILE_NOISE,
+                                     NOISEFILE_WHITE, NOISEFILE_RED)
+            self.efacs = noisetable['efac']
+            self.equads = noisetable['equad']
+            self.ecorrs = noisetable['jitter_q']
 
             # Let's get the red noise properties from single-pulsar analysis
-            self.Redamp = 1e-20
-            self.Redind = 0.0
-            self.DMamp = 1e-20
-            self.DMind = 0.0
-            for ll in noiselines:
-                if 'RN-Amplitude' in ll:
-                    self.Redamp = 10.0**np.double(ll.split()[1]) # 1e-6 * f1yr * np.sqrt(12.0*np.pi**2.0) * np.double(ll.split()[1]) 
-                if 'RN-spectral-index' in ll:
-                    self.Redind = np.double(ll.split()[1])
-                if 'DM-Amplitude' in ll:
-                    # special edit below since AP's DM-amps use TN convention
-                    self.DMamp = 10.0**np.double(ll.split()[1]) * np.sqrt(12.0*np.pi**2.0)
-                if 'DM-spectral-index' in ll:
-                    self.DMind = np.double(ll.split()[1])
+            self.Redamp = noisetable['Redamp']
+            self.Redind = noisetable['Redind']
+            self.DMamp = noisetable['DMamp']
+            self.DMind = noisetable['DMind']
 
             # Time to rescale the TOA uncertainties by single-pulsar EFACS and EQUADS
             if sysflag_target is not None:
-                systems = self.sysflagdict[sysflag_target]
+                systems = sysflag_target
             else:
-                if self.sysflagdict['group'] is not None:
-                    # for nanograv/ipta
-                    systems = self.sysflagdict['group']
-                elif self.sysflagdict['f'] is not None:
-                    # for nanograv
-                    systems = self.sysflagdict['f']
-                elif self.sysflagdict['sys'] is not None:
-                    # for the epta
-                    systems = self.sysflagdict['sys']
+                # for nanograv/ipta, nanograv, and the epta
+                systems = [flag for flag in ['group','f','sys']
+                           if flag in self.sysflags][0]
                 
             if rescale:
-                tmp_errs = self.toaerrs.copy()
-
-                for sysname in systems:
-                    tmp_errs[systems[sysname]] *= self.efacs[sysname] 
+                names, index = self.sysflags[systems]
 
-                t2equad_bit = np.ones(len(tmp_errs))
-                for sysname in systems:
-                    t2equad_bit[systems[sysname]] *= self.equads[sysname]
+                # TOAs outside every system keep their uncertainties
+                efac = np.append([self.efacs[sysname] for sysname in names], 1.0)
+                equad = np.append([self.equads[sysname] for sysname in names], 0.0)
 
-                tmp_errs = np.sqrt( tmp_errs**2.0 + t2equad_bit**2.0 )
-                self.toaerrs = tmp_errs
+                self.toaerrs = np.sqrt( (self.toaerrs * efac[index])**2.0 +
+                                        equad[index]**2.0 )
         
 
         print "--> Done extracting pulsar from hdf5 file :-) \n"
@@ -293,15 +293,9 @@ def ln_prob(xx):
             for jj,nano_sysname in enumerate(psr.sysflagdict['nano-f'].keys()):
                 Jamp[np.where(psr.epflags==nano_sysname)] *= ECORR[jj]**2.0
 
-            Nx = jitter.cython_block_shermor_0D(model_res, new_err**2.,
-                                                Jamp, psr.Uinds)
-            d = np.dot(psr.Te.T, Nx)
-            logdet_N, TtNT = \
-              jitter.cython_block_shermor_2D(psr.Te, new_err**2.,
-                                             Jamp, psr.Uinds)
-            det_dummy, dtNdt = \
-              jitter.cython_block_shermor_1D(model_res, new_err**2.,
-                                             Jamp, psr.Uinds)
+            logdet_N, d, dtNdt, TtNT = \
+              jitter.cython_block_shermor_products(psr.Te, model_res, new_err**2.,
+                                                   Jamp, psr.Uinds)
         else:
             d = np.dot(psr.Te.T, model_res/( new_err**2.0 ))
         
@@ -359,19 +353,13 @@ def ln_prob(xx):
     diagonal[1::2] = 10**kappa
 
     # compute Phi inverse 
-    red_phi = np.diag(1./diagonal)
     logdet_Phi = np.sum(np.log( diagonal ))
-  
-    # now fill in real covariance matrix
-    Phi = np.zeros( TtNT.shape )
-    for kk in range(0,mode_count):
-        Phi[kk+psr.Gc.shape[1],kk+psr.Gc.shape[1]] = red_phi[kk,kk]
-
-    # symmeterize Phi
-    Phi = Phi + Phi.T - np.diag(np.diag(Phi))
-    
-    # compute sigma
-    Sigma = TtNT + Phi
+
+    # compute sigma (TtNT is rebuilt on every call, so Phi inverse
+    # is added to its Fourier diagonal in place)
+    Sigma = TtNT
+    fidx = np.arange(psr.Gc.shape[1], psr.Gc.shape[1]+mode_count)
+    Sigma[fidx,fidx] += 1./diagonal
      
     # cholesky decomp for second term in exponential
     try:
@@ -20,6 +20,7 @@ from numpy import random
 from scipy import special as ss
 from scipy import linalg as sl
 from scipy.interpolate import interp1d
+from collections import OrderedDict
 from pkg_resources import resource_filename, Requirement
 import numexpr as ne
 import optparse
@@ -34,6 +35,37 @@ KPC2S = sc.parsec / sc.c * 1e3
 MPC2S = sc.parsec / sc.c * 1e6
 
 
+def savez_atomic(filename, compress=False, **arrays):
+    """
+    Store arrays in an npz file, writing under a temporary name first so
+    that concurrent runs never read a partially written file. Caches are
+    optional, so a directory that cannot be written to only costs the
+    cache and is reported rather than raised.
+
+    :param filename: Destination of the npz file
+    :param compress: Use np.savez_compressed
+    :param arrays: Named arrays to store
+
+    :returns: True if the file was written
+    """
+
+    tmpfile = '{0}.{1}.tmp'.format(filename, os.getpid())
+    save = np.savez_compressed if compress else np.savez
+    try:
+        with open(tmpfile, 'wb') as fil:
+            save(fil, **arrays)
+        os.rename(tmpfile, filename)
+    except (IOError, OSError) as err:
+        print "Could not write cache file {0}: {1}".format(filename, err)
+        try:
+            os.remove(tmpfile)
+        except OSError:
+            pass
+        return False
+
+    return True
+
+
 def sumTermCovarianceMatrix_fast(tm, fL, gam):
     """
     Calculate the power series expansion for the Hypergeometric
@@ -298,82 +330,133 @@ def createFourierDesignmatrix_eph(t, nmodes, psr_locs, output_freqs=False,
     else:
         return Fx, Fy, Fz
 
-def quantize_fast(times, dt=1.0, calci=False):
+def quantize_bounds(times, dt=1.0, flags=None):
+    """
+    Split a sequence of TOAs into observing epochs. A new epoch starts
+    at every TOA that lies at least dt after the first TOA of the current
+    epoch (or whose flag differs from the current epoch's flag).
+
+    :param times:   The TOAs, in the order in which they are grouped
+    :param dt:      Timescale for which to limit jitter blocks
+    :param flags:   Optional flags that also delimit the epochs
+
+    :return:        Index ranges [start, stop) of the epochs, shape (nepoch, 2)
+    """
+
+    ntoa = len(times)
+    if flags is not None:
+        newflag = np.append(False, flags[1:] != flags[:-1])
+    else:
+        newflag = np.zeros(ntoa, dtype=np.bool)
+
+    starts = [0]
+    ref = times[0]
+    for i in range(1, ntoa):
+        if newflag[i] or times[i] - ref >= dt:
+            starts.append(i)
+            ref = times[i]
+
+    inds = np.zeros((len(starts), 2), dtype=np.int)
+    inds[:, 0] = starts
+    inds[:-1, 1] = starts[1:]
+    inds[-1, 1] = ntoa
+
+    return inds
+
+
+def quantize_fast(times, dt=1.0):
     """
-    Adapted from libstempo: produce the quantisation matrix fast
+    Adapted from libstempo: quantise the TOAs into observing epochs fast.
+    Rather than a dense (ntoa x nepoch) quantisation matrix, the epochs
+    are returned as index ranges into the time-sorted TOAs.
+
+    :param times:   The TOAs
+    :param dt:      Timescale for which to limit jitter blocks
+
+    :return:    tave, isort, inds   (epoch-averaged TOAs, time-sorting
+                                     permutation, and the index ranges
+                                     [start, stop) of each epoch in isort)
     """
     isort = np.argsort(times)
-    
-    bucket_ref = [times[isort[0]]]
-    bucket_ind = [[isort[0]]]
-    
-    for i in isort[1:]:
-        if times[i] - bucket_ref[-1] < dt:
-            bucket_ind[-1].append(i)
-        else:
-            bucket_ref.append(times[i])
-            bucket_ind.append([i])
-    
-    t = np.array([np.mean(times[l]) for l in bucket_ind],'d')
-    
-    U = np.zeros((len(times),len(bucket_ind)),'d')
-    for i,l in enumerate(bucket_ind):
-        U[l,i] = 1
-    
-    rv = (t, U)
+    inds = quantize_bounds(times[isort], dt=dt)
 
-    if calci:
-        Ui = ((1.0/np.sum(U, axis=0)) * U).T
-        rv = (t, U, Ui)
+    tave = np.add.reduceat(times[isort], inds[:, 0]) / np.diff(inds, axis=1)[:, 0]
 
-    return rv
+    return tave, isort, inds
 
 
-def quantize_split(times, flags, dt=1.0, calci=False):
+def quantize_split(times, flags, dt=1.0):
     """
     As quantize_fast, but now split the blocks per backend. Note: for
     efficiency, this function assumes that the TOAs have been sorted by
     argsortTOAs. This is _NOT_ checked.
+
+    :return:    tave, inds          (epoch-averaged TOAs, and the index
+                                     ranges [start, stop) of each epoch)
     """
-    isort = np.arange(len(times))
-    
-    bucket_ref = [times[isort[0]]]
-    bucket_flag = [flags[isort[0]]]
-    bucket_ind = [[isort[0]]]
-    
-    for i in isort[1:]:
-        if times[i] - bucket_ref[-1] < dt and flags[i] == bucket_flag[-1]:
-            bucket_ind[-1].append(i)
-        else:
-            bucket_ref.append(times[i])
-            bucket_flag.append(flags[i])
-            bucket_ind.append([i])
-    
-    t = np.array([np.mean(times[l]) for l in bucket_ind],'d')
-    
-    U = np.zeros((len(times),len(bucket_ind)),'d')
-    for i,l in enumerate(bucket_ind):
-        U[l,i] = 1
-    
-    rv = (t, U)
+    inds = quantize_bounds(times, dt=dt, flags=flags)
 
-    if calci:
-        Ui = ((1.0/np.sum(U, axis=0)) * U).T
-        rv = (t, U, Ui)
+    tave = np.add.reduceat(times, inds[:, 0]) / np.diff(inds, axis=1)[:, 0]
 
-    return rv
+    return tave, inds
+
+
+def quant_flagcounts(inds, flags, uflagvals):
+    """
+    Number of TOAs of every flag value within each epoch.
+
+    :param inds:        Index ranges [start, stop) of the epochs
+    :param flags:       The flags of the TOAs
+    :param uflagvals:   Flag values to count
+
+    :return:            Counts, shape (nepoch, len(uflagvals))
+    """
+
+    counts = np.zeros((len(inds), len(uflagvals)), dtype=np.int)
+    for ii, flagval in enumerate(uflagvals):
+        cumcount = np.append(0, np.cumsum(flags == flagval))
+        counts[:, ii] = cumcount[inds[:, 1]] - cumcount[inds[:, 0]]
+
+    return counts
+
+
+def jitter_epochs(toas, flags, dt=1.0):
+    """
+    Time-sort the TOAs, and label each of them with its observing epoch
+    and its (epoch, flag) group
+    :param toas:    The toas
+    :param flags:   The flags that belong to each TOA (indicates sys/backend)
+    :param dt:      Timescale for which to limit jitter blocks
+    :return:    tsort, inds, epid, group    (stable time-sorting permutation,
+                                             index ranges [start, stop) of the
+                                             epochs in tsort, and the epoch and
+                                             group of each TOA in tsort order)
+    """
+
+    tsort = np.argsort(toas, kind='mergesort')
+    inds = quantize_bounds(toas[tsort], dt=dt)
+    epid = np.repeat(np.arange(len(inds)), inds[:, 1] - inds[:, 0])
+
+    uflagvals, flagid = np.unique(flags, return_inverse=True)
+    group = epid * len(uflagvals) + flagid[tsort]
+
+    return tsort, inds, epid, group
 
 
 def argsortTOAs(toas, flags, which=None, dt=1.0):
     """
     Return the sort, and the inverse sort permutations of the TOAs, for the
     requested type of sorting
-    NOTE: This one is _not_ optimized for efficiency yet (but is done only once)
     :param toas:    The toas that are to be sorted
     :param flags:   The flags that belong to each TOA (indicates sys/backend)
     :param which:   Which type of sorting we will use (None, 'jitterext', 'time')
     :param dt:      Timescale for which to limit jitter blocks, default [10 secs]
     :return:    perm, perminv       (sorting permutation, and inverse)
+
+    With 'jitterext' the TOAs are sorted in time, except that within an
+    observing epoch the TOAs of each flag are made consecutive. The flags
+    of an epoch follow the order of their first TOA, so that epochs which
+    already satisfy this keep their time order.
     """
     
     if which is None:
@@ -382,41 +465,18 @@ def argsortTOAs(toas, flags, which=None, dt=1.0):
     elif which == 'time':
         isort = np.argsort(toas, kind='mergesort')
         iisort = np.zeros(len(isort), dtype=np.int)
-        for ii, p in enumerate(isort):
-            iisort[p] = ii
+        iisort[isort] = np.arange(len(isort))
     elif which == 'jitterext':
-        tave, Umat = quantize_fast(toas, dt)
+        tsort, inds, epid, group = jitter_epochs(toas, flags, dt)
 
-        isort = np.argsort(toas, kind='mergesort')
-        uflagvals = list(set(flags))
-
-        for cc, col in enumerate(Umat.T):
-            for flagval in uflagvals:
-                flagmask = (flags[isort] == flagval)
-                if np.sum(col[isort][flagmask]) > 1:
-                    # This observing epoch has several TOAs
-                    colmask = col[isort].astype(np.bool)
-                    epmsk = flagmask[colmask]
-                    epinds = np.flatnonzero(epmsk)
-                    
-                    if len(epinds) == epinds[-1] - epinds[0] + 1:
-                        # Keys are exclusively in succession
-                        pass
-                    else:
-                        # Sort the indices of this epoch and backend
-                        # We need mergesort here, because it is stable
-                        # (A stable sort keeps items with the same key in the
-                        # same relative order. )
-                        episort = np.argsort(flagmask[colmask], kind='mergesort')
-                        isort[colmask] = isort[colmask][episort]
-                else:
-                    # Only one element, always ok
-                    pass
+        # sort on (epoch, first TOA of the epoch/flag group, time)
+        ugroup, first, ginv = np.unique(group, return_index=True,
+                                        return_inverse=True)
+        isort = tsort[np.lexsort((np.arange(len(tsort)), first[ginv], epid))]
 
         # Now that we have a correct permutation, also construct the inverse
         iisort = np.zeros(len(isort), dtype=np.int)
-        for ii, p in enumerate(isort):
-            iisort[p] = ii
+        iisort[isort] = np.arange(len(isort))
     else:
         isort, iisort = np.arange(len(toas)), np.arange(len(toas))
 
@@ -437,87 +497,55 @@ def checkTOAsort(toas, flags, which=None, dt=1.0):
     
     rv = True
     if which is None:
-        isort = slice(None, None, None)
-        iisort = slice(None, None, None)
+        pass
     elif which == 'time':
         isort = np.argsort(toas, kind='mergesort')
         if not np.all(isort == np.arange(len(isort))):
             rv = False
     elif which == 'jitterext':
-        tave, Umat = quantize_fast(toas, dt)
-
-        #isort = np.argsort(toas, kind='mergesort')
-        isort = np.arange(len(toas))
-        uflagvals = list(set(flags))
+        tsort, inds, epid, group = jitter_epochs(toas, flags, dt)
 
-        for cc, col in enumerate(Umat.T):
-            for flagval in uflagvals:
-                flagmask = (flags[isort] == flagval)
-                if np.sum(col[isort][flagmask]) > 1:
-                    # This observing epoch has several TOAs
-                    colmask = col[isort].astype(np.bool)
-                    epmsk = flagmask[colmask]
-                    epinds = np.flatnonzero(epmsk)
-                    
-                    if len(epinds) == epinds[-1] - epinds[0] + 1:
-                        # Keys are exclusively in succession
-                        pass
-                    else:
-                        # Keys are not sorted for this epoch/flag
-                        rv = False
-                else:
-                    # Only one element, always ok
-                    pass
+        # walk through every epoch in the current order of its TOAs; each
+        # epoch/flag group has to form a single run
+        runs = group[np.lexsort((tsort, epid))]
+        nruns = 1 + np.count_nonzero(runs[1:] != runs[:-1])
+        if nruns != len(np.unique(group)):
+            rv = False
     else:
         pass
 
     return rv
 
 
-def checkquant(U, flags, uflagvals=None):
+def checkquant(inds, flags, uflagvals=None):
     
     """
-    Check the quantization matrix for consistency with the flags
-    :param U:           quantization matrix
+    Check the quantization epochs for consistency with the flags
+    :param inds:        Index ranges [start, stop) of the epochs
     :param flags:       the flags of the TOAs
     :param uflagvals:   subset of flags that are not ignored
     
     :return:            True/False, whether or not consistent
     
-    The quantization matrix is checked for three kinds of consistency:
+    The quantization epochs are checked for three kinds of consistency:
     - Every quantization epoch has more than one observation
     - No quantization epoch has no observations
     - Only one flag is allowed per epoch
+    The epochs are index ranges, so they are continuous by construction.
     """
     
     if uflagvals is None:
         uflagvals = list(set(flags))
 
     rv = True
-    collisioncheck = np.zeros((U.shape[1], len(uflagvals)), dtype=np.int)
+    collisioncheck = quant_flagcounts(inds, flags, uflagvals)
     for ii, flagval in enumerate(uflagvals):
-        flagmask = (flags == flagval)
 
-        Umat = U[flagmask, :]
-
-        simepoch = np.sum(Umat, axis=0)
+        simepoch = collisioncheck[:, ii]
         if np.all(simepoch <= 1) and not np.all(simepoch == 0):
             rv = False
             #raise ValueError("quantization matrix contains non-jitter-style data")
 
-        collisioncheck[:, ii] = simepoch
-
-        # Check continuity of the columns
-        for cc, col in enumerate(Umat.T):
-            if np.sum(col > 2):
-                # More than one TOA for this flag/epoch
-                epinds = np.flatnonzero(col)
-                if len(epinds) != epinds[-1] - epinds[0] + 1:
-                    rv = False
-                    print("WARNING: checkquant found non-continuous blocks")
-                    #raise ValueError("quantization matrix epochs not continuous")
-        
-
     epochflags = np.sum(collisioncheck > 0, axis=1)
 
     if np.any(epochflags > 1):
@@ -531,7 +559,7 @@ def checkquant(U, flags, uflagvals=None):
         print("WARNING: checkquant found epochs without observations (eflags)")
         #raise ValueError("Some observing epochs include no observations... ???")
 
-    obsum = np.sum(U, axis=0)
+    obsum = inds[:, 1] - inds[:, 0]
     if np.any(obsum < 1):
         rv = False
         print("WARNING: checkquant found epochs without observations (all)")
@@ -540,66 +568,25 @@ def checkquant(U, flags, uflagvals=None):
     return rv
 
 
-def quant2ind(U):
+def quantreduce(inds, eat, flags):
     
     """
-    Convert the quantization matrix to an indices matrix for fast use in the
-    jitter likelihoods
-    :param U:       quantization matrix
-    
-    :return:        Index (basic slicing) version of the quantization matrix
-    
-    This function assumes that the TOAs have been properly sorted according to
-    the proper function argsortTOAs above. Checks on the continuity of U are not
-    performed
-    """
-    
-    inds = np.zeros((U.shape[1], 2), dtype=np.int)
-    
-    for cc, col in enumerate(U.T):
-        epinds = np.flatnonzero(col)
-        inds[cc, 0] = epinds[0]
-        inds[cc, 1] = epinds[-1]+1
-
-    return inds
-
-
-def quantreduce(U, eat, flags, calci=False):
-    
-    """
-    Reduce the quantization matrix by removing the observing epochs that do not
-    require any jitter parameters.
-    :param U:       quantization matrix
+    Reduce the quantization epochs by removing the observing epochs that do
+    not require any jitter parameters.
+    :param inds:    Index ranges [start, stop) of the epochs
     :param eat:     Epoch-averaged toas
     :param flags:   the flags of the TOAs
-    :param calci:   Calculate pseudo-inverse yes/no
     
-    :return     newU, jflags (flags that need jitter)
+    :return     newinds, neweat, jflags (flags that need jitter)
     """
     
     uflagvals = list(set(flags))
-    incepoch = np.zeros(U.shape[1], dtype=np.bool)
-    jflags = []
-    for ii, flagval in enumerate(uflagvals):
-        flagmask = (flags == flagval)
-        
-        Umat = U[flagmask, :]
-        ecnt = np.sum(Umat, axis=0)
-        incepoch = np.logical_or(incepoch, ecnt>1)
-
-        if np.any(ecnt > 1):
-            jflags.append(flagval)
-
-    Un = U[:, incepoch]
-    eatn = eat[incepoch]
-
-    if calci:
-        Ui = ((1.0/np.sum(Un, axis=0)) * Un).T
-        rv = (Un, Ui, eatn, jflags)
-    else:
-        rv = (Un, eatn, jflags)
+    ecnt = quant_flagcounts(inds, flags, uflagvals)
+    incepoch = np.any(ecnt > 1, axis=1)
+    jflags = [flagval for ii, flagval in enumerate(uflagvals)
+              if np.any(ecnt[:, ii] > 1)]
 
-    return rv
+    return inds[incepoch], eat[incepoch], jflags
 
 def dailyAve(times, res, err, ecorr, dt=1, flags=None):
     """
@@ -846,6 +833,196 @@ def solve_coupled_ecc_solution(F0, e0, gamma0, phase0, mc, q, t):
     return ret
 
 
+def cubic_hermite(x, y, dydx, xnew):
+
+    """
+    Piecewise-cubic Hermite interpolation through tabulated
+    values and derivatives.
+
+    :param x: Increasing abscissae, shape (n,)
+    :param y: Tabulated values, shape (n,) or (n, m)
+    :param dydx: Tabulated derivatives, same shape as y
+    :param xnew: Points at which to interpolate
+
+    :returns: Interpolated values, shape (len(xnew),) + y.shape[1:]
+
+    """
+
+    xnew = np.atleast_1d(xnew)
+    kk = np.clip(np.searchsorted(x, xnew) - 1, 0, len(x)-2)
+
+    h = x[kk+1] - x[kk]
+    s = (xnew - x[kk]) / h
+    s2 = s*s
+    s3 = s2*s
+
+    shape = (-1,) + (1,)*(y.ndim-1)
+    h00 = (2*s3 - 3*s2 + 1).reshape(shape)
+    h10 = ((s3 - 2*s2 + s) * h).reshape(shape)
+    h01 = (3*s2 - 2*s3).reshape(shape)
+    h11 = ((s3 - s2) * h).reshape(shape)
+
+    return h00*y[kk] + h10*dydx[kk] + h01*y[kk+1] + h11*dydx[kk+1]
+
+
+class OrbitalEvolution(object):
+
+    """
+    Cached solutions of the Peters (1964) / Barack & Cutler (2004)
+    equations for the pulsar-term orbital parameters.
+
+    dF/dt and de/dt do not depend on gamma or the orbital phase, so
+    gamma(t) - gamma0 and l(t) - l0 depend only on (F0, e0, mc, q).
+    For each such set the system is integrated once on a grid covering
+    all requested lookback times (padded by a fractional margin, so
+    that small changes in pulsar distance stay inside it), and F, e,
+    gamma and l are interpolated at arbitrary times with cubic Hermite
+    polynomials built from the equations' own derivatives.
+
+    """
+
+    def __init__(self, ngrid=128, margin=0.1, maxcache=16):
+
+        """
+        :param ngrid: Number of grid points on each side of t=0
+        :param margin: Fractional padding of a newly integrated range
+        :param maxcache: Number of parameter sets kept in the cache
+
+        """
+
+        self.ngrid = ngrid
+        self.margin = margin
+        self.maxcache = maxcache
+        self._cache = OrderedDict()
+
+    def _solve(self, F0, e0, mc, q, tend, tnodes, constecc):
+
+        """
+        Integrate from t=0 to tend, with zero initial gamma and phase.
+        The grid is clustered towards t=0, where the orbit evolves
+        fastest, and includes the times tnodes.
+
+        :returns: (t, y, dy/dt) with t running from 0 to tend and
+            columns [F, e, gamma, phase], or None on failure (which
+            includes a solution running into e -> 1)
+
+        """
+
+        tt = np.sign(tend) * np.union1d(np.abs(tend) *
+                                        np.linspace(0.0, 1.0, self.ngrid)**2,
+                                        np.abs(tnodes))
+
+        if constecc:
+            y = solve_coupled_constecc_solution(F0, e0, 0.0, mc, tt)
+            if not np.any(y) or not np.all(np.isfinite(y)):
+                return None
+            F, phase = y.T
+            e = np.ones(len(tt))*e0
+            gamma = np.zeros(len(tt))
+            dy = np.array([get_Fdot(F, mc, e0), np.zeros(len(tt)),
+                           np.zeros(len(tt)), 2*np.pi*F]).T
+            y = np.array([F, e, gamma, phase]).T
+        else:
+            y = solve_coupled_ecc_solution(F0, e0, 0.0, 0.0, mc, q, tt)
+            if not np.any(y) or not np.all(np.isfinite(y)):
+                return None
+            dy = get_coupled_ecc_eqns(y.T, tt, mc, q).T
+
+        return tt, y, dy
+
+    def _tabulate(self, F0, e0, mc, q, tlo, thi, tnodes, constecc):
+
+        """
+        Integrate over [tlo, thi], with tlo <= 0 <= thi, placing grid
+        points at the times tnodes.
+
+        :returns: (t, y, dy/dt) with increasing t, or None on failure
+
+        """
+
+        sides = [self._solve(F0, e0, mc, q, tend,
+                             tnodes[np.sign(tnodes) == np.sign(tend)],
+                             constecc)
+                 for tend in (tlo, thi) if tend != 0.0]
+        if len(sides) == 0 or None in sides:
+            return None
+
+        # stitch the backward and forward solutions together
+        if tlo < 0.0:
+            sides[0] = [arr[::-1] for arr in sides[0]]
+        if len(sides) == 2:
+            sides[1] = [arr[1:] for arr in sides[1]]
+
+        return tuple(np.concatenate(arrs) for arrs in zip(*sides))
+
+    def solution(self, F0, e0, mc, q, t, constecc=False):
+
+        """
+        Tabulated solution covering the times t, from the cache if
+        possible.
+
+        :returns: (t, y, dy/dt) with increasing t, or None if the
+            integration failed
+
+        """
+
+        key = (F0, e0, mc, None if constecc else q, constecc)
+        tlo, thi = min(t.min(), 0.0), max(t.max(), 0.0)
+
+        sol = self._cache.pop(key, None)
+        if sol is not None and (tlo < sol[0][0] or thi > sol[0][-1]):
+            tlo, thi = min(tlo, sol[0][0]), max(thi, sol[0][-1])
+            sol = None
+
+        if sol is None:
+            # the padded range may run into the e -> 1 singularity in
+            # the past, in which case fall back to the requested range
+            sol = self._tabulate(F0, e0, mc, q, (1+self.margin)*tlo,
+                                 (1+self.margin)*thi, t, constecc)
+            if sol is None and self.margin > 0.0:
+                sol = self._tabulate(F0, e0, mc, q, tlo, thi, t, constecc)
+            if sol is None:
+                return None
+
+        self._cache[key] = sol
+        while len(self._cache) > self.maxcache:
+            self._cache.popitem(last=False)
+
+        return sol
+
+    def __call__(self, F0, e0, gamma0, l0, mc, q, t, constecc=False):
+
+        """
+        Orbital parameters at times t.
+
+        :param F0: Orbital frequency at t=0 [Hz]
+        :param e0: Eccentricity at t=0
+        :param gamma0: Angle of precession of periastron at t=0 [rad]
+        :param l0: Orbital phase at t=0 [rad]
+        :param mc: Chirp mass of binary [Solar Mass]
+        :param q: Mass ratio of binary
+        :param t: Times at which to evaluate the solution [s]
+        :param constecc: Hold the eccentricity fixed at e0
+
+        :returns: (F(t), e(t), gamma(t), l(t)), or None if the
+            integration failed
+
+        """
+
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+
+        sol = self.solution(F0, e0, mc, q, t, constecc)
+        if sol is None:
+            return None
+
+        F, e, gamma, l = cubic_hermite(sol[0], sol[1], sol[2], t).T
+
+        return F, e, gamma + gamma0, l + l0
+
+
+orbital_evolution = OrbitalEvolution()
+
+
 def get_an(n, mc, dl, h0, F, e):
     
     """
@@ -938,12 +1115,68 @@ def get_cn(n, mc, dl, h0, F, e):
 
     return ret
 
-def calculate_splus_scross(nmax, mc, dl, h0, F, e, t, l0, gamma, gammadot, inc):
+def harmonic_sums(coeffs, phase, chunk=64):
+    """
+    Evaluate the harmonic series sum_n coeffs[n-1] sin(n*phase) and
+    sum_n coeffs[n-1] cos(n*phase), n = 1...len(coeffs), for every phase.
+
+    The harmonics are accumulated in chunks. Inside a chunk starting at
+    harmonic n0, sin/cos((n0+j)*phase) follow from angle-addition with a
+    fixed table of sin/cos(j*phase), so only an (nphase x chunk) table is
+    ever held in memory.
+
+    :param coeffs: Harmonic coefficients, shape (nharm,) or (nharm, ncoeff)
+    :param phase: Phases [rad], shape (nphase,)
+    :param chunk: Number of harmonics per chunk
+
+    :returns: sine and cosine sums, each of shape (nphase,) or (nphase, ncoeff)
+    """
+
+    coeffs = np.asarray(coeffs)
+    nharm = coeffs.shape[0]
+    chunk = max(min(chunk, nharm), 1)
+
+    # offsets j = 0...chunk-1 inside a chunk
+    jphase = np.outer(phase, np.arange(chunk))
+    sin_off = np.sin(jphase)
+    cos_off = np.cos(jphase)
+    del jphase
+
+    sinsum = np.zeros((len(phase),) + coeffs.shape[1:])
+    cossum = np.zeros((len(phase),) + coeffs.shape[1:])
+    for n0 in range(1, nharm+1, chunk):
+
+        cc = coeffs[n0-1:n0-1+chunk]
+        nc = len(cc)
+
+        sin_base = np.sin(n0*phase)
+        cos_base = np.cos(n0*phase)
+        if cc.ndim > 1:
+            sin_base = sin_base[:,None]
+            cos_base = cos_base[:,None]
+
+        co = np.dot(cos_off[:,:nc], cc)
+        so = np.dot(sin_off[:,:nc], cc)
+
+        # sin(a+b) = sin(a)cos(b) + cos(a)sin(b)
+        # cos(a+b) = cos(a)cos(b) - sin(a)sin(b)
+        sinsum += sin_base*co + cos_base*so
+        cossum += cos_base*co - sin_base*so
+
+    return sinsum, cossum
+
+
+def calculate_splus_scross(nmax, mc, dl, h0, F, e, t, l0, gamma, gammadot, inc,
+                           chunk=64):
     
     """
     Calculate splus and scross summed over all harmonics. 
     This waveform differs slightly from that in Taylor et al (2015) 
     in that it includes the time dependence of the advance of periastron.
+
+    The periastron terms, sin/cos(2*gamma(t)), do not depend on the
+    harmonic, so the sums reduce to three harmonic series in the mean
+    anomaly, which are evaluated by harmonic_sums.
     
     :param nmax: Total number of harmonics to use
     :param mc: Chirp mass of binary [Solar Mass]
@@ -955,6 +1188,7 @@ def calculate_splus_scross(nmax, mc, dl, h0, F, e, t, l0, gamma, gammadot, inc):
     :param gamma: Angle of periastron advance [rad]
     :param gammadot: Time derivative of angle of periastron advance [rad/s]
     :param inc: Inclination angle [rad]
+    :param chunk: Number of harmonics summed at a time
 
     """ 
     n = np.arange(1, nmax)
@@ -969,35 +1203,25 @@ def calculate_splus_scross(nmax, mc, dl, h0, F, e, t, l0, gamma, gammadot, inc):
     gt = gamma + gammadot * t
     lt = l0 + omega * t
 
-    # tiled phase
-    phase1 = n * np.tile(lt, (nmax-1,1)).T
-    phase2 = np.tile(gt, (nmax-1,1)).T
-
-    sinp1 = np.sin(phase1)
-    cosp1 = np.cos(phase1)
-    sinp2 = np.sin(2*phase2)
-    cosp2 = np.cos(2*phase2)
-
-    sinpp = sinp1*cosp2 + cosp1*sinp2
-    cospp = cosp1*cosp2 - sinp1*sinp2
-    sinpm = sinp1*cosp2 - cosp1*sinp2
-    cospm = cosp1*cosp2 + sinp1*sinp2
-
-    # intermediate terms
-    sp = sinpm/(n*omega-2*gammadot) + \
-      sinpp/(n*omega+2*gammadot)
-    sm = sinpm/(n*omega-2*gammadot) - \
-      sinpp/(n*omega+2*gammadot)
-    cp = cospm/(n*omega-2*gammadot) + \
-      cospp/(n*omega+2*gammadot)
-    cm = cospm/(n*omega-2*gammadot) - \
-      cospp/(n*omega+2*gammadot)
-    
-    splus_n = -0.5 * (1+np.cos(inc)**2) * (an*sp - bn*sm) + \
-            (1-np.cos(inc)**2)*cn * sinp1
-    scross_n = np.cos(inc) * (an*cm - bn*cp)
-        
-    return np.sum(splus_n, axis=1), np.sum(scross_n, axis=1)
+    # harmonic weights of the periastron-shifted phases
+    wm = 1.0/(n*omega-2*gammadot)
+    wp = 1.0/(n*omega+2*gammadot)
+    pn = an*(wm+wp) - bn*(wm-wp)
+    qn = an*(wp-wm) + bn*(wm+wp)
+
+    sinsum, cossum = harmonic_sums(np.array([pn, qn, cn]).T, lt, chunk=chunk)
+    psin = sinsum[:,0]
+    qcos = cossum[:,1]
+    csin = sinsum[:,2]
+
+    sin2g = np.sin(2*gt)
+    cos2g = np.cos(2*gt)
+
+    splus = -0.5 * (1+np.cos(inc)**2) * (cos2g*psin + sin2g*qcos) + \
+      (1-np.cos(inc)**2) * csin
+    scross = np.cos(inc) * (sin2g*psin - cos2g*qcos)
+
+    return splus, scross
 
 
 def fplus_fcross(psr, gwtheta, gwphi):
@@ -1034,6 +1258,122 @@ def fplus_fcross(psr, gwtheta, gwphi):
     return fplus, fcross
 
 
+def fplus_fcross_array(psrvec, gwtheta, gwphi):
+    """
+    Compute gravitational-wave quadrupolar antenna patterns
+    of all pulsars for several GW source positions at once.
+
+    :param psrvec: Unit vectors to the pulsars, shape (npsr, 3)
+    :param gwtheta: Polar angles of GW sources in celestial coords [radians]
+    :param gwphi: Azimuthal angles of GW sources in celestial coords [radians]
+
+    :returns: fplus, fcross, each of shape (nsrc, npsr)
+    """
+
+    gwtheta = np.atleast_1d(gwtheta)
+    gwphi = np.atleast_1d(gwphi)
+
+    # define variable for later use
+    cosgwtheta, cosgwphi = np.cos(gwtheta), np.cos(gwphi)
+    singwtheta, singwphi = np.sin(gwtheta), np.sin(gwphi)
+
+    # unit vectors to GW sources
+    m = np.array([singwphi, -cosgwphi, np.zeros_like(gwphi)]).T
+    n = np.array([-cosgwtheta*cosgwphi, -cosgwtheta*singwphi, singwtheta]).T
+    omhat = np.array([-singwtheta*cosgwphi, -singwtheta*singwphi, -cosgwtheta]).T
+
+    mp = np.dot(m, psrvec.T)
+    npr = np.dot(n, psrvec.T)
+    omp = np.dot(omhat, psrvec.T)
+
+    fplus = 0.5 * (mp**2 - npr**2) / (1 + omp)
+    fcross = (mp*npr) / (1 + omp)
+
+    return fplus, fcross
+
+
+def pointsrc_orf(psrvec, gwtheta, gwphi):
+    """
+    Overlap reduction functions of GW point-sources,
+    including the pulsar-term in the auto-correlations.
+
+    :param psrvec: Unit vectors to the pulsars, shape (npsr, 3)
+    :param gwtheta: Polar angles of GW sources in celestial coords [radians]
+    :param gwphi: Azimuthal angles of GW sources in celestial coords [radians]
+
+    :returns: ORFs, shape (nsrc, npsr, npsr)
+    """
+
+    Fp, Fc = fplus_fcross_array(psrvec, gwtheta, gwphi)
+
+    orf = (3.0/(8.0*np.pi)) * (Fp[:,:,None]*Fp[:,None,:] + Fc[:,:,None]*Fc[:,None,:])
+    # scaling for pulsar-term
+    diag = np.arange(psrvec.shape[0])
+    orf[:,diag,diag] *= 2.0
+
+    return orf
+
+
+def psr_separations(psrvec):
+    """
+    Angular separations of all pulsar pairs.
+
+    :param psrvec: Unit vectors to the pulsars, shape (npsr, 3)
+
+    :returns: Separations [radians], shape (npsr, npsr)
+    """
+
+    zeta = np.arccos(np.clip(np.dot(psrvec, psrvec.T), -1.0, 1.0))
+    np.fill_diagonal(zeta, 0.0)
+
+    return zeta
+
+
+def dipole_orf_kernel(zeta):
+    """
+    Angular part of the maximal-dipole overlap reduction function
+    of Anholm et al. (2009).
+
+    :param zeta: Angular separations of pulsar pairs [radians]
+
+    :returns: cos(zeta) - 4/3 - 4 tan^2(zeta/2) log(sin(zeta/2)),
+              where the last term vanishes at zeta = 0
+    """
+
+    zeta = np.asarray(zeta, dtype=float)
+    half = zeta/2.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logterm = np.where(zeta > 0.0,
+                           4.0*np.tan(half)**2.0*np.log(np.sin(half)),
+                           0.0)
+
+    return np.cos(zeta) - (4.0/3.0) - logterm
+
+
+def dipole_orf(psrvec, dipvec, kernel):
+    """
+    Maximal-dipole overlap reduction functions of Anholm et al. (2009)
+    for several dipole directions at once, including the pulsar-term
+    in the auto-correlations.
+
+    :param psrvec: Unit vectors to the pulsars, shape (npsr, 3)
+    :param dipvec: Unit vectors to the dipole directions, shape (ndip, 3)
+    :param kernel: Angular part from dipole_orf_kernel, shape (npsr, npsr)
+
+    :returns: ORFs, shape (ndip, npsr, npsr)
+    """
+
+    # dot products of psr and dipole position vectors
+    cpsr = np.dot(dipvec, psrvec.T)
+
+    orf = (3.0/8.0) * (cpsr[:,:,None] + cpsr[:,None,:]) * kernel
+    # scaling for pulsar-term
+    diag = np.arange(psrvec.shape[0])
+    orf[:,diag,diag] *= 2.0
+
+    return orf
+
+
 def ecc_cgw_signal(psr, gwtheta, gwphi, mc, dist, h0, F, inc, psi, gamma0,
                    e0, l0, q, nmax=100, nset=None, pd=None, gpx=None, lpx=None,
                    periEv=True, psrTerm=False, tref=0, check=False, useFile=True,
@@ -1219,6 +1559,165 @@ def ecc_cgw_signal(psr, gwtheta, gwphi, mc, dist, h0, F, inc, psi, gamma0,
     return rr
 
 
+
+def get_nharm(e, nmax, useFile=True):
+    """
+    Number of harmonics needed to describe the waveform of a binary
+    with eccentricity e.
+
+    :param e: Orbital eccentricity
+    :param nmax: Maximum number of harmonics
+    :param useFile: Use pre-computed table of number of harmonics vs eccentricity
+
+    :returns: Number of harmonics
+    """
+
+    if useFile:
+        if e > 0.001 and e < 0.999:
+            return min(int(ecc_interp(e)), nmax) + 1
+        elif e <= 0.001:
+            return 3
+        else:
+            return nmax
+    else:
+        return nmax
+
+
+def ecc_cgw_array_signal(psrs, gwtheta, gwphi, mc, dist, h0, F, inc, psi, gamma0,
+                         e0, l0, q, nmax=100, nset=None, pd=None, gpx=None, lpx=None,
+                         periEv=True, psrTerm=False, tref=0, useFile=True,
+                         epochTOAs=False, noEccEvolve=False):
+    """
+    Simulate GW from eccentric SMBHB in all pulsars of an array at once.
+    Same waveform model as ecc_cgw_signal, but the source geometry and the
+    harmonic amplitudes are computed once, and the Earth term is
+    evaluated on the concatenated TOAs of all pulsars.
+
+    :param psrs: list of pulsar objects
+    :param pd: Pulsar distances [kpc], one per pulsar (or None)
+    :param gpx: Pulsar-term gamma0 [radians], one per pulsar (or None)
+    :param lpx: Pulsar-term l0 [radians], one per pulsar (or None)
+
+    All other parameters are as in ecc_cgw_signal.
+
+    :returns: List of induced residuals, one vector per pulsar (zeros for
+        a pulsar whose pulsar-term orbit could not be integrated)
+    """
+
+    npsr = len(psrs)
+    if pd is None:
+        pd = [None]*npsr
+    if gpx is None:
+        gpx = [None]*npsr
+    if lpx is None:
+        lpx = [None]*npsr
+
+    sin2psi, cos2psi = np.sin(2*psi), np.cos(2*psi)
+
+    # antenna patterns of all pulsars
+    ptheta = np.array([np.pi/2 - p.psr_locs[1] for p in psrs])
+    pphi = np.array([p.psr_locs[0] for p in psrs])
+    psrvec = np.array([np.sin(ptheta)*np.cos(pphi), np.sin(ptheta)*np.sin(pphi),
+                       np.cos(ptheta)]).T
+
+    fplus, fcross = fplus_fcross_array(psrvec, gwtheta, gwphi)
+    fplus, fcross = fplus[0], fcross[0]
+    omhat = np.array([-np.sin(gwtheta)*np.cos(gwphi),
+                      -np.sin(gwtheta)*np.sin(gwphi), -np.cos(gwtheta)])
+    cosMu = -np.dot(psrvec, omhat)
+
+    # polarisation-rotated antenna patterns
+    ant_plus = fplus*cos2psi - fcross*sin2psi
+    ant_cross = fplus*sin2psi + fcross*cos2psi
+
+    # concatenated TOAs
+    if epochTOAs:
+        toas = [(p.detsig_avetoas - tref)*86400.0 for p in psrs]
+    else:
+        toas = [(p.toas - tref)*86400.0 for p in psrs]
+    splits = np.cumsum([len(tt) for tt in toas])[:-1]
+
+    # get gammadot for earth term
+    if not periEv:
+        gammadot = 0.0
+    else:
+        gammadot = get_gammadot(F, mc, q, e0)
+
+    if nset is not None:
+        nharm = nset
+    else:
+        nharm = get_nharm(e0, nmax, useFile)
+
+    ##### earth term #####
+    splus, scross = calculate_splus_scross(nharm, mc, dist, h0, F, e0,
+                                           np.concatenate(toas), l0, gamma0,
+                                           gammadot, inc)
+    splus = np.split(splus, splits)
+    scross = np.split(scross, splits)
+
+    if not psrTerm:
+        return [- ant_plus[ii] * splus[ii] - ant_cross[ii] * scross[ii]
+                for ii in range(npsr)]
+
+    ##### pulsar term #####
+
+    # earliest retarded time of each pulsar
+    tpmin = np.zeros(npsr)
+    for ii,p in enumerate(psrs):
+
+        # convert units
+        pdist = pd[ii]
+        if pdist is None:
+            pdist = p.h5Obj['pdist'].value
+        pdist *= KPC2S   # convert from kpc to seconds
+
+        tpmin[ii] = toas[ii].min() - pdist * (1-cosMu[ii])
+
+    # evolve the orbit back to every pulsar term in one go
+    orbit = orbital_evolution(F, e0, gamma0, l0, mc, q, tpmin,
+                              constecc=noEccEvolve)
+    if orbit is None:
+        # one failed pulsar term fails the joint integration, so retry
+        # pulsar by pulsar (nearest first, so that the cached solution
+        # grows) and, as in ecc_cgw_signal, zero only the failed ones
+        orbit = np.nan * np.ones((4,npsr))
+        for ii in np.argsort(np.abs(tpmin)):
+            orbit_psr = orbital_evolution(F, e0, gamma0, l0, mc, q, tpmin[ii],
+                                          constecc=noEccEvolve)
+            if orbit_psr is not None:
+                orbit[:,ii] = [par[0] for par in orbit_psr]
+
+    rr = []
+    for ii,p in enumerate(psrs):
+
+        if np.isnan(orbit[0][ii]):
+            rr.append(np.zeros(len(toas[ii])))
+            continue
+
+        # get pulsar term values
+        Fp, ep, gp, lp = [par[ii] for par in orbit]
+
+        # get gammadot at pulsar term
+        if not periEv:
+            gammadotp = 0.0
+        else:
+            gammadotp = get_gammadot(Fp, mc, q, ep)
+
+        if gpx[ii] is not None:
+            gp = gpx[ii]
+        if lpx[ii] is not None:
+            lp = lpx[ii]
+
+        splusp, scrossp = calculate_splus_scross(get_nharm(ep, nmax, useFile),
+                                                 mc, dist, h0, Fp, ep,
+                                                 toas[ii], lp, gp,
+                                                 gammadotp, inc)
+
+        rr.append(ant_plus[ii] * (splusp - splus[ii]) +
+                  ant_cross[ii] * (scrossp - scross[ii]))
+
+    return rr
+
 def BWMantennaPattern(rajp, decjp, raj, decj, pol):
     """Return the antenna pattern for a given source position and
     pulsar position
@@ -1250,7 +1749,7 @@ def BWMantennaPattern(rajp, decjp, raj, decj, pol):
     return np.cos(2*pol)*Fp + np.sin(2*pol)*Fc
 
 
-def bwmsignal(parameters, psr, antennaPattern='quad'):
+def bwmsignal(parameters, psr, antennaPattern='quad', epochTOAs=False):
     """
     Function that calculates the earth-term gravitational-wave burst-with-memory
     signal, as described in:
@@ -1265,9 +1764,14 @@ def bwmsignal(parameters, psr, antennaPattern='quad'):
     parameter[4] = polarisation angle (rad) [0, pi]
     raj = Right Ascension of the pulsar (rad)
     decj = Declination of the pulsar (rad)
-    t = timestamps where the waveform should be returned
+    epochTOAs = evaluate on the epoch-averaged TOAs (psr.detsig_avetoas)
     returns the waveform as induced timing residuals (seconds)
     """
+
+    if epochTOAs:
+        toas = psr.detsig_avetoas
+    else:
+        toas = psr.toas
     
     gwphi = np.array([parameters[2]])
     gwdec = np.array([np.pi/2-np.arccos(parameters[3])])
@@ -1286,8 +1790,8 @@ def bwmsignal(parameters, psr, antennaPattern='quad'):
     heaviside = lambda x: 0.5 * (np.sign(x) + 1)
 
     # Return the time-series for the pulsar
-    bwm = pol * (10**parameters[1]) * heaviside(psr.toas - parameters[0]) * \
-            (psr.toas - parameters[0]) * 86400
+    bwm = pol * (10**parameters[1]) * heaviside(toas - parameters[0]) * \
+            (toas - parameters[0]) * 86400
 
     return bwm
 
@@ -1362,26 +1866,34 @@ def real_sph_harm(ll, mm, phi, theta):
     return ans.real
 
 
-def SetupPriorSkyGrid(lmax):
+def SetupPriorSkyGrid(lmax, ngrid_phi=40, ngrid_costheta=40, nside=None):
     """
-    Check whether these anisotropy coefficients correspond to a physical
-    angular-distribution of the metric-perturbation quadratic
-    expectation-value.
+    Evaluate the real spherical harmonics up to lmax on the sky-grid
+    used to test the physicality of anisotropy coefficients.
+
+    :param lmax: Maximum multipole
+    :param ngrid_phi: Number of grid points in azimuth
+    :param ngrid_costheta: Number of grid points in cos(polar angle)
+    :param nside: If given, use the pixel centres of a HEALPix map with
+                  this nside instead of the (phi, cos(theta)) grid
+
+    :returns: Dense (npix, (lmax+1)**2) matrix of harmonics, ordered
+              like the clm vector
     
     """
-    
-    ngrid_phi = 40
-    ngrid_costheta = 40
-    
-    phi = np.arange(0.0,2.0*np.pi,2.0*np.pi/ngrid_phi)
-    theta = np.arccos(np.arange(-1.0,1.0,2.0/ngrid_costheta))
 
-    xx, yy = np.meshgrid(phi,theta)
+    if nside is not None:
+        import healpy as hp
+        theta, phi = hp.pix2ang(nside, np.arange(hp.nside2npix(nside)))
+    else:
+        phi = np.arange(0.0,2.0*np.pi,2.0*np.pi/ngrid_phi)
+        theta = np.arccos(np.arange(-1.0,1.0,2.0/ngrid_costheta))
+        phi, theta = [grid.ravel() for grid in np.meshgrid(phi,theta)]
 
-    harm_sky_vals = [[0.0]*(2*ll+1) for ll in range(lmax+1)]
-    for ll in range(len(harm_sky_vals)):
-        for mm in range(len(harm_sky_vals[ll])):
-            harm_sky_vals[ll][mm] = real_sph_harm(ll,mm-ll,xx,yy)
+    harm_sky_vals = np.zeros((len(phi), (lmax+1)**2))
+    for ll in range(lmax+1):
+        for mm in range(-ll,ll+1):
+            harm_sky_vals[:,ll**2 + ll + mm] = real_sph_harm(ll,mm,phi,theta)
 
     return harm_sky_vals
 
@@ -1390,15 +1902,19 @@ def PhysPrior(clm,harm_sky_vals):
     Check whether these anisotropy coefficients correspond to a physical
     angular-distribution of the metric-perturbation quadratic
     expectation-value.
+
+    :param clm: Anisotropy coefficients, (nclm,) or one row per
+                frequency window (nwins, nclm)
+    :param harm_sky_vals: Harmonics on the sky-grid, from SetupPriorSkyGrid
+
+    :returns: 'Physical' if the power is non-negative everywhere on the
+              grid (in every window), 'Unphysical' otherwise
     
     """
 
-    Pdist=0.
-    for ll in range(len(harm_sky_vals)):
-        for mm in range(len(harm_sky_vals[ll])):
-            Pdist += clm[ ll**2 + mm ] * harm_sky_vals[ll][mm]
+    Pdist = np.dot(harm_sky_vals, np.asarray(clm).T)
 
-    if np.any(Pdist<0.)==True:
+    if Pdist.min() < 0.:
         return 'Unphysical'
     else:
         return 'Physical'